@@ -16,15 +16,19 @@ Features:
 
 import streamlit as st
 import pandas as pd
+from pandas.api.types import union_categoricals
 import numpy as np
 from datetime import date, datetime, timedelta
 import json
 import os
-from sklearn.linear_model import LinearRegression
 import plotly.express as px
 import time
 from auth import login, signup, logout
-from auth import _load_users, reset_password
+from auth import get_user, reset_password
+import storage
+import analytics
+import classifier
+import importer
 
 # --- FORCE LOGOUT IF SESSION HALF-LOADED ---
 if "logged_in_user" in st.session_state and \
@@ -35,16 +39,19 @@ if "logged_in_user" in st.session_state and \
 st.set_page_config(page_title="AI PERSONAL EXPENSE ADVISOR", layout="wide")
 
  # ------------------------- File paths helper (per-user) -------------------------
-def get_user_files():
+def current_username():
     if "logged_in_user" not in st.session_state:
-        return ("expenses_default.csv", "incomes_default.csv", "category_memory_default.json")
+        return "default"
+    return st.session_state.logged_in_user["username"]
+
 
-    u = st.session_state.logged_in_user["username"]
-    u = u.strip().replace(" ", "_")   # safe filename
+# CSV / JSON files are the import / export format for every storage backend
+def get_user_files():
+    u = current_username()
     return (
-        f"expenses_{u}.csv",
-        f"incomes_{u}.csv",
-        f"category_memory_{u}.json"
+        storage.ledger_path(u, "expenses"),
+        storage.ledger_path(u, "incomes"),
+        storage.ledger_path(u, "memory")
     )
 
 
@@ -53,42 +60,156 @@ def rerun_after_action(seconds: float = 0.8):
     time.sleep(seconds)
     st.rerun()
 
-# ------------------------- CSV & MEMORY HELPERS -------------------------
-def load_csv_safe(path, expected_cols):
-    if os.path.exists(path):
-        try:
-            df = pd.read_csv(path)
-            for c in expected_cols:
-                if c not in df.columns:
-                    df[c] = ""
-            if "date" in df.columns:
-                df["date"] = pd.to_datetime(df["date"], errors="coerce")
-            return df
-        except:
-            return pd.DataFrame(columns=expected_cols)
-    return pd.DataFrame(columns=expected_cols)
-
-
-def save_csv_safe(df, path):
-    df2 = df.copy()
-    if "date" in df2.columns:
-        df2["date"] = pd.to_datetime(df2["date"], errors="coerce").dt.strftime("%Y-%m-%d")
-    df2.to_csv(path, index=False)
-
+# ------------------------- LEDGER & MEMORY HELPERS -------------------------
+# backend (csv / journal / sqlite / arrow) is picked by EXPENSE_STORAGE_MODE, see storage.py.
+# Frames come from a process-wide cache shared by all sessions: never edit them in place.
+STORE = storage.get_store()
 
-def load_memory(path):
-    if os.path.exists(path):
+def load_ledger(ledger):
+    if ledger == "memory":
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return STORE.load(current_username(), "memory")
         except:
             return {}
-    return {}
+    try:
+        # the cached frame as is: already normalized once, shared with every other session
+        return STORE.load(current_username(), ledger)
+    except:
+        return pd.DataFrame(columns=storage.LEDGER_COLUMNS[ledger])
+
+
+def save_ledger(ledger, data):
+    STORE.save(current_username(), ledger, data)
+
+
+# ------------------------- change tracking -------------------------
+LEDGERS = ("expenses", "incomes", "memory")
+
+def reset_ledger_versions():
+    # called right after the ledgers are (re)loaded from disk: nothing is dirty
+    st.session_state.ledger_versions = {k: 0 for k in LEDGERS}
+    st.session_state.saved_versions = {k: 0 for k in LEDGERS}
+    # rollups already in the session were built for these frames (login load)
+    for r in st.session_state.get("rollups", {}).values():
+        r.version = 0
+
+
+def log_change(ledger, **record):
+    # every add / update / delete / set goes through here so the ledger is marked dirty
+    if "ledger_versions" not in st.session_state:
+        reset_ledger_versions()
+    version = st.session_state.ledger_versions[ledger]
+    st.session_state.ledger_versions[ledger] = version + 1
+    # the row helpers keep the rollups in step with each change: they move with the version
+    r = st.session_state.get("rollups", {}).get(ledger)
+    if r is not None and r.version == version:
+        r.version = version + 1
+
+    # journal / sqlite: persist just this mutation instead of rewriting the whole ledger
+    if STORE.apply(current_username(), ledger, record):
+        st.session_state.saved_versions[ledger] = st.session_state.ledger_versions[ledger]
+
+
+# ------------------------- rollups + row helpers -------------------------
+# running daily / monthly / per-label totals, so pages never re-group the full history
+ROLLUP_LABELS = analytics.ROLLUP_LABELS
+
+def get_rollups(ledger):
+    if "rollups" not in st.session_state:
+        st.session_state.rollups = {}
+    if "ledger_versions" not in st.session_state:
+        reset_ledger_versions()
+    version = st.session_state.ledger_versions[ledger]
+    r = st.session_state.rollups.get(ledger)
+    # rebuilt only when missing or built for another version of the ledger
+    if r is None or r.version != version:
+        r = analytics.Rollups.from_frame(st.session_state[ledger], ROLLUP_LABELS[ledger])
+        r.version = version
+        st.session_state.rollups[ledger] = r
+    return r
+
+
+def set_ledger(ledger, df, rollups=None):
+    # whole frame replaced (login / reload): rollups are rebuilt on next use
+    # unless already built for this frame (login load)
+    st.session_state[ledger] = df
+    if ledger in ROLLUP_LABELS:
+        if "rollups" not in st.session_state:
+            st.session_state.rollups = {}
+        if rollups is not None:
+            rollups.version = st.session_state.get("ledger_versions", {}).get(ledger)
+            st.session_state.rollups[ledger] = rollups
+        else:
+            st.session_state.rollups.pop(ledger, None)
+
+
+def update_rows(ledger, idx, fields):
+    # the loaded frame may be the shared cached one: a shallow copy is enough under
+    # pandas copy-on-write, only the columns written below get their own buffers
+    df = st.session_state[ledger].copy(deep=False)
+    pos = df.index.get_loc(idx)
+    rollups = get_rollups(ledger) if ledger in ROLLUP_LABELS else None
+    if rollups:
+        rollups.remove_frame(df.iloc[[pos]])
+    for col, val in fields.items():
+        storage.set_values(df, pos, col, val)   # adds new categories if needed
+    if rollups:
+        rollups.add_frame(df.iloc[[pos]])
+    st.session_state[ledger] = df
+
+
+def append_rows(ledger, new_rows):
+    # keep the compact schema (categoricals, normalized dates): only the new rows are normalized,
+    # the existing ones are concatenated as they are
+    rollups = get_rollups(ledger)
+    old = st.session_state[ledger]
+    new_rows = storage.normalize_frame(new_rows.copy(), ledger)
+    if old.empty:
+        df = new_rows.reset_index(drop=True)
+    else:
+        df = pd.concat([old, new_rows], ignore_index=True)
+        for c in storage.DICT_COLUMNS:
+            if c in old.columns and isinstance(old[c].dtype, pd.CategoricalDtype):
+                # concat of categoricals with different categories falls back to object
+                df[c] = union_categoricals([old[c], new_rows[c]], ignore_order=True)
+    st.session_state[ledger] = df
+    rollups.add_frame(new_rows)
+
+
+def row_ids(ledger, positions):
+    # sqlite frames carry each row's rowid: journal records name the rows by it,
+    # so an edit from a stale tab still lands on the row that tab shows
+    df = st.session_state[ledger]
+    if storage.ROW_ID not in df.columns:
+        return {}
+    rids = df[storage.ROW_ID].iloc[positions]
+    if rids.isna().any():
+        return {}
+    return {"rids": rids.astype("int64").tolist()}
+
+
+def delete_rows(ledger, labels):
+    rollups = get_rollups(ledger)
+    df = st.session_state[ledger]
+    rollups.remove_frame(df.loc[labels])
+    st.session_state[ledger] = df.drop(labels).reset_index(drop=True)
+
+
+TABLE_PAGE_ROWS = 500
+
+def table_page(ledger, key, columns):
+    # the record tables show one page of the ledger: only that slice is copied and its dates
+    # formatted, instead of the whole frame on every rerun. 'row' is the ledger-wide position.
+    df = st.session_state[ledger]
+    pages = max(1, -(-len(df) // TABLE_PAGE_ROWS))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key) if pages > 1 else 1
+    start = (page - 1) * TABLE_PAGE_ROWS
+    view = df.iloc[start:start + TABLE_PAGE_ROWS][columns]
+    view.insert(0, "row", np.arange(start, start + len(view)))
+    view["date"] = pd.to_datetime(view["date"], errors="coerce").dt.strftime("%Y-%m-%d")
+    return view
 
 
-def save_memory(mem, path):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(mem, f, indent=2)
 # ------------------ FORGOT PASSWORD SECTION ------------------
 if st.session_state.get("forgot_mode", False):
 
@@ -97,12 +218,12 @@ if st.session_state.get("forgot_mode", False):
     uname = st.text_input("Enter your username")
 
     if st.button("Get Security Question"):
-        users = _load_users()
-        if uname not in users:
+        user = get_user(uname)
+        if user is None:
             st.error("User does not exist ❌")
         else:
             st.session_state["fp_username"] = uname
-            st.session_state["fp_question"] = users[uname]["security_question"]
+            st.session_state["fp_question"] = user["security_question"]
             st.rerun()
 
     if "fp_question" in st.session_state:
@@ -241,22 +362,25 @@ if "logged_in_user" not in st.session_state:
             user = login(username, password)
             if user:
                 st.session_state.logged_in_user = user
-                
-                exp_file, inc_file, mem_file = get_user_files()
-
-                if not os.path.exists(exp_file):
-                    pd.DataFrame(columns=['date','amount','description','category']).to_csv(exp_file, index=False)
 
-                if not os.path.exists(inc_file):
-                    pd.DataFrame(columns=['date','amount','source','id']).to_csv(inc_file, index=False)
-
-                if not os.path.exists(mem_file):
-                    with open(mem_file, "w") as f:
-                        json.dump({}, f)
-
-                st.session_state.expenses = load_csv_safe(exp_file, ['date','amount','description','category'])
-                st.session_state.incomes  = load_csv_safe(inc_file, ['date','amount','source','id'])
-                st.session_state.memory   = load_memory(mem_file)
+                # nothing of the user's is loaded before the password checks out
+                try:
+                    session = analytics.take_session(STORE, user["username"])
+                    set_ledger("expenses", session["expenses"], session["rollups"]["expenses"])
+                    set_ledger("incomes", session["incomes"], session["rollups"]["incomes"])
+                    st.session_state.memory = session["memory"]
+                except storage.StaleLedgerError as e:
+                    # files from another storage mode are newer: don't pick a side silently
+                    del st.session_state.logged_in_user
+                    st.error(f"⚠️ {e}")
+                    st.stop()
+                except:
+                    # create empty ledgers (or import existing CSVs) on first login
+                    STORE.ensure_user(user["username"])
+                    set_ledger("expenses", load_ledger("expenses"))
+                    set_ledger("incomes", load_ledger("incomes"))
+                    st.session_state.memory   = load_ledger("memory")
+                reset_ledger_versions()
                 st.success("Login successful! Redirecting....")
                 st.rerun()
             else:
@@ -439,105 +563,175 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ------------------------- Persistence helpers -------------------------
+# file-level helpers kept for scripts / older callers: thin wrappers over storage,
+# so loading always replays snapshot + journal (the app itself goes through STORE)
 def load_csv_safe(path, expected_cols):
-    if os.path.exists(path):
-        try:
-            df = pd.read_csv(path)
-            for c in expected_cols:
-                if c not in df.columns:
-                    df[c] = ""
-            if "date" in df.columns:
-                df["date"] = pd.to_datetime(df["date"], errors="coerce")
-            return df
-        except:
-            return pd.DataFrame(columns=expected_cols)
-    return pd.DataFrame(columns=expected_cols)
+    try:
+        df = storage.load_frame(path)
+    except:
+        return pd.DataFrame(columns=expected_cols)
+    for c in expected_cols:
+        if c not in df.columns:
+            df[c] = ""
+    if "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    return df
 
 def save_csv_safe(df, path):
-    df2 = df.copy()
-    if "date" in df2.columns:
-        df2["date"] = pd.to_datetime(df2["date"], errors="coerce").dt.strftime("%Y-%m-%d")
-    df2.to_csv(path, index=False)
+    storage.save_frame(df, path)
 
 def load_memory(path):
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+    try:
+        return storage.load_memory(path)
+    except:
+        return {}
 
 def save_memory(mem, path):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(mem, f, indent=2)
-
-
-# ------------------------- Keyword mapping for auto-category -------------------------
-KEYWORD_MAP = {
-    'Food': [
-        'zomato','swiggy','blinkit','bigbasket','grocery','groceries','restaurant','dominos','ubereats','pizza','mcdonalds','kfc','starbucks','subway','foodpanda','instacart','talabat','grubhub','burger king','food'
-    ],
-    'Shopping': [
-        'amazon','fashion','flipkart','myntra','ajio','ebay','walmart','mall','order','purchase','shopping','asos','zalando','target','costco','shopee','lazada','alibaba','mercado libre','tata cliq'
-    ],
-    'Bills': [
-        'recharge','bill','electricity','internet','mobile','rent','water','bills','jio','idea','airtel','vodafone','telefonica','verizon','comcast','spectrum','utility','utilities','tv','wifi','gas','lpg','cng'
-    ],
-    'Travel': [
-        'uber','ola','taxi','bus','flight','train','petrol','fuel','diesel','make my trip','rapido','booking.com','kayak','skyscanner','airbnb','expedia','tripadvisor','holiday','vacation','ethiia','qatarairways','delta','metro','travel'
-    ],
-    'Entertainment': [
-        'netflix','hotstar','prime','movie','spotify','hulu','disney+','sony','music','concert','event','streaming','playstation','xbox','steam','minecraft','tiktok','jio hotstar','entertainment'
-    ],
-    'Health': [
-        'doctor','clinic','hospital','medicine','pharmacy','ayushman card','wellness','fitness','gym','medicare','healthcare','dentist','optical','surgery','allergy','health','accident','operation'
-    ],
-    'Education': [
-        'course','udemy','coursera','school','college','book','tuition','khanacademy','skillshare','linkedin learning','academic','edu','scholarship','canvas','physics wallah','apna college','unacademy','exam fees','certificates','byjus','allen','education'
-    ],
-    'Groceries': [
-        'groceries','grocery','bigbasket','dmart','aldi','tesco','walmart','wholefoods','aldi','carrefour','supermarket','costco','lidl'
-    ],
-    'Transport': [
-        'metro','bus','auto','cab','railway','uber','ola','taxi','lyft','tram','subway','ticket','commute','transportation','vehicle','transit'
-    ],
-    'Shop': [
-	'shop'],
-    'Others': [
-        'miscellaneous','other','unknown','charity','gift','donation','subscription','club','membership','fee','tax','fine'
-    ]
-}
+    storage.save_memory(mem, path)
 
 
 # ------------------------- Auto category function -------------------------
+# the merchant keywords (merchants.json) and the matching rules live in analytics.py (headless, benchmarked)
+def category_memo():
+    # per-user LRU of description -> category, reset when another user logs in
+    memo = st.session_state.get("category_memo")
+    if memo is None or st.session_state.get("category_memo_user") != current_username():
+        memo = analytics.CategoryMemo()
+        st.session_state.category_memo = memo
+        st.session_state.category_memo_user = current_username()
+    return memo
+
+
+def category_model():
+    # per-user classifier for descriptions the keywords don't know; loaded (or trained) once per
+    # session on a background thread: None until it is ready (memory + keywords still apply)
+    if st.session_state.get("category_model_user") != current_username():
+        st.session_state.category_model = None
+        st.session_state.category_model_user = current_username()
+        st.session_state.category_model_future = classifier.load_or_train_async(
+            current_username(), st.session_state.expenses, st.session_state.memory, analytics.keyword_map())
+    fut = st.session_state.get("category_model_future")
+    if fut is not None and fut.done():
+        st.session_state.category_model_future = None
+        try:
+            st.session_state.category_model = fut.result()
+        except:
+            pass   # keep the model we had (if any)
+    model = st.session_state.category_model
+    if model is not None and st.session_state.category_model_future is None \
+            and classifier.is_stale(model, st.session_state.expenses):
+        # the history outgrew the model (imports, or a model saved long ago): retrain, the old one serves meanwhile
+        st.session_state.category_model_future = classifier.retrain_async(
+            current_username(), st.session_state.expenses, st.session_state.memory, analytics.keyword_map())
+    return model
+
+
 def auto_category(description: str) -> str:
-    if not isinstance(description, str) or description.strip() == "":
-        return "Others"
-    text = description.lower()
-    # direct memory exact match first
-    mem = st.session_state.memory
-    if text in mem:
-        return mem[text]
-    # keyword scanning
-    for cat, kws in KEYWORD_MAP.items():
-        for kw in kws:
-            if kw in text:
-                return cat
-    return "Others"
+    return category_memo().category(description, st.session_state.memory, category_model())
 
-# ------------------------- persist helper -------------------------
-# ------------------------- persist helper -------------------------
-def persist_all():
-    # GET USER-SPECIFIC FILES
-    exp_file, inc_file, mem_file = get_user_files()
 
-    # SAVE DATA SEPARATELY FOR EACH USER
-    save_csv_safe(st.session_state.expenses, exp_file)
-    save_csv_safe(st.session_state.incomes, inc_file)
+def teach_memory(desc_key, new_cat):
+    # "teach the app": remember the mapping, update the classifier and drop memoized categories
+    analytics.remember(st.session_state.memory, desc_key, new_cat)
+    log_change("memory", op="set", key=desc_key, value=new_cat)
+    model = category_model()
+    if model is not None:
+        try:
+            if model.learn([desc_key], [new_cat]):
+                classifier.save_later(model, classifier.model_path(current_username()))
+            elif st.session_state.get("category_model_future") is None:
+                # a brand-new category: the label set is fixed, so retrain (the old model serves meanwhile)
+                st.session_state.category_model_future = classifier.retrain_async(
+                    current_username(), st.session_state.expenses, st.session_state.memory, analytics.keyword_map())
+        except:
+            pass
+    category_memo().invalidate()
+
+
+def description_index():
+    # description -> expense row positions; rebuilt only after rows are added, deleted or re-described
+    index = st.session_state.get("description_index")
+    if index is None or index.frame is not st.session_state.expenses:
+        index = analytics.DescriptionIndex(st.session_state.expenses)
+        st.session_state.description_index = index
+    return index
+
+
+def ledger_version(ledger):
+    if "ledger_versions" not in st.session_state:
+        reset_ledger_versions()
+    return st.session_state.ledger_versions[ledger]
+
+
+def dedup_index():
+    # hashes of (date, amount, description) already in the ledger, persisted next to it
+    # (with the store version it was saved for); rebuilt when out of step with the session's ledger
+    index = st.session_state.get("dedup_index")
+    if index is None or st.session_state.get("dedup_index_user") != current_username() \
+            or index.version != ledger_version("expenses"):
+        index = importer.DedupIndex.load(importer.dedup_path(current_username()), st.session_state.expenses,
+                                         STORE.version(current_username(), "expenses"))
+        index.version = ledger_version("expenses")
+        st.session_state.dedup_index = index
+        st.session_state.dedup_index_user = current_username()
+    return index
+
+
+def dedup_update(before, added=None, removed=None):
+    # keep the session's dedup index in step with an expense add / delete made at version `before`
+    index = st.session_state.get("dedup_index")
+    if index is None or index.version != before:
+        return   # not built, or already out of step: rebuilt on next use
+    if added is not None:
+        index.add(importer.row_hashes(added))
+    if removed is not None:
+        index.remove(importer.row_hashes(removed))
+    index.version = ledger_version("expenses")
+
+
+def recategorize_rows(real_idx, new_cat):
+    # the selected row plus every other row with the same description, where the category differs
+    desc_key = str(st.session_state.expenses.at[real_idx, 'description']).lower().strip()
+    if not desc_key:
+        current = st.session_state.expenses.at[real_idx, 'category']
+        return desc_key, np.array([real_idx] if current != new_cat else [], dtype=np.intp)
+    return desc_key, description_index().changes(desc_key, 'category', new_cat)
+
+
+def recategorize(real_idx, new_cat):
+    # one (shallow) copy, one rollup delta, one journal record for all matching rows; then teach the memory
+    desc_key, pos = recategorize_rows(real_idx, new_cat)
+    if len(pos):
+        before = ledger_version("expenses")
+        index = description_index()
+        df = st.session_state.expenses.copy(deep=False)   # only 'category' is written
+        rollups = get_rollups("expenses")
+        rollups.remove_frame(df.iloc[pos])
+        storage.set_values(df, df.index[pos], 'category', new_cat)
+        rollups.add_frame(df.iloc[pos])
+        st.session_state.expenses = df
+        index.frame = df   # descriptions unchanged
+        log_change("expenses", op="update", rows=pos.tolist(), **row_ids("expenses", pos), fields={'category': new_cat})
+        dedup_update(before)   # the category is not part of the dedup key
+    if desc_key:
+        teach_memory(desc_key, new_cat)
+    return len(pos)
 
-    # SAVE MEMORY (category learning)
-    save_memory(st.session_state.memory, mem_file)
+# ------------------------- persist helper -------------------------
+def persist_all():
+    if "ledger_versions" not in st.session_state:
+        reset_ledger_versions()
+    versions = st.session_state.ledger_versions
+    saved = st.session_state.saved_versions
+
+    # SAVE DATA SEPARATELY FOR EACH USER (only ledgers changed since the last save)
+    # (memory = category learning)
+    for ledger in LEDGERS:
+        if versions[ledger] == saved[ledger]:
+            storage.count_write("skipped")
+            continue
+        save_ledger(ledger, st.session_state[ledger])
+        saved[ledger] = versions[ledger]
 
     # KEEP YOUR UPLOADER CSS SAME
     st.markdown("""
@@ -596,41 +790,114 @@ with st.sidebar:
     st.markdown("---")
     # CSV uploader (expenses)
     uploaded = st.file_uploader("Upload expenses CSV/XLSX (optional)", type=['csv','xlsx'])
-    if uploaded is not None:
+    # a file stays in the uploader across reruns: import it once per session
+    upload_key = (current_username(), getattr(uploaded, "file_id", None) or (uploaded.name, uploaded.size)) if uploaded is not None else None
+    if uploaded is not None and st.session_state.get("imported_upload") != upload_key:
+        imported = {"rows": 0}   # rows already in the ledger (for a partial-import message)
+        summary = None
+        bar = st.progress(0.0, text="Importing…")
         try:
-            if uploaded.name.lower().endswith('.xlsx'):
-                new = pd.read_excel(uploaded)
-            else:
-                new = pd.read_csv(uploaded)
-            # normalize columns
-            new_cols = [c.strip().lower() for c in new.columns]
-            new.columns = new_cols
-            required = {'date','amount','description'}
-            if not required.issubset(set(new_cols)):
-                st.error("Uploaded file must contain columns: date, amount, description (case-insensitive).")
-            else:
-                new['date'] = pd.to_datetime(new['date'], errors='coerce')
-                if 'category' not in new.columns:
-                    new['category'] = new['description'].apply(lambda x: auto_category(str(x)))
-                else:
-                    # fill blanks
-                    new['category'] = new['category'].fillna('')
-                    new.loc[new['category'].str.strip()=='','category'] = new.loc[new['category'].str.strip()=='','description'].apply(lambda x: auto_category(str(x)))
-                new = new[['date','amount','description','category']]
-                old_count = len(st.session_state.expenses)
-                st.session_state.expenses = pd.concat([st.session_state.expenses, new], ignore_index=True)
-                persist_all()
-                st.success(f"Uploaded {len(new)} rows. Total now: {len(st.session_state.expenses)}")
+            # streaming import: read / validate / categorize chunk by chunk; each chunk goes straight into
+            # the session ledger (journal / sqlite also write it to the store now; csv rewrites the file
+            # once, in persist_all below), so no more than one chunk is held at a time
+
+            def save_chunk(chunk):
+                imported["rows"] += len(chunk)
+                rows = chunk.to_dict("records")
+                log_change("expenses", op="add", rows=rows)
+                if rows and storage.ROW_ID in rows[0]:
+                    # sqlite filled in each row's rid
+                    chunk = chunk.assign(**{storage.ROW_ID: [r[storage.ROW_ID] for r in rows]})
+                append_rows("expenses", chunk)
+
+            def show_progress(fraction, rows):
+                bar.progress(fraction if fraction is not None else 0.0, text=f"Importing… {rows:,} rows")
+
+            categorize = lambda descriptions: analytics.categorize_series(
+                descriptions, st.session_state.memory, category_memo(), category_model())
+            dedup = dedup_index()
+            before = ledger_version("expenses")
+            try:
+                summary = importer.import_stream(uploaded, uploaded.name, save_chunk, categorize, show_progress,
+                                                 dedup=dedup, layouts_file=importer.layouts_path(current_username()))
+            finally:
+                bar.empty()
+                if imported["rows"]:
+                    persist_all()
+                if imported["rows"] or summary is not None:
+                    # imported (even partly): a rerun must not import the file again
+                    st.session_state.imported_upload = upload_key
+            # import_stream already added the new rows' hashes
+            if dedup.version == before:
+                dedup.version = ledger_version("expenses")
+                dedup.save(importer.dedup_path(current_username()), STORE.version(current_username(), "expenses"))
+            skipped = f" Skipped {summary['skipped']} row(s) without a numeric amount or a readable date." if summary['skipped'] else ""
+            credits = f" Left out {summary['credits']} credit / deposit row(s)." if summary['credits'] else ""
+            st.success(f"Uploaded {summary['rows']} new rows, {summary['duplicates']} duplicate(s) already in your ledger, "
+                       f"in {summary['seconds']:.1f}s ({summary['rows_per_s'] or 0:,.0f} rows/s). "
+                       f"Total now: {len(st.session_state.expenses)}.{skipped}{credits}")
+            st.caption(f"Layout: {summary['layout']} · dates: {summary['date_format'] or 'auto'}")
+        except importer.ImportFormatError as e:
+            st.error(str(e))
+            if e.columns:
+                # user-defined layout: map this bank's header once, later uploads with this header use it
+                with st.expander("🧭 Map statement columns", expanded=True):
+                    none = "—"
+                    opts = [none] + e.columns
+                    lay_date = st.selectbox("Date column", e.columns, key="lay_date")
+                    lay_fmt = st.selectbox("Date format", ["auto"] + list(importer.DATE_FORMATS), key="lay_fmt")
+                    lay_desc = st.multiselect("Description / narration column(s)", e.columns, key="lay_desc")
+                    lay_amount = st.selectbox("Amount column (signed / single)", opts, key="lay_amount")
+                    lay_debit = st.selectbox("…or Debit / withdrawal column", opts, key="lay_debit")
+                    lay_credit = st.selectbox("Credit / deposit column", opts, key="lay_credit")
+                    lay_name = st.text_input("Layout name", value=uploaded.name.rsplit(".", 1)[0], key="lay_name")
+                    if st.button("💾 Save layout & import"):
+                        columns = {"date": lay_date, "description": lay_desc}
+                        if lay_amount != none:
+                            columns["amount"] = lay_amount
+                        elif lay_debit != none:
+                            columns["debit"] = lay_debit
+                            if lay_credit != none:
+                                columns["credit"] = lay_credit
+                        if not lay_desc or ("amount" not in columns and "debit" not in columns):
+                            st.warning("Pick a description column and an amount or debit column.")
+                        else:
+                            importer.save_layout({"name": lay_name, "fingerprint": importer.header_fingerprint(e.columns),
+                                                  "columns": columns,
+                                                  "date_format": None if lay_fmt == "auto" else lay_fmt},
+                                                 importer.layouts_path(current_username()))
+                            st.rerun()
         except Exception as e:
-            st.error(f"Upload error: {e}")
+            saved = imported["rows"]
+            partial = (f" {saved:,} row(s) read before the error were imported; re-upload the file to import the rest "
+                       f"(rows already in your ledger are skipped).") if saved else ""
+            st.error(f"Upload error: {e}.{partial}")
 
     st.markdown("---")
-    st.markdown("<div style='font-size:12px;color:rgba(255,255,255,0.9);padding-left:8px'>Tips: Use 'Teach the app' to correct categories. CSV uploads accept 'date','amount','description' columns.</div>", unsafe_allow_html=True)
+    st.markdown("<div style='font-size:12px;color:rgba(255,255,255,0.9);padding-left:8px'>Tips: Use 'Teach the app' to correct categories. CSV/XLSX uploads accept 'date','amount','description' columns or common bank exports (debit/credit, narration).</div>", unsafe_allow_html=True)
         
 # ------------------------- LOGOUT BUTTON -------------------------
     st.markdown("<hr>", unsafe_allow_html=True)
 
+    with st.expander("⚙️ Diagnostics"):
+        ws = storage.WRITE_STATS
+        st.caption(f"Storage mode: {storage.STORAGE_MODE}")
+        st.caption(f"Ledger writes — performed: {ws['performed']} · skipped (unchanged): {ws['skipped']} · single-record appends: {ws['appended']}")
+        cs = STORE.stats()
+        st.caption(f"Ledger cache — hits: {cs['hits']} · misses: {cs['misses']} · evictions: {cs['evictions']} · {cs['entries']} frames / {cs['mb']} MB")
+        ms = category_memo().stats()
+        st.caption(f"Category memo — hits: {ms['hits']} · misses: {ms['misses']} · invalidations: {ms['invalidations']} · {ms['entries']}/{ms['max_entries']} entries")
+        md = analytics.MERCHANTS.stats()
+        st.caption(f"Merchant dictionary — v{md['version']} · {md['keywords']} keywords in {md['categories']} categories · reloads: {md['reloads']}")
+        if md['error']:
+            st.caption(f"⚠️ Merchant file not reloaded: {md['error']}")
+        if storage.STORAGE_MODE == "sqlite" and st.button("📤 Export ledgers to CSV"):
+            for ledger, path in zip(LEDGERS, get_user_files()):
+                STORE.export_csv(current_username(), ledger, path)
+            st.success("Exported: " + ", ".join(get_user_files()))
+
     if st.button("🚪 Logout"):
+        classifier.flush_save(classifier.model_path(current_username()))
         logout()
         st.session_state.pop("logged_in_user", None)
         st.success("Logged out successfully!")
@@ -652,23 +919,9 @@ st.markdown(
 
 # ------------------------- Helper: render stats cards -------------------------
 def render_stat_cards(exp_df):
-    if exp_df.empty:
-        total = 0
-        this_month = 0
-        avg_month = 0
-        records = 0
-    else:
-        df = exp_df.copy()
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        total = df['amount'].astype(float).sum()
-        now = datetime.now()
-        this_month = df.loc[df['date'].dt.month == now.month, 'amount'].sum() if 'date' in df else 0
-        if df['date'].notnull().any():
-            avg_month = df.groupby(df['date'].dt.to_period('M'))['amount'].sum().mean()
-            avg_month = 0 if np.isnan(avg_month) else avg_month
-        else:
-            avg_month = 0
-        records = len(df)
+    cards = analytics.stat_cards(exp_df)
+    total, this_month = cards["total"], cards["this_month"]
+    avg_month, records = cards["avg_month"], cards["records"]
     c1, c2, c3, c4 = st.columns([1,1,1,1])
     c1.markdown(f"<div class='card'><span class='gtext gicon'>💰</span><div style='display:inline-block;vertical-align:middle'><div style='color:#6b7280'>Total spent</div><div class='stat-value'>₹{total:,.0f}</div></div></div>", unsafe_allow_html=True)
     c2.markdown(f"<div class='card'><span class='gtext gicon'>📅</span><div style='display:inline-block;vertical-align:middle'><div style='color:#6b7280'>This month</div><div class='stat-value'>₹{this_month:,.0f}</div></div></div>", unsafe_allow_html=True)
@@ -702,41 +955,24 @@ if menu == "Dashboard":
     """, unsafe_allow_html=True)
 
     # --- Load Data ---
-    df_exp = st.session_state.expenses.copy()
-    df_inc = st.session_state.incomes.copy()
-
-    # Ensure datetime conversion
-    if not df_exp.empty:
-        df_exp["date"] = pd.to_datetime(df_exp["date"], errors="coerce")
-    if not df_inc.empty:
-        df_inc["date"] = pd.to_datetime(df_inc["date"], errors="coerce")
+    # totals come from the incrementally maintained rollups, not the raw rows
+    df_exp = st.session_state.expenses
+    df_inc = st.session_state.incomes
+    exp_roll = get_rollups("expenses")
+    inc_roll = get_rollups("incomes")
+    stats = analytics.dashboard_stats(exp_roll, inc_roll)
 
     # ------------------------- EXPENSE STATS -------------------------
-    total_spent = df_exp["amount"].sum() if not df_exp.empty else 0
-    this_month_spent = df_exp[df_exp["date"].dt.month == date.today().month]["amount"].sum() if not df_exp.empty else 0
-    avg_monthly_spend = df_exp.groupby(df_exp["date"].dt.to_period("M"))["amount"].sum().mean() if not df_exp.empty else 0
-    total_records = len(df_exp)
+    total_spent = stats["total_spent"]
+    this_month_spent = stats["this_month_spent"]
+    avg_monthly_spend = stats["avg_monthly_spend"]
+    total_records = stats["total_records"]
 
     # ------------------------- INCOME STATS (FIXED) -------------------------
-    if not df_inc.empty:
-        df_inc["date"] = pd.to_datetime(df_inc["date"], errors="coerce")
-
-    total_income = df_inc["amount"].sum() if not df_inc.empty else 0
-
-    monthly_income = (
-        df_inc[df_inc["date"].dt.month == date.today().month]["amount"].sum()
-        if not df_inc.empty else 0
-    )
-
-    yearly_income = (
-        df_inc[df_inc["date"].dt.year == date.today().year]["amount"].sum()
-        if not df_inc.empty else 0
-    )
-
-    weekly_income = (
-        df_inc[df_inc["date"].dt.isocalendar().week == datetime.now().isocalendar().week]["amount"].sum()
-        if not df_inc.empty else 0
-    )
+    total_income = stats["total_income"]
+    monthly_income = stats["monthly_income"]
+    yearly_income = stats["yearly_income"]
+    weekly_income = stats["weekly_income"]
 
 
     # ------------------------- CARD CSS -------------------------
@@ -794,7 +1030,7 @@ if menu == "Dashboard":
             </h3>
             """, unsafe_allow_html=True)
 
-            cat = df_exp.groupby("category")["amount"].sum().reset_index()
+            cat = exp_roll.label_frame()
 
             fig_pie = px.pie(
                 cat,
@@ -824,8 +1060,7 @@ if menu == "Dashboard":
             </h3>
             """, unsafe_allow_html=True)
 
-            daily = df_exp.groupby(df_exp["date"].dt.date)["amount"].sum().reset_index()
-            daily["date"] = pd.to_datetime(daily["date"])
+            daily = exp_roll.daily_frame()
 
             fig_daily = px.line(daily, x="date", y="amount", markers=True)
             fig_daily.update_traces(
@@ -860,10 +1095,9 @@ if menu == "Dashboard":
         """, unsafe_allow_html=True)
 
         if not df_inc.empty:
-            df_year = df_inc[df_inc["date"].dt.year == date.today().year]
+            src_sum = analytics.yearly_income_by_source(inc_roll, date.today().year)
 
-            if not df_year.empty:
-                src_sum = df_year.groupby("source")["amount"].sum().reset_index()
+            if not src_sum.empty:
 
                 fig_src = px.pie(
                     src_sum,
@@ -898,11 +1132,7 @@ if menu == "Dashboard":
 
         if (not df_exp.empty) or (not df_inc.empty):
 
-            me = df_exp.groupby(df_exp['date'].dt.to_period("M"))['amount'].sum().reset_index().rename(columns={'amount':'expense'})
-            mi = df_inc.groupby(df_inc['date'].dt.to_period("M"))['amount'].sum().reset_index().rename(columns={'amount':'income'})
-
-            combined = pd.merge(mi, me, on='date', how='outer').fillna(0)
-            combined['month'] = combined['date'].astype(str)
+            combined = analytics.income_vs_expense(exp_roll, inc_roll)
 
             fig_small = go.Figure()
             fig_small.add_trace(go.Scatter(
@@ -949,9 +1179,7 @@ if menu == "Dashboard":
     </h3>
     """, unsafe_allow_html=True)
 
-    surplus = max(0, total_income - total_spent)
-    health = (surplus / total_income * 100) if total_income > 0 else 0
-    health = max(0, min(100, health))
+    health = stats["health"]
 
     fig_health = go.Figure(go.Indicator(
         mode="gauge+number",
@@ -976,7 +1204,7 @@ if menu == "Dashboard":
     c1, c2, c3 = st.columns(3)
 
     if not df_exp.empty:
-        c1.download_button("⬇️ Download Expenses (CSV)", df_exp.to_csv(index=False), "expenses.csv")
+        c1.download_button("⬇️ Download Expenses (CSV)", df_exp.drop(columns=storage.ROW_ID, errors="ignore").to_csv(index=False), "expenses.csv")
     else:
         c1.write("No expense CSV")
 
@@ -1025,9 +1253,10 @@ elif menu == "Expenses":
             try:
                 cat_final = cat_manual.strip() if cat_manual.strip() else auto_category(desc)
                 new = {'date': pd.to_datetime(d_in), 'amount': float(amt), 'description': desc, 'category': cat_final}
-                st.session_state.expenses = pd.concat(
-                    [st.session_state.expenses, pd.DataFrame([new])], ignore_index=True
-                )
+                before = ledger_version("expenses")
+                log_change("expenses", op="add", rows=[new])
+                append_rows("expenses", pd.DataFrame([new]))
+                dedup_update(before, added=pd.DataFrame([new]))
                 persist_all()
                 st.success(f"✅ Expense of ₹{amt:,.2f} added successfully!")
                 rerun_after_action()
@@ -1038,13 +1267,12 @@ elif menu == "Expenses":
 
     # 📋 Expense Table
     st.subheader("📋 Your Recorded Expenses")
-    exp = st.session_state.expenses.copy().reset_index().rename(columns={'index': 'row'})
+    exp = st.session_state.expenses
 
     if exp.empty:
         st.info("No expense records found. Add some above to get started.")
     else:
-        display_df = exp[['row', 'date', 'amount', 'description', 'category']].copy()
-        display_df['date'] = pd.to_datetime(display_df['date'], errors='coerce').dt.strftime('%Y-%m-%d')
+        display_df = table_page("expenses", "expense_table_page", ['date', 'amount', 'description', 'category'])
         st.dataframe(display_df, height=300)
 
         # ✏️ Edit / Delete
@@ -1057,14 +1285,13 @@ elif menu == "Expenses":
                 'Food', 'Shopping', 'Bills', 'Travel', 'Entertainment', 'Health',
                 'Education', 'Groceries', 'Transport', 'Others'
             ])
+            real_idx = int(exp.index[idx])
+            st.caption(f"🔁 {len(recategorize_rows(real_idx, new_cat)[1])} row(s) with this description will change to {new_cat}.")
             if st.button("Apply new category"):
                 try:
-                    real_idx = int(exp.loc[idx, 'row'])
-                    desc_key = str(st.session_state.expenses.at[real_idx, 'description']).lower().strip()
-                    st.session_state.expenses.at[real_idx, 'category'] = new_cat
-                    st.session_state.memory[desc_key] = new_cat
+                    changed = recategorize(real_idx, new_cat)
                     persist_all()
-                    st.success("✅ Category updated successfully.")
+                    st.success(f"✅ Category updated successfully ({changed} row(s)).")
                     rerun_after_action()
                 except Exception as e:
                     st.error(f"Update failed: {e}")
@@ -1072,8 +1299,12 @@ elif menu == "Expenses":
         elif choose_action == "Delete row":
             if st.button("🗑️ Delete selected row"):
                 try:
-                    real_idx = int(exp.loc[idx, 'row'])
-                    st.session_state.expenses = st.session_state.expenses.drop(real_idx).reset_index(drop=True)
+                    real_idx = int(exp.index[idx])
+                    ids = row_ids("expenses", [real_idx])
+                    before, removed = ledger_version("expenses"), st.session_state.expenses.loc[[real_idx]]
+                    delete_rows("expenses", [real_idx])
+                    log_change("expenses", op="delete", row=real_idx, **ids)
+                    dedup_update(before, removed=removed)
                     persist_all()
                     st.success("✅ Row deleted successfully.")
                     rerun_after_action()
@@ -1133,10 +1364,9 @@ elif menu == "Expenses":
 
         # 🔹 Use goal in expense calculation
         monthly_goal = st.session_state.monthly_goal
-        exp['date'] = pd.to_datetime(exp['date'], errors='coerce')
-        current_month = exp[exp['date'].dt.month == datetime.now().month]
-        monthly_spent = current_month['amount'].sum()
-        progress = (monthly_spent / monthly_goal) * 100 if monthly_goal > 0 else 0
+        exp_roll = get_rollups("expenses")
+        monthly_spent = exp_roll.month_of_year_total(datetime.now().month)
+        progress = analytics.budget_progress(monthly_spent, monthly_goal)
 
         st.progress(min(progress / 100, 1.0))
         st.markdown(f"**You’ve spent ₹{monthly_spent:,.2f} out of ₹{monthly_goal:,.2f} ({progress:.1f}%) this month.**")
@@ -1150,7 +1380,8 @@ elif menu == "Expenses":
 
         # 📈 Daily Expense Trend
         st.subheader("📈 Expense Trend Over Time")
-        trend = exp.groupby(exp['date'].dt.date)['amount'].sum().reset_index()
+        daily_exp = exp_roll.daily_frame()
+        trend = daily_exp
         fig = px.line(
             trend, x='date', y='amount', markers=True,
             title="📊 Daily Expense Trend",
@@ -1162,15 +1393,10 @@ elif menu == "Expenses":
 
         # 🤖 Weekly AI Forecast
         st.subheader("🤖 Weekly AI Forecast")
-        exp['week'] = exp['date'].dt.isocalendar().week
-        exp['year'] = exp['date'].dt.year
-        exp['week_start'] = exp['date'] - pd.to_timedelta(exp['date'].dt.weekday, unit='d')
-        weekly_expense = exp.groupby(['year', 'week', 'week_start'])['amount'].sum().reset_index()
-
-        if len(weekly_expense) >= 2:
-            current_week = weekly_expense.iloc[-1]['amount']
-            prev_week = weekly_expense.iloc[-2]['amount']
-            change_percent = ((current_week - prev_week) / prev_week) * 100 if prev_week != 0 else 0
+        weekly_expense = exp_roll.weekly_frame()
+
+        change_percent = analytics.weekly_change(weekly_expense)
+        if change_percent is not None:
             if change_percent > 10:
                 st.error(f"🚨 Overspending Alert! You spent {change_percent:.1f}% more than last week.")
             elif change_percent < -5:
@@ -1180,11 +1406,8 @@ elif menu == "Expenses":
 
         # 🔮 Next Week Prediction
         st.subheader("🔮 AI Predicted Next Week Expense")
-        if len(weekly_expense) >= 3:
-            X = np.arange(len(weekly_expense)).reshape(-1, 1)
-            y = weekly_expense['amount'].values
-            model = LinearRegression().fit(X, y)
-            prediction = model.predict([[len(weekly_expense)]])[0]
+        prediction = analytics.predict_next_week(weekly_expense)
+        if prediction is not None:
             st.markdown(f"📊 **Estimated next week’s expense:** ₹{prediction:,.2f}")
         else:
             st.info("🧩 Add at least 3 weeks of data for prediction.")
@@ -1193,11 +1416,7 @@ elif menu == "Expenses":
         # 📆 5-Week Comparison
         st.subheader("📆 Last 5 Weeks Expense Comparison")
 
-        # Add week start date for readability
-        exp['week_start'] = exp['date'] - pd.to_timedelta(exp['date'].dt.weekday, unit='d')
-
-        # Group by year, week, and week_start for clear labeling
-        weekly_expense = exp.groupby(['year', 'week', 'week_start'])['amount'].sum().reset_index()
+        # weekly_expense (year, week, week_start) from the rollups above
 
         # Take last 5 weeks
         last5 = weekly_expense.tail(5)
@@ -1232,7 +1451,7 @@ elif menu == "Expenses":
 
         # 🧠 Category Breakdown
         st.subheader("🧠 AI Category-Wise Breakdown")
-        category_exp = exp.groupby("category")["amount"].sum().reset_index().sort_values(by="amount", ascending=False)
+        category_exp = exp_roll.label_frame().sort_values(by="amount", ascending=False)
         fig_cat = px.bar(category_exp, x="category", y="amount", color="amount",
                          text_auto=True, title="Spending by Category", color_continuous_scale="Viridis")
         st.plotly_chart(fig_cat, use_container_width=True)
@@ -1253,7 +1472,7 @@ elif menu == "Expenses":
 
         # 🗓️ Heatmap Visualization
         st.subheader("🌡️ Expense Heatmap Calendar")
-        heatmap_data = exp.groupby(exp['date'].dt.date)['amount'].sum().reset_index()
+        heatmap_data = daily_exp
         fig_heat = px.density_heatmap(
             heatmap_data,
             x='date', y='date', z='amount',
@@ -1270,7 +1489,7 @@ elif menu == "Expenses":
         st.plotly_chart(fig_heat, use_container_width=True)
 
         # 📂 Download CSV
-        csv = exp.to_csv(index=False).encode("utf-8")
+        csv = exp.drop(columns=storage.ROW_ID, errors="ignore").to_csv(index=False).encode("utf-8")
         st.download_button("⬇️ Download Expense Records (CSV)", data=csv, file_name="expense_records.csv", mime="text/csv")
 
         # 💡 Smart Insights
@@ -1300,14 +1519,13 @@ elif menu == "Income":
     if "incomes" not in st.session_state:
         st.session_state.incomes = pd.DataFrame(columns=["id", "date", "amount", "source"])
 
-    df_income = st.session_state.incomes.copy()
+    df_income = st.session_state.incomes
 
     # ---------------- INCOME OVERVIEW ---------------- #
     if not df_income.empty:
-        total_income = df_income["amount"].sum()
-        avg_income = total_income / max(1, len(df_income["date"].astype(str).str[:7].unique()))
-        top_source = df_income["source"].mode()[0] if not df_income["source"].empty else "N/A"
-        last_date = df_income["date"].max()
+        overview = analytics.income_overview(get_rollups("incomes"))
+        total_income, avg_income = overview["total_income"], overview["avg_income"]
+        top_source, last_date = overview["top_source"], overview["last_date"]
 
         st.markdown(f"""
         <div style="
@@ -1344,9 +1562,8 @@ elif menu == "Income":
             try:
                 new_id = np.random.randint(10**7, 10**9)
                 new = {'date': pd.to_datetime(idate), 'amount': float(iamt), 'source': src, 'id': new_id}
-                st.session_state.incomes = pd.concat(
-                    [st.session_state.incomes, pd.DataFrame([new])], ignore_index=True
-                )
+                append_rows("incomes", pd.DataFrame([new]))
+                log_change("incomes", op="add", rows=[new])
                 persist_all()
                 with st.spinner("🔄 Saving income..."):
                     time.sleep(0.7)
@@ -1359,11 +1576,11 @@ elif menu == "Income":
 
     # ---------------- INCOME RECORDS ---------------- #
     st.subheader("📜 Income Records")
-    df_income = st.session_state.incomes.copy().reset_index(drop=True)
+    df_income = st.session_state.incomes
 
     if not df_income.empty:
-        df_income["date"] = pd.to_datetime(df_income["date"], errors="coerce").dt.strftime("%Y-%m-%d")
-        st.dataframe(df_income[["id", "date", "amount", "source"]], height=280)
+        st.dataframe(table_page("incomes", "income_table_page", ["id", "date", "amount", "source"]).drop(columns="row"),
+                     height=280)
 
     # Modify / Delete income
         st.markdown("### ✏️ Modify or Delete Income")
@@ -1400,16 +1617,15 @@ elif menu == "Income":
                         if st.button("✅ Save Changes"):
                             try:
                                 idx = df_income.index[df_income["id"] == edit_id][0]
-                                st.session_state.incomes.at[idx, "amount"] = new_amt
-                                st.session_state.incomes.at[idx, "source"] = new_src
-                                
-                                exp_file, inc_file, mem_file = get_user_files()
+                                update_rows("incomes", idx, {"amount": new_amt, "source": new_src})
+                                log_change("incomes", op="update", id=edit_id,
+                                           fields={"amount": new_amt, "source": new_src})
+
 
                                 persist_all()
 
-                            # Reload immediately from file
-                                st.session_state.incomes = pd.read_csv(inc_file)
-                                st.session_state.incomes['date'] = pd.to_datetime(st.session_state.incomes['date'], errors='coerce')
+                            # Reload immediately from storage
+                                set_ledger("incomes", load_ledger("incomes"))
                                 st.success(f"✅ Income ID {edit_id} updated successfully!")
                                 st.session_state.editing_income = False
                                 rerun_after_action()
@@ -1430,9 +1646,9 @@ elif menu == "Income":
             if st.button("🗑️ Delete"):
                 if del_id in df_income["id"].values:
                     try:
-                        st.session_state.incomes = st.session_state.incomes[
-                            st.session_state.incomes["id"] != del_id
-                        ].reset_index(drop=True)
+                        inc = st.session_state.incomes
+                        delete_rows("incomes", inc.index[inc["id"] == del_id])
+                        log_change("incomes", op="delete", id=del_id)
                         persist_all()
                         with st.spinner("🧹 Deleting record..."):
                             time.sleep(0.8)
@@ -1451,15 +1667,8 @@ elif menu == "Income":
     # ---------------- MONTHLY CHART + LINE CHART + DOWNLOAD + SMART TIPS ---------------- 
     st.subheader("📈 Monthly Income Trend")
 
-# Ensure date is parsed correctly
-    df_income["date"] = pd.to_datetime(df_income["date"], errors="coerce")
-
-# Group by month
-    monthly = (
-        df_income.groupby(df_income["date"].dt.to_period("M"))["amount"]
-        .sum()
-        .reset_index()
-    )
+# Group by month (from the income rollups)
+    monthly = get_rollups("incomes").monthly_frame()
     monthly["month"] = monthly["date"].dt.strftime("%b %Y")  # 👈 show Jan, Feb, Mar format
 
     # ----------- BAR CHART -----------
@@ -1572,7 +1781,7 @@ elif menu == "Income":
 
     # ----------- DOWNLOAD CSV -----------
     st.subheader("⬇️ Export Income Data")
-    csv = df_income.to_csv(index=False).encode("utf-8")
+    csv = df_income.drop(columns=storage.ROW_ID, errors="ignore").to_csv(index=False).encode("utf-8")
     st.download_button(
         label="💾 Download Income Records (CSV)",
         data=csv,
@@ -1609,7 +1818,7 @@ elif menu == "Income":
 elif menu == "Forecast":
     st.header("🔮 Forecast & Predictions")
 
-    df = st.session_state.expenses.copy()
+    df = st.session_state.expenses
 
     if df.empty or len(df) < 3:
         st.info("📊 Add at least 3 expense records for a meaningful forecast.")
@@ -1636,39 +1845,20 @@ elif menu == "Forecast":
 
 
             # Data preparation
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
-            daily = df.groupby(df['date'].dt.date)['amount'].sum().reset_index().rename(columns={'date': 'day'})
-            daily['day'] = pd.to_datetime(daily['day'])
+            daily = get_rollups("expenses").daily_frame()
 
             if daily.empty:
                 st.warning("⚠️ Not enough daily data available for trend prediction.")
             else:
-                # Apply smoothing for realistic trend
-                daily['smoothed'] = daily['amount'].rolling(window=3, min_periods=1).mean()
-
-                # Regression Model
-                X = np.arange(len(daily)).reshape(-1, 1)
-                y = daily['smoothed'].values
-                model = LinearRegression().fit(X, y)
-
-                # Prediction for next N days
+                # Smoothed daily trend + regression (analytics.forecast_daily)
                 n = st.slider("🔢 Select number of days to predict", 3, 30, 10)
-                future_index = np.arange(len(daily), len(daily) + n)
-                preds = model.predict(future_index.reshape(-1, 1))
-
-                # Add a little realistic variation
-                variation = np.sin(np.linspace(0, 2 * np.pi, n)) * 100
-                preds = preds + variation
-
-                # Future Dates
-                future_dates = [daily['day'].max() + timedelta(days=i + 1) for i in range(n)]
-                pred_df = pd.DataFrame({'date': future_dates, 'predicted_amount': np.round(preds, 2)})
+                pred_df = analytics.forecast_daily(daily, n)
 
                 st.markdown("### 🗓️ Forecasted Expense for Upcoming Days")
                 st.dataframe(pred_df.style.format({'predicted_amount': '₹{:,.2f}'.format}))
 
                 # Combine past + future data for chart
-                past = daily[['day', 'amount']].rename(columns={'day': 'date', 'amount': 'value'})
+                past = daily[['date', 'amount']].rename(columns={'amount': 'value'})
                 future = pred_df.rename(columns={'predicted_amount': 'value'})
                 combined = pd.concat([past, future], ignore_index=True)
 
@@ -1766,16 +1956,14 @@ elif menu == "Reports":
     
     st.header("📊 Reports & Insights")
 
-    df = st.session_state.expenses.copy()
+    df = st.session_state.expenses
     if df.empty:
         st.info("No expenses recorded yet.")
     else:
-        # Calculations
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        total_spent = df['amount'].sum()
-        start_date, end_date = df['date'].min().date(), df['date'].max().date()
-        avg_monthly = total_spent / max(1, len(df['date'].dt.to_period('M').unique()))
-        top_cat = df.groupby('category')['amount'].sum().idxmax()
+        # Calculations (from the expense rollups)
+        summary = analytics.report_summary(get_rollups("expenses"))
+        total_spent, avg_monthly, top_cat = summary["total_spent"], summary["avg_monthly"], summary["top_cat"]
+        start_date, end_date = summary["start_date"], summary["end_date"]
 
         # 🌊 Vibrant Blue Gradient Overview Card (Same as Forecast Section)
         st.markdown(f"""
@@ -1815,21 +2003,15 @@ elif menu == "Reports":
 
         # ===== TOTAL PER CATEGORY =====
         st.subheader("💰 Total per Category")
-        per_cat = df.groupby('category')['amount'].sum().reset_index().sort_values('amount', ascending=False)
-        st.dataframe(per_cat, use_container_width=True)
+        st.dataframe(summary["per_cat"], use_container_width=True)
 
         # ===== MONTHLY TOTAL =====
         st.subheader("📅 Monthly Total")
-        monthly = df.groupby(df['date'].dt.to_period('M'))['amount'].sum().reset_index()
-        monthly['Month'] = monthly['date'].astype(str)
-        monthly = monthly.rename(columns={'amount': 'Total Amount (₹)'})
-        st.dataframe(monthly[['Month', 'Total Amount (₹)']], use_container_width=True)
+        st.dataframe(summary["monthly"], use_container_width=True)
 
         # ===== YEARLY TOTAL =====
         st.subheader("🗓️ Yearly Total")
-        yearly = df.groupby(df['date'].dt.year)['amount'].sum().reset_index()
-        yearly = yearly.rename(columns={'date': 'Year', 'amount': 'Total Amount (₹)'})
-        st.dataframe(yearly, use_container_width=True)
+        st.dataframe(summary["yearly"], use_container_width=True)
 
         # ===== GRAND TOTAL =====
         st.success(f"🏦 **Overall Total Spent:** ₹{total_spent:,.2f}")
@@ -1837,7 +2019,7 @@ elif menu == "Reports":
         # ===== DOWNLOAD OPTION =====
         st.download_button(
             "⬇️ Download expenses CSV",
-            data=df.to_csv(index=False).encode('utf-8'),
+            data=df.drop(columns=storage.ROW_ID, errors="ignore").to_csv(index=False).encode('utf-8'),
             file_name="expenses_export.csv"
         )
 
@@ -1954,7 +2136,7 @@ elif menu == "Reports":
 elif menu == "AI Advice":
     st.header("🧠 AI Advice")
 
-    df = st.session_state.expenses.copy()
+    df = st.session_state.expenses
 
     if df.empty:
         st.warning("⚠️ No expenses recorded yet. Add your expenses to get AI-powered insights!")
@@ -1978,14 +2160,10 @@ elif menu == "AI Advice":
         """, unsafe_allow_html=True)
 
 
-        # Total spent and category-wise breakdown
-        category_spending = df.groupby("category")["amount"].sum().reset_index()
-        category_spending = category_spending.sort_values(by="amount", ascending=False)
-        total_spent = category_spending["amount"].sum()
-
-        total_income = st.session_state.incomes["amount"].sum() if not st.session_state.incomes.empty else 0
-        top_cat = category_spending.iloc[0]["category"]
-        top_amt = category_spending.iloc[0]["amount"]
+        # Total spent, category-wise breakdown and tips (analytics.advice)
+        result = analytics.advice(df, get_rollups("expenses"), get_rollups("incomes").total_amount)
+        category_spending, total_spent = result["category_spending"], result["total_spent"]
+        top_cat, top_amt, tips = result["top_cat"], result["top_amt"], result["tips"]
 
         st.markdown("### 💸 Spending Summary")
         st.dataframe(category_spending, height=220)
@@ -1994,60 +2172,10 @@ elif menu == "AI Advice":
         # Personalized insights list
         st.markdown("### 💬 AI-Generated Personal Recommendations")
 
-        tips = []
-
-        # 1️⃣ Category-based smart advice
-        for _, row in category_spending.iterrows():
-            cat = row["category"]
-            amt = row["amount"]
-
-            if amt > 0.25 * total_spent:
-                tips.append(f"⚠️ Your spending on **{cat}** is unusually high (₹{amt:,.0f}). Try limiting this to 20% of total expenses next month.")
-            elif amt < 0.05 * total_spent:
-                tips.append(f"✅ Spending on **{cat}** is under control — great job maintaining discipline!")
-
-        # 2️⃣ Income to expense ratio analysis
-        if total_income > 0:
-            ratio = (total_spent / total_income) * 100
-            if ratio > 80:
-                tips.append("🚨 You're spending over **80% of your income**! Consider reviewing essential vs non-essential expenses.")
-            elif 60 < ratio <= 80:
-                tips.append("💡 Spending between 60–80% of income — you can aim to save a little more each month.")
-            else:
-                tips.append("🟢 Excellent! You're spending wisely and maintaining a good savings margin.")
-
-            # AI Suggested savings
-            tips.append(f"💰 Based on your income, you should save **₹{round(total_income * 0.2):,} (20%)** monthly as your base goal.")
-
-        # 3️⃣ Detecting overspending patterns based on user data
-        recent_expenses = df.sort_values(by="date", ascending=False).head(5)
-        avg_expense = df["amount"].mean()
-
-        for _, exp in recent_expenses.iterrows():
-            if exp["amount"] > avg_expense * 1.5:
-                tips.append(f"🧐 Your recent expense in **{exp['category']} (₹{exp['amount']})** was significantly higher than average. Recheck if it was necessary.")
-
-        # 4️⃣ General lifestyle & budget tips
-        tips.extend([
-            "📅 Try maintaining a fixed monthly budget for each category (Food, Travel, Entertainment).",
-            "🍽️ Prepare meals at home more often — saves ₹2,000–₹4,000 monthly.",
-            "🧾 Use a spending tracker app to monitor expenses daily.",
-            "💳 Avoid EMI purchases unless necessary — interest eats into savings.",
-            "🛍️ Delay luxury buys using the **24-hour rule** before confirming a purchase.",
-            "💡 Automate savings transfers every salary day — treat savings as an expense.",
-            "📈 Follow the **50-30-20 rule**: 50% needs, 30% wants, 20% savings.",
-            "📊 Review this dashboard weekly to track spending drift.",
-            "🏦 Keep 3 months’ expense as emergency savings — ensures stability.",
-            "🧠 Use cashback or reward offers smartly — not as excuses to overspend."
-        ])
-          
         # 🔍 Deep analysis on the highest expense category
         st.markdown("### 🔎 Focus: Highest Expense Category Analysis")
 
-        # Get the top expense category and its amount
-        top_cat = category_spending.iloc[0]["category"]
-        top_amt = category_spending.iloc[0]["amount"]
-        percent = (top_amt / total_spent) * 100
+        percent = result["percent"]
 
         st.info(f"📈 Your highest expense is **{top_cat}**, which takes up **{percent:.1f}%** of your total spending (₹{top_amt:,.2f}).")
 
@@ -2152,15 +2280,13 @@ elif menu == "AI Advice":
 
 
 # --- Load DataFrame ---
-        df = st.session_state.expenses.copy().reset_index().rename(columns={'index': 'row'})
+        df = st.session_state.expenses
 
         if df.empty:
             st.info("No expense data yet. Add some expenses to train the AI.")
         else:
-            df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.strftime("%Y-%m-%d")
-
             st.dataframe(
-                df[['row', 'date', 'amount', 'description', 'category']],
+                table_page("expenses", "learn_table_page", ['date', 'amount', 'description', 'category']),
                 height=280
             )
 
@@ -2207,34 +2333,20 @@ elif menu == "AI Advice":
             """, unsafe_allow_html=True)
 
     # --- FIXED BUTTON (visible in light & dark both) ---
+            # Real index in original df
+            real_idx = int(df.index[idx])
+            st.caption(f"🔁 {len(recategorize_rows(real_idx, new_cat)[1])} row(s) with this description will change to {new_cat}.")
             update_btn = st.button("✅ Update Category Globally")
 
             if update_btn:
                 try:
-            # Real index in original df
-                    real_idx = int(df.loc[idx, 'row'])
+            # Update every matching row + AI memory for auto ML categorization
+                    changed = recategorize(real_idx, new_cat)
 
-            # Key for AI memory
-                    desc_key = str(st.session_state.expenses.at[real_idx, 'description']).lower().strip()
-
-            # Update category in main dataset
-                    st.session_state.expenses.at[real_idx, 'category'] = new_cat
-
-            # Update AI memory for auto ML categorization
-                    st.session_state.memory[desc_key] = new_cat
-                   
-                    exp_file, inc_file, mem_file = get_user_files()
-
-            # Save changes permanently
+            # Save changes permanently (the session frame and rollups are already current)
                     persist_all()
 
-            # Reload after saving
-                    st.session_state.expenses = pd.read_csv(exp_file)
-                    st.session_state.expenses["date"] = pd.to_datetime(
-                        st.session_state.expenses["date"], errors="coerce"
-                    )
-
-                    st.success("✅ Category updated successfully across all sections!")
+                    st.success(f"✅ Category updated successfully across all sections! ({changed} row(s))")
                 except Exception as e:
                     st.error(f"Update failed: {e}")
 
@@ -0,0 +1,965 @@
+# analytics.py
+"""
+Headless analytics for the expense advisor (pandas only, no Streamlit).
+
+Rollups keeps running totals of a ledger so pages never have to re-group the
+full history on a rerun: it is built once per load and then updated with just
+the rows that were added, edited or deleted. auto_category / MERCHANTS (the
+merchant keyword dictionary in merchants.json) are the categorizer used for
+manual adds and uploads, behind the user's taught memory (looked up exactly,
+then through MemoryIndex). The remaining
+functions are the page computations (stat cards, forecasts, reports, advice
+rules); the Streamlit script only renders what they return, and benchmark.py
+times them directly. take_session loads a user's ledgers and rollups at
+login, reusing a background prefetch_session when one was started; both are
+for authenticated users only (nothing is loaded for a username alone).
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+import storage
+from storage import to_paise
+
+
+# ------------------------- auto-category -------------------------
+# category -> keywords, first category wins; edited in the data file, not here
+MERCHANTS_FILE = os.environ.get("EXPENSE_MERCHANTS",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "merchants.json"))
+MERCHANTS_CHECK_S = 2.0   # how often (at most) the file's mtime / size is looked at
+
+
+class KeywordMatcher:
+    """
+    A keyword map compiled into one Aho-Corasick automaton (as a DFA), so a
+    description is scanned once, character by character, instead of once per
+    keyword. Every state carries the best (lowest) category rank of the
+    keywords ending there, which keeps the map's priority: the first category
+    with any keyword anywhere in the text wins, exactly like the nested loop.
+    """
+
+    def __init__(self, keyword_map):
+        from collections import deque
+
+        self.categories = list(keyword_map)
+        none = len(self.categories)
+        goto, rank = [{}], [none]
+        for r, kws in enumerate(keyword_map.values()):
+            for kw in kws:
+                s = 0
+                for ch in kw:
+                    nxt = goto[s].get(ch)
+                    if nxt is None:
+                        goto.append({})
+                        rank.append(none)
+                        nxt = goto[s][ch] = len(goto) - 1
+                    s = nxt
+                rank[s] = min(rank[s], r)
+        # failure links, breadth first; a state also reports its suffixes' ranks
+        fail = [0] * len(goto)
+        order, queue = [], deque([0])
+        while queue:
+            s = queue.popleft()
+            order.append(s)
+            for ch, t in goto[s].items():
+                queue.append(t)
+                if s:
+                    f = fail[s]
+                    while f and ch not in goto[f]:
+                        f = fail[f]
+                    fail[t] = goto[f].get(ch, 0)
+                rank[t] = min(rank[t], rank[fail[t]])
+        # full transition table (missing chars go back to the root)
+        delta = [None] * len(goto)
+        for s in order:
+            d = dict(delta[fail[s]]) if s else {}
+            d.update(goto[s])
+            delta[s] = d
+        self._delta = delta
+        self._rank = rank
+        self._none = none
+
+    def match(self, text):
+        """Highest-priority category with a keyword in `text` (lowercase), or None."""
+        delta, rank, best = self._delta, self._rank, self._none
+        s = 0
+        for ch in text:
+            s = delta[s].get(ch, 0)
+            r = rank[s]
+            if r < best:
+                best = r
+                if r == 0:
+                    break
+        return self.categories[best] if best < self._none else None
+
+
+class MerchantDictionary:
+    """
+    The shared merchant dictionary: MERCHANTS_FILE compiled into one
+    KeywordMatcher per server process (every user's session shares it, so
+    its memory does not grow with the number of users). The file is
+    re-read when its mtime / size changes, checked at most every
+    MERCHANTS_CHECK_S; `version` is the file's "version" plus a content
+    hash, so memoized categories can tell a reload happened. A file that
+    fails to parse keeps the last good dictionary in place (see `error`).
+    Taught user memory is consulted before it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keyword_map = {}
+        self.matcher = KeywordMatcher({})
+        self.version = None
+        self.reloads = 0
+        self.error = None
+        self._token = object()   # matches no stat token (nor a missing file): the first refresh always reads
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < MERCHANTS_CHECK_S:
+            return
+        self._checked = now
+        try:
+            st_ = os.stat(self.path)
+            token = (st_.st_mtime_ns, st_.st_size)
+        except OSError:
+            token = None
+        if token == self._token:
+            return
+        with self._lock:
+            if token == self._token:
+                return
+            self._token = token
+            try:
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                data = json.loads(raw)
+                keyword_map = {str(cat): [str(kw).lower() for kw in kws] for cat, kws in data["categories"].items()}
+                matcher = KeywordMatcher(keyword_map)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                self.error = f"{self.path}: {e}"
+                return
+            self.keyword_map, self.matcher = keyword_map, matcher
+            self.version = f"{data.get('version', 0)}-{hashlib.sha1(raw).hexdigest()[:8]}"
+            self.reloads += 1
+            self.error = None
+
+    def match(self, text):
+        self.refresh()
+        return self.matcher.match(text)
+
+    def stats(self):
+        return {"version": self.version, "categories": len(self.keyword_map),
+                "keywords": sum(map(len, self.keyword_map.values())), "reloads": self.reloads, "error": self.error}
+
+
+MERCHANTS = MerchantDictionary(MERCHANTS_FILE)
+
+
+def keyword_map():
+    """The current category -> keywords map (reloaded from MERCHANTS_FILE when it changes)."""
+    MERCHANTS.refresh()
+    return MERCHANTS.keyword_map
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_DIGITS_RE = re.compile(r"[0-9]+")
+# bank-statement filler that says nothing about the merchant
+NOISE_TOKENS = {"upi", "pos", "ref", "txn", "neft", "imps", "rtgs", "ach", "ecom", "no", "id", "to", "from",
+                "by", "via", "the", "of", "at", "in", "on", "for", "and", "payment", "order", "purchase"}
+MIN_PREFIX = 4           # "amazonpay" finds a taught "amazon", "cafeteria" does not find "caf"
+MIN_SIMILARITY = 0.6     # trigram Dice score for the typo fallback
+MAX_POSTING = 2000       # trigrams shared by more entries than this are too common to rank on
+# the per-memory indexes are kept in an LRU bounded by (estimated) size, not count:
+# one user with 50k taught entries weighs as much as thousands with a few dozen
+MEMORY_INDEX_MAX_BYTES = int(os.environ.get("EXPENSE_MEMORY_INDEX_MB", "64")) * 1024 * 1024
+INDEX_ENTRY_BYTES = 600  # per indexed key (entries / exact / postings), measured with tracemalloc
+INDEX_GRAM_BYTES = 70    # per trigram posting, once the fuzzy fallback has built them
+
+
+def normalize_tokens(text):
+    """Merchant tokens of a description: lowercase words with IDs dropped and stray digits stripped."""
+    out = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        if not tok.isalpha():
+            letters = _DIGITS_RE.sub("", tok)
+            if len(tok) - len(letters) >= 3:
+                continue  # reference numbers, card / account / order IDs
+            tok = letters
+        if len(tok) > 1 and tok not in NOISE_TOKENS:
+            out.append(tok)
+    return tuple(out)
+
+
+def _trigrams(text):
+    text = f" {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class MemoryIndex:
+    """
+    Token index over one user's taught memory, so "Blinkit order #123" is
+    found by a taught "blinkit". Entries are normalized with normalize_tokens
+    and posted under their longest token; lookup() matches an entry when
+    every entry token is one of the description's tokens. fuzzy_lookup()
+    (tried after the merchant keywords) also accepts an entry token that is
+    a prefix of one, then falls back to a trigram posting list that ranks
+    near-identical spellings ("blinkt") by Dice similarity. The best match
+    is the most specific entry (most tokens, then most characters, then the
+    latest taught).
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self._lock = threading.Lock()
+        self._rebuild()
+
+    def _rebuild(self):
+        self._entries = {}      # memory key -> (tokens, seq)
+        self._exact = {}        # normalized string -> memory key
+        self._postings = {}     # longest token -> set of memory keys
+        self._grams = None      # trigram -> set of memory keys (built on the first fuzzy lookup)
+        self._gram_total = 0    # postings across all trigrams
+        self._seq = 0
+        for key in self.memory:
+            self._add(key)
+        self._size = len(self.memory)
+
+    def _add(self, key):
+        self._remove(key)
+        tokens = normalize_tokens(key)
+        if not tokens:
+            return  # only an exact lookup can reach it
+        self._seq += 1
+        norm = " ".join(tokens)
+        self._entries[key] = (tokens, self._seq)
+        self._exact[norm] = key
+        self._postings.setdefault(max(tokens, key=len), set()).add(key)
+        if self._grams is not None:
+            self._add_grams(key, norm)
+
+    def _add_grams(self, key, norm):
+        grams = _trigrams(norm)
+        self._gram_counts[key] = len(grams)
+        self._gram_total += len(grams)
+        for g in grams:
+            self._grams.setdefault(g, set()).add(key)
+
+    def _build_grams(self):
+        self._grams, self._gram_counts, self._gram_total = {}, {}, 0
+        for key, (tokens, _) in self._entries.items():
+            self._add_grams(key, " ".join(tokens))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        tokens = entry[0]
+        norm = " ".join(tokens)
+        if self._exact.get(norm) == key:
+            del self._exact[norm]
+        self._postings[max(tokens, key=len)].discard(key)
+        if self._grams is not None:
+            self._gram_total -= self._gram_counts.pop(key)
+            for g in _trigrams(norm):
+                self._grams[g].discard(key)
+
+    @property
+    def nbytes(self):
+        """Estimated size, for the memory_index() LRU."""
+        return INDEX_ENTRY_BYTES * len(self._entries) + INDEX_GRAM_BYTES * self._gram_total
+
+    def add(self, key):
+        """Index a (new or re-taught) memory key; call after setting memory[key]."""
+        with self._lock:
+            self._add(key)
+            self._size = len(self.memory)
+
+    def sync(self):
+        # memory replaced wholesale or entries removed elsewhere: start over
+        with self._lock:
+            if self._size != len(self.memory):
+                self._rebuild()
+
+    def _contained(self, present):
+        # most specific entry whose tokens are all in `present`
+        best, best_rank = None, None
+        for tok in present:
+            for key in self._postings.get(tok, ()):
+                entry_tokens, seq = self._entries[key]
+                if all(t in present for t in entry_tokens):
+                    rank = (len(entry_tokens), sum(map(len, entry_tokens)), seq)
+                    if best_rank is None or rank > best_rank:
+                        best, best_rank = key, rank
+        return best
+
+    def lookup(self, text):
+        """Memory key matching `text` exactly or by whole tokens, or None."""
+        tokens = normalize_tokens(text)
+        if not tokens:
+            return None
+        with self._lock:
+            key = self._exact.get(" ".join(tokens))
+            if key is not None:
+                return key
+            return self._contained(set(tokens))
+
+    def fuzzy_lookup(self, text):
+        """Memory key matching `text` by token prefixes, else by trigram similarity, or None."""
+        tokens = normalize_tokens(text)
+        if not tokens:
+            return None
+        norm = " ".join(tokens)
+        with self._lock:
+            present = set()
+            for tok in tokens:
+                present.update(tok[:k] for k in range(MIN_PREFIX, len(tok)))
+                present.add(tok)
+            best = self._contained(present)
+            if best is not None:
+                return best
+            if self._grams is None:
+                self._build_grams()
+            grams = _trigrams(norm)
+            postings = (self._grams.get(g, ()) for g in grams)
+            shared = Counter(chain.from_iterable(p for p in postings if len(p) <= MAX_POSTING))
+            # Dice >= s needs at least s*|q|/(2-s) shared trigrams, whatever the entry's length
+            needed = MIN_SIMILARITY * len(grams) / (2 - MIN_SIMILARITY)
+            best, best_score = None, MIN_SIMILARITY
+            for key, n in shared.items():
+                if n >= needed:
+                    score = 2 * n / (len(grams) + self._gram_counts[key])
+                    if score >= best_score:
+                        best, best_score = key, score
+            return best
+
+
+_memory_indexes = OrderedDict()  # id(memory) -> MemoryIndex
+_memory_index_bytes = {}         # id(memory) -> nbytes when last used
+_memory_index_total = 0          # sum of _memory_index_bytes (memory_index runs per description)
+_memory_index_lock = threading.Lock()
+
+
+def _note_memory_index(key, nbytes):
+    global _memory_index_total
+    _memory_index_total += nbytes - _memory_index_bytes.get(key, 0)
+    _memory_index_bytes[key] = nbytes
+
+
+def _drop_memory_index(key):
+    global _memory_index_total
+    _memory_index_total -= _memory_index_bytes.pop(key, 0)
+    return _memory_indexes.pop(key, None)
+
+
+def memory_index(memory):
+    """
+    The (cached) MemoryIndex of a memory dict, rebuilt if the dict was changed
+    behind its back. Least recently used indexes go first once their sizes
+    (as of their last use) pass MEMORY_INDEX_MAX_BYTES; the one just asked
+    for always stays.
+    """
+    with _memory_index_lock:
+        index = _memory_indexes.get(id(memory))
+        if index is None or index.memory is not memory:
+            index = None
+        else:
+            _memory_indexes.move_to_end(id(memory))
+    if index is None:
+        index = MemoryIndex(memory)
+        with _memory_index_lock:
+            _memory_indexes[id(memory)] = index
+    else:
+        index.sync()
+    with _memory_index_lock:
+        if _memory_indexes.get(id(memory)) is index:
+            # sizes grow after the fact (taught keys, the fuzzy trigrams): refresh on every use
+            _note_memory_index(id(memory), index.nbytes)
+            while len(_memory_indexes) > 1 and _memory_index_total > MEMORY_INDEX_MAX_BYTES:
+                _drop_memory_index(next(iter(_memory_indexes)))
+    return index
+
+
+def remember(memory, key, category):
+    """memory[key] = category, keeping an already built index current without a rebuild."""
+    memory[key] = category
+    with _memory_index_lock:
+        index = _memory_indexes.get(id(memory))
+    if index is not None and index.memory is memory:
+        index.add(key)
+
+
+def match_category(description, memory=None):
+    """
+    Taught memory (exact, then whole-token match), then the first merchant
+    keyword hit, then a fuzzy (prefix / typo) memory match; None if none.
+    """
+    if not isinstance(description, str) or description.strip() == "":
+        return None
+    text = description.lower()
+    # direct memory exact match first
+    if memory:
+        if text in memory:
+            return memory[text]
+        key = memory_index(memory).lookup(text)
+        if key is not None:
+            return memory[key]
+    # keyword scan: one pass through the shared compiled automaton
+    cat = MERCHANTS.match(text)
+    if cat is None and memory:
+        key = memory_index(memory).fuzzy_lookup(text)
+        if key is not None:
+            return memory[key]
+    return cat
+
+
+def auto_category(description, memory=None, model=None):
+    """match_category, then the user's classifier (when given), then "Others"."""
+    cat = match_category(description, memory)
+    if cat is None and model is not None and isinstance(description, str) and description.strip():
+        cat = model.predict([description.lower()])[0]
+    return cat or "Others"
+
+
+CATEGORY_MEMO_SIZE = int(os.environ.get("EXPENSE_CATEGORY_MEMO", "4096"))
+MEMO_STATS = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+class CategoryMemo:
+    """
+    Bounded LRU of description -> auto_category result for one user's memory.
+    Cleared by invalidate() whenever that memory is taught, and automatically
+    when a different / resized memory dict or another model is passed in, or
+    the merchant dictionary is reloaded.
+    """
+
+    def __init__(self, max_entries=CATEGORY_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            MEMO_STATS["invalidations"] += 1
+
+    def get(self, description, memory=None, model=None):
+        MERCHANTS.refresh()
+        stamp = (id(memory), len(memory) if memory else 0, id(model), MERCHANTS.version)
+        with self._lock:
+            if stamp != self._stamp:
+                self._entries.clear()
+                self._stamp = stamp
+            cat = self._entries.get(description)
+            if cat is not None:
+                self._entries.move_to_end(description)
+                MEMO_STATS["hits"] += 1
+                return cat
+        MEMO_STATS["misses"] += 1
+        return None
+
+    def put(self, description, cat):
+        with self._lock:
+            self._entries[description] = cat
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def category(self, description, memory=None, model=None):
+        if not isinstance(description, str):
+            return auto_category(description, memory, model)
+        cat = self.get(description, memory, model)
+        if cat is None:
+            cat = auto_category(description, memory, model)
+            self.put(description, cat)
+        return cat
+
+    def stats(self):
+        with self._lock:
+            return dict(MEMO_STATS, entries=len(self._entries), max_entries=self.max_entries)
+
+
+def categorize_series(descriptions, memory=None, memo=None, model=None):
+    """
+    auto_category for a whole column (uploads): the descriptions are
+    deduplicated, each distinct one is resolved once against memory and the
+    keywords (through `memo` when given), the ones still unresolved go to the
+    classifier in a single predict call, and the results are mapped back
+    with a single take.
+    """
+    values = descriptions.astype(str)
+    codes, uniques = pd.factorize(values)
+    resolved = np.empty(len(uniques) + 1, dtype=object)
+    resolved[-1] = "Others"
+    pending = []
+    for i, u in enumerate(uniques):
+        cat = memo.get(u, memory, model) if memo is not None else None
+        if cat is None:
+            cat = match_category(u, memory)
+            if cat is None and model is not None and u.strip():
+                pending.append(i)
+                continue
+            cat = cat or "Others"
+            if memo is not None:
+                memo.put(u, cat)
+        resolved[i] = cat
+    if pending:
+        predicted = model.predict([uniques[i].lower() for i in pending])
+        for i, cat in zip(pending, predicted):
+            resolved[i] = cat or "Others"
+            if memo is not None:
+                memo.put(uniques[i], resolved[i])
+    return pd.Series(resolved[codes], index=descriptions.index)
+
+
+def description_key(descriptions):
+    """The taught-memory key of each description (lowercase, stripped)."""
+    return descriptions.astype(str).str.lower().str.strip()
+
+
+class DescriptionIndex:
+    """
+    description key -> positions of the expense rows carrying it, so a
+    correction can be applied to every matching row at once. Built in one
+    groupby; still valid after edits that leave descriptions alone, which is
+    what `frame` records (the caller moves it along with the ledger).
+    """
+
+    def __init__(self, df):
+        self.frame = df
+        keys = description_key(df["description"]) if "description" in df.columns else pd.Series(dtype=str)
+        self._rows = keys.reset_index(drop=True).groupby(keys.to_numpy(), sort=False).indices
+
+    def rows(self, key):
+        return self._rows.get(key, np.empty(0, dtype=np.intp))
+
+    def changes(self, key, col, value):
+        """Positions of the rows with this key whose `col` is not already `value`."""
+        pos = self.rows(key)
+        if len(pos):
+            pos = pos[self.frame[col].to_numpy()[pos] != value]
+        return pos
+
+
+class Rollups:
+    """
+    Running totals in integer paise (plus row counts) keyed by day, month,
+    week, ISO week number, label and (month, label). `label_col` is "category" for expenses and
+    "source" for incomes. Rows without a valid date only count towards the
+    total / label totals, like the groupbys they replace.
+    """
+
+    def __init__(self, label_col):
+        self.label_col = label_col
+        self.total = 0
+        self.count = 0
+        self.daily = {}        # Timestamp -> (paise, rows)
+        self.monthly = {}      # Period('M') -> (paise, rows)
+        self.weekly = {}       # (year, ISO week, week start) -> (paise, rows)
+        self.week_of_year = {} # ISO week number -> (paise, rows)
+        self.by_label = {}     # label -> (paise, rows)
+        self.month_label = {}  # (Period('M'), label) -> (paise, rows)
+        self.version = None    # owner's change counter for the frame these totals describe
+
+    @classmethod
+    def from_frame(cls, df, label_col):
+        r = cls(label_col)
+        r.add_frame(df)
+        return r
+
+    # ------------------------- updates -------------------------
+    def add_frame(self, df, sign=1):
+        """Fold a batch of rows in (sign=-1 takes them out); cost depends on the batch only."""
+        if df is None or df.empty:
+            return
+        date = pd.to_datetime(df["date"], errors="coerce").dt.normalize()
+        batch = pd.DataFrame({
+            "paise": to_paise(df["amount"]).fillna(0).astype("int64"),
+            "date": date,
+            "month": date.dt.to_period("M"),
+            "year": date.dt.year,
+            "week": date.dt.isocalendar().week,
+            "week_start": date - pd.to_timedelta(date.dt.weekday, unit="D"),
+            "label": df[self.label_col].astype(object),
+        })
+        self.total += sign * int(batch["paise"].sum())
+        self.count += sign * len(batch)
+        self._fold(self.daily, batch.groupby("date")["paise"], sign)
+        self._fold(self.monthly, batch.groupby("month")["paise"], sign)
+        self._fold(self.weekly, batch.groupby(["year", "week", "week_start"])["paise"], sign)
+        self._fold(self.week_of_year, batch.groupby("week")["paise"], sign)
+        self._fold(self.by_label, batch.groupby("label")["paise"], sign)
+        self._fold(self.month_label, batch.groupby(["month", "label"])["paise"], sign)
+
+    def remove_frame(self, df):
+        self.add_frame(df, sign=-1)
+
+    @staticmethod
+    def _fold(target, grouped, sign):
+        agg = grouped.agg(["sum", "count"])
+        for key, paise, rows in zip(agg.index, agg["sum"], agg["count"]):
+            cur = target.get(key, (0, 0))
+            new = (cur[0] + sign * int(paise), cur[1] + sign * int(rows))
+            if new[1] <= 0:
+                target.pop(key, None)
+            else:
+                target[key] = new
+
+    # ------------------------- read side (rupees) -------------------------
+    @staticmethod
+    def _frame(items, key_cols, value_col="amount"):
+        rows = [(*(k if isinstance(k, tuple) else (k,)), v[0] / 100) for k, v in items]
+        df = pd.DataFrame(rows, columns=key_cols + [value_col])
+        df[value_col] = df[value_col].astype("float64")
+        return df.sort_values(key_cols).reset_index(drop=True) if not df.empty else df
+
+    @property
+    def total_amount(self):
+        return self.total / 100
+
+    def daily_frame(self):
+        """date (datetime64) / amount, like groupby(date.dt.date).sum()."""
+        df = self._frame(self.daily.items(), ["date"])
+        df["date"] = pd.to_datetime(df["date"])
+        return df
+
+    def monthly_frame(self):
+        """date (Period 'M') / amount, like groupby(date.dt.to_period('M')).sum()."""
+        df = self._frame(self.monthly.items(), ["date"])
+        df["date"] = pd.PeriodIndex(df["date"], freq="M")
+        return df
+
+    def yearly_frame(self):
+        """date (year int) / amount, like groupby(date.dt.year).sum()."""
+        m = self.monthly_frame()
+        return m.groupby(m["date"].dt.year)["amount"].sum().reset_index()
+
+    def label_frame(self):
+        """<label_col> / amount, like groupby(label_col).sum()."""
+        return self._frame(self.by_label.items(), [self.label_col])
+
+    def month_label_frame(self):
+        """date (Period 'M') / <label_col> / amount."""
+        df = self._frame(self.month_label.items(), ["date", self.label_col])
+        df["date"] = pd.PeriodIndex(df["date"], freq="M")
+        return df
+
+    def weekly_frame(self):
+        """year / week / week_start / amount, same keys the Expenses page used."""
+        df = self._frame(self.weekly.items(), ["year", "week", "week_start"])
+        if df.empty:
+            return pd.DataFrame(columns=["year", "week", "week_start", "amount"])
+        df["year"] = df["year"].astype("int32")
+        df["week"] = df["week"].astype("UInt32")
+        df["week_start"] = pd.to_datetime(df["week_start"])
+        return df
+
+    def month_of_year_total(self, month):
+        """Sum over every year for calendar month `month` (the pages' 'this month')."""
+        return sum(v[0] for k, v in self.monthly.items() if k.month == month) / 100
+
+    def year_total(self, year):
+        return sum(v[0] for k, v in self.monthly.items() if k.year == year) / 100
+
+    def week_of_year_total(self, week):
+        """Sum over every year for ISO week number `week`."""
+        return self.week_of_year.get(week, (0, 0))[0] / 100
+
+
+# ------------------------- KPIs -------------------------
+def stat_cards(exp_df, now=None):
+    """Total / this month / avg monthly / records for render_stat_cards()."""
+    if exp_df.empty:
+        return {"total": 0, "this_month": 0, "avg_month": 0, "records": 0}
+    now = now or datetime.now()
+    dates = pd.to_datetime(exp_df["date"], errors="coerce")
+    amount = exp_df["amount"].astype(float)
+    avg_month = 0
+    if dates.notnull().any():
+        avg_month = amount.groupby(dates.dt.to_period("M")).sum().mean()
+        avg_month = 0 if np.isnan(avg_month) else avg_month
+    return {
+        "total": amount.sum(),
+        "this_month": amount[dates.dt.month == now.month].sum(),
+        "avg_month": avg_month,
+        "records": len(exp_df),
+    }
+
+
+def dashboard_stats(exp_roll, inc_roll, today=None):
+    """Expense + income cards and the financial health score for the Dashboard."""
+    today = today or date.today()
+    exp_monthly = exp_roll.monthly_frame()
+    total_spent = exp_roll.total_amount
+    total_income = inc_roll.total_amount
+    surplus = max(0, total_income - total_spent)
+    health = (surplus / total_income * 100) if total_income > 0 else 0
+    return {
+        "total_spent": total_spent,
+        "this_month_spent": exp_roll.month_of_year_total(today.month),
+        "avg_monthly_spend": exp_monthly["amount"].mean() if not exp_monthly.empty else 0,
+        "total_records": exp_roll.count,
+        "total_income": total_income,
+        "monthly_income": inc_roll.month_of_year_total(today.month),
+        "yearly_income": inc_roll.year_total(today.year),
+        "weekly_income": inc_roll.week_of_year_total(today.isocalendar()[1]),
+        "health": max(0, min(100, health)),
+    }
+
+
+def yearly_income_by_source(inc_roll, year):
+    """source / amount for calendar year `year`."""
+    df_year = inc_roll.month_label_frame()
+    df_year = df_year[df_year["date"].dt.year == year]
+    return df_year.groupby("source")["amount"].sum().reset_index()
+
+
+def income_vs_expense(exp_roll, inc_roll):
+    """date (Period 'M') / income / expense / month (str), outer-joined on month."""
+    me = exp_roll.monthly_frame().rename(columns={"amount": "expense"})
+    mi = inc_roll.monthly_frame().rename(columns={"amount": "income"})
+    combined = pd.merge(mi, me, on="date", how="outer").fillna(0)
+    combined["month"] = combined["date"].astype(str)
+    return combined
+
+
+def income_overview(inc_roll):
+    """Income page overview card: total, average per month, primary source, last date (from the rollups)."""
+    total_income = inc_roll.total_amount
+    # most frequent source, ties going to the first in sort order (like Series.mode()[0])
+    sources = sorted(inc_roll.by_label.items(), key=lambda kv: (-kv[1][1], str(kv[0])))
+    return {
+        "total_income": total_income,
+        "avg_income": total_income / max(1, len(inc_roll.monthly)),
+        "top_source": sources[0][0] if sources else "N/A",
+        "last_date": max(inc_roll.daily) if inc_roll.daily else pd.NaT,
+    }
+
+
+def budget_progress(spent, goal):
+    """Percent of the monthly goal already spent (0 when no goal is set)."""
+    return (spent / goal) * 100 if goal > 0 else 0
+
+
+# ------------------------- forecasts -------------------------
+def weekly_change(weekly):
+    """Percent change of the last week vs the one before, None with < 2 weeks."""
+    if len(weekly) < 2:
+        return None
+    current_week = weekly.iloc[-1]["amount"]
+    prev_week = weekly.iloc[-2]["amount"]
+    return ((current_week - prev_week) / prev_week) * 100 if prev_week != 0 else 0
+
+
+def predict_next_week(weekly):
+    """LinearRegression over the weekly totals, None with < 3 weeks."""
+    if len(weekly) < 3:
+        return None
+    X = np.arange(len(weekly)).reshape(-1, 1)
+    model = LinearRegression().fit(X, weekly["amount"].values)
+    return float(model.predict([[len(weekly)]])[0])
+
+
+def forecast_daily(daily, n=10):
+    """
+    Forecast page: 3-day smoothed daily totals, linear trend, next `n` days
+    (plus the small sine variation the page has always added).
+    `daily` is Rollups.daily_frame(); returns date / predicted_amount.
+    """
+    smoothed = daily["amount"].rolling(window=3, min_periods=1).mean()
+    X = np.arange(len(daily)).reshape(-1, 1)
+    model = LinearRegression().fit(X, smoothed.values)
+    future_index = np.arange(len(daily), len(daily) + n)
+    preds = model.predict(future_index.reshape(-1, 1))
+    preds = preds + np.sin(np.linspace(0, 2 * np.pi, n)) * 100
+    last_day = daily["date"].max()
+    future_dates = [last_day + timedelta(days=i + 1) for i in range(n)]
+    return pd.DataFrame({"date": future_dates, "predicted_amount": np.round(preds, 2)})
+
+
+# ------------------------- reports / advice -------------------------
+def report_summary(exp_roll):
+    """Reports page numbers and tables, all from the expense rollups."""
+    per_cat = exp_roll.label_frame().sort_values("amount", ascending=False).reset_index(drop=True)
+    total_spent = exp_roll.total_amount
+    monthly = exp_roll.monthly_frame()
+    monthly["Month"] = monthly["date"].astype(str)
+    return {
+        "total_spent": total_spent,
+        "start_date": min(exp_roll.daily).date() if exp_roll.daily else None,
+        "end_date": max(exp_roll.daily).date() if exp_roll.daily else None,
+        "avg_monthly": total_spent / max(1, len(exp_roll.monthly)),
+        "top_cat": per_cat.iloc[0]["category"] if not per_cat.empty else "N/A",
+        "per_cat": per_cat,
+        "monthly": monthly.rename(columns={"amount": "Total Amount (₹)"})[["Month", "Total Amount (₹)"]],
+        "yearly": exp_roll.yearly_frame().rename(columns={"date": "Year", "amount": "Total Amount (₹)"}),
+    }
+
+
+GENERAL_TIPS = [
+    "📅 Try maintaining a fixed monthly budget for each category (Food, Travel, Entertainment).",
+    "🍽️ Prepare meals at home more often — saves ₹2,000–₹4,000 monthly.",
+    "🧾 Use a spending tracker app to monitor expenses daily.",
+    "💳 Avoid EMI purchases unless necessary — interest eats into savings.",
+    "🛍️ Delay luxury buys using the **24-hour rule** before confirming a purchase.",
+    "💡 Automate savings transfers every salary day — treat savings as an expense.",
+    "📈 Follow the **50-30-20 rule**: 50% needs, 30% wants, 20% savings.",
+    "📊 Review this dashboard weekly to track spending drift.",
+    "🏦 Keep 3 months’ expense as emergency savings — ensures stability.",
+    "🧠 Use cashback or reward offers smartly — not as excuses to overspend.",
+]
+
+
+def advice(exp_df, exp_roll, total_income):
+    """AI Advice page: category breakdown, top category and the tips list."""
+    category_spending = exp_roll.label_frame()
+    category_spending = category_spending.sort_values(by="amount", ascending=False).reset_index(drop=True)
+    total_spent = category_spending["amount"].sum()
+    top_cat = category_spending.iloc[0]["category"]
+    top_amt = category_spending.iloc[0]["amount"]
+    tips = []
+
+    # 1️⃣ Category-based smart advice
+    for cat, amt in zip(category_spending["category"], category_spending["amount"]):
+        if amt > 0.25 * total_spent:
+            tips.append(f"⚠️ Your spending on **{cat}** is unusually high (₹{amt:,.0f}). Try limiting this to 20% of total expenses next month.")
+        elif amt < 0.05 * total_spent:
+            tips.append(f"✅ Spending on **{cat}** is under control — great job maintaining discipline!")
+
+    # 2️⃣ Income to expense ratio analysis
+    if total_income > 0:
+        ratio = (total_spent / total_income) * 100
+        if ratio > 80:
+            tips.append("🚨 You're spending over **80% of your income**! Consider reviewing essential vs non-essential expenses.")
+        elif ratio > 60:
+            tips.append("💡 Spending between 60–80% of income — you can aim to save a little more each month.")
+        else:
+            tips.append("🟢 Excellent! You're spending wisely and maintaining a good savings margin.")
+        # AI Suggested savings
+        tips.append(f"💰 Based on your income, you should save **₹{round(total_income * 0.2):,} (20%)** monthly as your base goal.")
+
+    # 3️⃣ Detecting overspending patterns based on user data
+    recent_expenses = exp_df.nlargest(5, "date")   # no full sort of the ledger
+    avg_expense = exp_roll.total_amount / exp_roll.count if exp_roll.count else 0
+    for cat, amt in zip(recent_expenses["category"], recent_expenses["amount"]):
+        if amt > avg_expense * 1.5:
+            tips.append(f"🧐 Your recent expense in **{cat} (₹{amt})** was significantly higher than average. Recheck if it was necessary.")
+
+    # 4️⃣ General lifestyle & budget tips
+    tips.extend(GENERAL_TIPS)
+    return {
+        "category_spending": category_spending,
+        "total_spent": total_spent,
+        "top_cat": top_cat,
+        "top_amt": top_amt,
+        "percent": (top_amt / total_spent) * 100,
+        "tips": tips,
+    }
+
+
+# ------------------------- login prefetch -------------------------
+ROLLUP_LABELS = {"expenses": "category", "incomes": "source"}
+PREFETCH_MAX_BYTES = int(os.environ.get("EXPENSE_PREFETCH_MB", "64")) * 1024 * 1024
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ledger-prefetch")
+_prefetches = OrderedDict()  # (store id, username) -> Future
+_prefetch_bytes = {}         # (store id, username) -> frame bytes, once loaded
+_prefetch_lock = threading.Lock()
+
+
+def _versions(store, username):
+    return {ledger: store.version(username, ledger) for ledger in ("expenses", "incomes", "memory")}
+
+
+def load_session(store, username):
+    """
+    What login puts in the session: frames, memory and rollups (+ the versions
+    they were read at). `store` is a CachedStore, whose frames are normalized.
+    """
+    store.ensure_user(username)
+    session = {"versions": _versions(store, username), "rollups": {}}
+    for ledger, label_col in ROLLUP_LABELS.items():
+        # the store's shared (already normalized) frame, as is: sessions never copy the ledger
+        df = store.load(username, ledger)
+        session[ledger] = df
+        session["rollups"][ledger] = Rollups.from_frame(df, label_col)
+    session["memory"] = store.load(username, "memory")
+    return session
+
+
+def _session_bytes(session):
+    return sum(int(session[ledger].memory_usage(deep=True).sum()) for ledger in ROLLUP_LABELS)
+
+
+def _pop_prefetch(key):
+    _prefetch_bytes.pop(key, None)
+    return _prefetches.pop(key, None)
+
+
+def _prefetch_loaded(key, fut):
+    # size is known once loaded: oldest prefetches go first past PREFETCH_MAX_BYTES
+    try:
+        nbytes = _session_bytes(fut.result())
+    except Exception:
+        nbytes = 0
+    with _prefetch_lock:
+        if _prefetches.get(key) is not fut:
+            return  # already taken or dropped
+        _prefetch_bytes[key] = nbytes
+        while sum(_prefetch_bytes.values()) > PREFETCH_MAX_BYTES:
+            _pop_prefetch(next(k for k in _prefetches if k in _prefetch_bytes))
+
+
+def prefetch_session(store, username):
+    """
+    Start load_session on a background thread (once per username); returns the
+    Future. Only for a user who has already authenticated.
+    """
+    key = (id(store), username)
+    with _prefetch_lock:
+        fut = _prefetches.get(key)
+        if fut is not None:
+            return fut
+        fut = _prefetch_pool.submit(load_session, store, username)
+        _prefetches[key] = fut
+    # outside the lock: the callback runs right here if the load already finished
+    fut.add_done_callback(lambda f: _prefetch_loaded(key, f))
+    return fut
+
+
+def drop_prefetch(store, username):
+    """Forget a prefetched session (failed login): its frames are not kept around."""
+    with _prefetch_lock:
+        _pop_prefetch((id(store), username))
+
+
+def take_session(store, username):
+    """
+    The prefetched session if there is one and nothing changed since it was
+    read, otherwise a fresh synchronous load. Each prefetch is used only once
+    (its rollups become that session's own).
+    """
+    with _prefetch_lock:
+        fut = _pop_prefetch((id(store), username))
+    if fut is not None:
+        try:
+            session = fut.result()
+            if session["versions"] == _versions(store, username):
+                return session
+        except Exception:
+            pass
+    return load_session(store, username)
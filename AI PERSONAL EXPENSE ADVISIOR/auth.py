@@ -2,63 +2,281 @@
 import json
 import os
 import hashlib
+import hmac
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 USERS_FILE = "users_db.json"
 
-def _load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
+# user store backend (EXPENSE_USER_STORE env var):
+# - "json"   : users_db.json, rewritten in full on every signup / reset (original)
+# - "sqlite" : one row per user in EXPENSE_USERS_DB, username is the primary key;
+#              users_db.json is imported the first time the database is opened
+USER_STORE = os.environ.get("EXPENSE_USER_STORE", "json").strip().lower()
+USERS_DB = os.environ.get("EXPENSE_USERS_DB", "users.db")
+USER_FIELDS = ("fullname", "password", "security_question", "security_answer")
+
+# in-memory user index, re-parsed only when USERS_FILE's (mtime, size) changes
+_index = {"token": None, "users": {}}
+_index_lock = threading.Lock()
+
+def _file_token():
+    try:
+        st = os.stat(USERS_FILE)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def _read_users_file():
     try:
         with open(USERS_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
         return {}
 
+def _user_index():
+    """username -> user record (shared, treat as read-only)."""
+    token = _file_token()
+    with _index_lock:
+        if token != _index["token"]:
+            _index["users"] = _read_users_file() if token is not None else {}
+            _index["token"] = token
+        return _index["users"]
+
 def _save_users(users):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
+    tmp = USERS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(users, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, USERS_FILE)
+    with _index_lock:
+        _index["users"] = users
+        _index["token"] = _file_token()
+
+
+class JsonUserStore:
+    """users_db.json behind the cached index; writes rewrite the file under a lock."""
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+
+    def get(self, username):
+        return _user_index().get(username)
+
+    def add(self, username, record):
+        """False if the username is taken."""
+        with self._write_lock:
+            users = dict(_read_users_file())
+            if username in users:
+                return False
+            users[username] = record
+            _save_users(users)
+            return True
+
+    def add_many(self, records):
+        """username -> record; one read + one write of the file. Returns the usernames added."""
+        with self._write_lock:
+            users = dict(_read_users_file())
+            added = [u for u in records if u not in users]
+            users.update((u, records[u]) for u in added)
+            _save_users(users)
+            return added
+
+    def update(self, username, **fields):
+        with self._write_lock:
+            users = dict(_read_users_file())
+            if username not in users:
+                return False
+            users[username] = dict(users[username], **fields)
+            _save_users(users)
+            return True
+
+    def all(self):
+        return dict(_user_index())
+
+
+class SqliteUserStore:
+    """
+    One row per user, username as PRIMARY KEY (so a duplicate signup fails in
+    the database, even across processes). Signup / reset touch one row only.
+    """
+
+    def __init__(self, db_path=USERS_DB):
+        import sqlite3
+
+        self._lock = threading.RLock()
+        self._integrity_error = sqlite3.IntegrityError
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY, fullname TEXT, password TEXT,
+                security_question TEXT, security_answer TEXT);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._import_json()
+        self.conn.commit()
+
+    def _import_json(self):
+        """Copy users_db.json in once; later edits to the file are ignored."""
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                return
+            users = _read_users_file()
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO users (username, {', '.join(USER_FIELDS)}) VALUES (?, ?, ?, ?, ?)",
+                [(u,) + tuple(rec.get(f) for f in USER_FIELDS) for u, rec in users.items()])
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (str(len(users)),))
+
+    @staticmethod
+    def _record(row):
+        # same shape as a users_db.json entry (absent fields stay absent)
+        return {f: v for f, v in zip(USER_FIELDS, row) if v is not None}
+
+    def get(self, username):
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(USER_FIELDS)} FROM users WHERE username = ?", (username,)).fetchone()
+        return self._record(row) if row else None
+
+    def add(self, username, record):
+        try:
+            with self._lock, self.conn:
+                self.conn.execute(
+                    f"INSERT INTO users (username, {', '.join(USER_FIELDS)}) VALUES (?, ?, ?, ?, ?)",
+                    (username,) + tuple(record.get(f) for f in USER_FIELDS))
+            return True
+        except self._integrity_error:
+            return False
+
+    def add_many(self, records):
+        """username -> record in one transaction; existing usernames are left alone."""
+        with self._lock, self.conn:
+            existing = {r[0] for r in self.conn.execute("SELECT username FROM users")}
+            added = [u for u in records if u not in existing]
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO users (username, {', '.join(USER_FIELDS)}) VALUES (?, ?, ?, ?, ?)",
+                [(u,) + tuple(records[u].get(f) for f in USER_FIELDS) for u in added])
+        return added
+
+    def update(self, username, **fields):
+        fields = {k: v for k, v in fields.items() if k in USER_FIELDS}
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                f"UPDATE users SET {', '.join(f'{k} = ?' for k in fields)} WHERE username = ?",
+                tuple(fields.values()) + (username,))
+        return cur.rowcount > 0
 
-def _hash_password(password, salt=None):
+    def all(self):
+        with self._lock:
+            rows = self.conn.execute(f"SELECT username, {', '.join(USER_FIELDS)} FROM users").fetchall()
+        return {r[0]: self._record(r[1:]) for r in rows}
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_user_store(mode=None):
+    """One user store per process (Streamlit reruns re-import nothing)."""
+    mode = mode or USER_STORE
+    with _stores_lock:
+        if mode not in _stores:
+            _stores[mode] = SqliteUserStore() if mode == "sqlite" else JsonUserStore()
+        return _stores[mode]
+
+def get_user(username):
+    """Lookup by username (cached index / primary key); None if the user does not exist."""
+    return get_user_store().get(username)
+
+def _load_users():
+    """All users as a dict (copy)."""
+    return get_user_store().all()
+
+# password hashing: "<kdf>$<cost>$<salt>$<hex digest>"
+# - scrypt        : cost = log2(N), r=8, p=1 (memory ~ 128 * r * N bytes)
+# - pbkdf2_sha256 : cost = iterations
+# Legacy "salt$sha256" hashes still verify and are rehashed on the next login.
+KDF = os.environ.get("EXPENSE_KDF", "scrypt").strip().lower()
+KDF = "pbkdf2_sha256" if KDF.startswith("pbkdf2") else "scrypt"
+DEFAULT_KDF_COST = {"scrypt": 14, "pbkdf2_sha256": 600_000}
+KDF_COST = int(os.environ.get("EXPENSE_KDF_COST", "0")) or DEFAULT_KDF_COST[KDF]
+SCRYPT_R, SCRYPT_P = 8, 1
+# hashes run on a bounded pool (hashlib releases the GIL), so a login burst
+# uses at most AUTH_WORKERS cores and never runs the KDF on the script thread
+AUTH_WORKERS = int(os.environ.get("EXPENSE_AUTH_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _auth_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth-kdf")
+        return _pool
+
+def _run_kdf(fn, *args):
+    """Run a hash / verify on the auth pool and wait for it."""
+    return _auth_pool().submit(fn, *args).result()
+
+def _derive(password, salt, kdf, cost):
+    if kdf == "scrypt":
+        n = 1 << cost
+        return hashlib.scrypt(password.encode("utf-8"), salt=salt.encode("utf-8"), n=n,
+                              r=SCRYPT_R, p=SCRYPT_P, maxmem=256 * SCRYPT_R * n).hex()
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), cost).hex()
+
+def _hash_password(password, salt=None, kdf=None, cost=None):
     if salt is None:
         salt = uuid.uuid4().hex
-    hash_obj = hashlib.sha256()
-    hash_obj.update((salt + password).encode("utf-8"))
-    return salt + "$" + hash_obj.hexdigest()
+    kdf = kdf or KDF
+    cost = cost or (KDF_COST if kdf == KDF else DEFAULT_KDF_COST[kdf])
+    return f"{kdf}${cost}${salt}${_derive(password, salt, kdf, cost)}"
 
 def _check_password(stored, plain):
+    parts = (stored or "").split("$")
     try:
-        salt, h = stored.split("$", 1)
+        if len(parts) == 2:  # legacy salt$sha256
+            salt, h = parts
+            hash_obj = hashlib.sha256()
+            hash_obj.update((salt + plain).encode("utf-8"))
+            return hmac.compare_digest(hash_obj.hexdigest(), h)
+        kdf, cost, salt, h = parts
+        return hmac.compare_digest(_derive(plain, salt, kdf, int(cost)), h)
     except Exception:
         return False
-    hash_obj = hashlib.sha256()
-    hash_obj.update((salt + plain).encode("utf-8"))
-    return hash_obj.hexdigest() == h
+
+def _needs_rehash(stored):
+    parts = (stored or "").split("$")
+    return len(parts) != 4 or parts[0] != KDF or parts[1] != str(KDF_COST)
 
 def signup(fullname: str, username: str, password: str, sq: str, sa: str) -> str:
     if not username or not password:
         return "Please provide username and password."
-    users = _load_users()
-    if username in users:
+    if get_user(username) is not None:
         return "Username already exists."
 
-    users[username] = {
+    created = get_user_store().add(username, {
         "fullname": fullname or username,
-        "password": _hash_password(password),
+        "password": _run_kdf(_hash_password, password),
         "security_question": sq,
         "security_answer": sa.lower().strip()
-    }
-    _save_users(users)
+    })
+    if not created:
+        return "Username already exists."
     return f"User '{username}' created successfully. You can now login."
 
 
 
 def login(username: str, password: str):
-    users = _load_users()
-    if username not in users:
+    user = get_user(username)
+    if user is None:
         return None
-    user = users[username]
-    if _check_password(user.get("password",""), password):
+    stored = user.get("password", "")
+    if _run_kdf(_check_password, stored, password):
+        # upgrade legacy salt$sha256 hashes (or an older cost) now that we know the password
+        if _needs_rehash(stored):
+            get_user_store().update(username, password=_run_kdf(_hash_password, password))
         # return minimal user object
         return {"username": username, "fullname": user.get("fullname", username)}
     return None
@@ -68,15 +286,98 @@ def logout():
     return True
 
 def reset_password(username: str, answer: str, newpass: str) -> str:
-    users = _load_users()
-    if username not in users:
+    user = get_user(username)
+    if user is None:
         return "User not found."
 
-    if users[username]["security_answer"] != answer.lower().strip():
+    if user["security_answer"] != answer.lower().strip():
         return "Incorrect answer ❌"
 
-    users[username]["password"] = _hash_password(newpass)
-    _save_users(users)
+    get_user_store().update(username, password=_run_kdf(_hash_password, newpass))
     return "Password reset successfully ✔"
 
+# ------------------------- bulk provisioning -------------------------
+def _read_user_rows(path):
+    """Rows of a users .csv (header row) or .jsonl file as dicts."""
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    import csv
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+def provision_users(path, workers=None, cost=None, storage_mode=None):
+    """
+    Create every user in a CSV / JSONL file (username, password, fullname,
+    security_question, security_answer). Passwords are hashed across a process
+    pool, the user store is written once and the users' empty ledgers are
+    created in one batch. Existing / duplicate usernames are skipped.
+    A lower `cost` speeds up big imports; those hashes are upgraded to the
+    configured KDF_COST on each user's first login.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    import time
+
+    import storage
+
+    t0 = time.perf_counter()
+    store = get_user_store()
+    rows, seen = [], set()
+    for row in _read_user_rows(path):
+        username = str(row.get("username") or "").strip()
+        if not username or not row.get("password") or username in seen:
+            continue
+        seen.add(username)
+        if store.get(username) is None:
+            rows.append(row)
+
+    workers = workers or os.cpu_count() or 1
+    hash_one = partial(_hash_password, kdf=KDF, cost=cost or KDF_COST)
+    passwords = [str(r["password"]) for r in rows]
+    if workers > 1 and len(passwords) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            hashes = list(pool.map(hash_one, passwords, chunksize=max(1, len(passwords) // (workers * 8))))
+    else:
+        hashes = [hash_one(p) for p in passwords]
+    t_hash = time.perf_counter()
+
+    records = {}
+    for row, hashed in zip(rows, hashes):
+        username = str(row["username"]).strip()
+        records[username] = {
+            "fullname": row.get("fullname") or username,
+            "password": hashed,
+            "security_question": row.get("security_question") or "",
+            "security_answer": str(row.get("security_answer") or "").lower().strip(),
+        }
+    added = store.add_many(records)
+    t_store = time.perf_counter()
+
+    storage.get_store(storage_mode).ensure_users(added)
+    t_end = time.perf_counter()
+    return {
+        "created": len(added),
+        "skipped": len(seen) - len(added),
+        "hash_s": round(t_hash - t0, 3),
+        "user_store_s": round(t_store - t_hash, 3),
+        "ledgers_s": round(t_end - t_store, 3),
+        "total_s": round(t_end - t0, 3),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="User administration")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    prov = sub.add_parser("provision", help="bulk-create users from a .csv / .jsonl file")
+    prov.add_argument("path")
+    prov.add_argument("--workers", type=int, default=None, help="hashing processes (default: all cpus)")
+    prov.add_argument("--cost", type=int, default=None,
+                      help="KDF cost for the import (upgraded to EXPENSE_KDF_COST on first login)")
+    prov.add_argument("--storage-mode", default=None, help="ledger backend (default EXPENSE_STORAGE_MODE)")
+    args = parser.parse_args()
 
+    if args.cmd == "provision":
+        print(json.dumps(provision_users(args.path, args.workers, args.cost, args.storage_mode), indent=2))
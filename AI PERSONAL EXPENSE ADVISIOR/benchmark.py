@@ -0,0 +1,534 @@
+# benchmark.py
+"""
+Benchmark harness for the expense advisor's computation paths.
+
+Generates synthetic ledgers in the app's CSV schema
+(date,amount,description,category / date,amount,source,id) and times each
+path the Streamlit pages run on a rerun, without Streamlit:
+
+    python benchmark.py                               # 1k .. 1M rows
+    python benchmark.py --sizes 1000 10000000 --out bench.json
+    python benchmark.py --compare bench_old.json      # ratios vs an older run
+    python benchmark.py --sizes --auth-costs 12 14 16  # logins/s per KDF cost only
+    python benchmark.py --sizes --categorize-rows 1000000
+    python benchmark.py --sizes --classifier-rows 100000
+    python benchmark.py --sizes --memory-entries 50000
+    python benchmark.py --sizes --import-rows 1000000 --mode journal
+    python benchmark.py --sizes --xlsx-rows 100000                  # needs openpyxl
+
+Output is one JSON document (meta + one result per size/path), so runs from
+different versions can be diffed or compared with --compare.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import auth
+import classifier
+import importer
+import storage
+
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+BENCH_USER = "bench"
+CATEGORIES = list(analytics.keyword_map())
+SOURCES = ["Salary", "freelancing", "gaming", "selling"]
+# descriptions as they show up in bank exports: merchant words, ids, noise
+DESCRIPTIONS = [
+    "Cab fare", "Miscellaneous expense", "zomato order", "Swiggy", "blinkit",
+    "UPI/ZOMATO/", "POS DMART ", "Amazon purchase ", "Flipkart order ",
+    "Electricity bill ", "Jio recharge ", "Uber trip ", "Ola ride ",
+    "Netflix subscription", "Apollo pharmacy ", "Udemy course ",
+    "IMPS transfer ", "ATM withdrawal ", "NEFT ", "coffee with friends",
+]
+
+
+# ------------------------- synthetic ledgers -------------------------
+def synthetic_expenses(rows, seed=0, days=5 * 365):
+    """`rows` expense rows over `days` days, shaped like expenses_<user>.csv."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2021-01-01")
+    desc = pd.Series(rng.choice(DESCRIPTIONS, rows))
+    # half the rows carry a reference number, like real statement lines
+    ref = pd.Series(rng.integers(10_000, 99_999_999, rows)).astype(str)
+    desc = desc.where(rng.random(rows) < 0.5, desc + ref)
+    return pd.DataFrame({
+        "date": (start + pd.to_timedelta(rng.integers(0, days, rows), unit="D")).strftime("%Y-%m-%d"),
+        "amount": rng.integers(1_000, 500_000, rows) / 100,
+        "description": desc,
+        "category": rng.choice(CATEGORIES, rows),
+    })
+
+
+def synthetic_incomes(rows, seed=0, days=5 * 365):
+    """`rows` income rows, shaped like incomes_<user>.csv (unique ids)."""
+    rng = np.random.default_rng(seed + 1)
+    start = pd.Timestamp("2021-01-01")
+    return pd.DataFrame({
+        "date": (start + pd.to_timedelta(rng.integers(0, days, rows), unit="D")).strftime("%Y-%m-%d"),
+        "amount": rng.integers(100_000, 20_000_000, rows) / 100,
+        "source": rng.choice(SOURCES, rows),
+        "id": 10**8 + rng.permutation(rows),
+    })
+
+
+def write_user(workdir, expenses, incomes, memory=None):
+    """Lay the ledgers out the way CsvStore expects them for BENCH_USER."""
+    storage._write_frame(expenses, os.path.join(workdir, storage.ledger_path(BENCH_USER, "expenses")))
+    storage._write_frame(incomes, os.path.join(workdir, storage.ledger_path(BENCH_USER, "incomes")))
+    storage._write_memory(memory or {}, os.path.join(workdir, storage.ledger_path(BENCH_USER, "memory")))
+
+
+# ------------------------- computation paths -------------------------
+# Each path takes the session context (ledgers, rollups, memory) and runs
+# what the matching page computes, minus the st.* / plotly rendering.
+def make_backend(mode, workdir):
+    if mode == "sqlite":
+        return storage.SqliteStore(os.path.join(workdir, "ledgers.db"))
+    if mode == "arrow":
+        return storage.ArrowStore()
+    if mode == "journal":
+        return storage.JournalStore()
+    return storage.CsvStore()
+
+
+def path_login_load(ctx):
+    """Login: load both ledgers + memory, normalize, build rollups."""
+    store = make_backend(ctx["mode"], ctx["workdir"])
+    store.ensure_user(BENCH_USER)
+    exp = storage.normalize_frame(store.load(BENCH_USER, "expenses"), "expenses")
+    inc = storage.normalize_frame(store.load(BENCH_USER, "incomes"), "incomes")
+    store.load(BENCH_USER, "memory")
+    analytics.Rollups.from_frame(exp, "category")
+    analytics.Rollups.from_frame(inc, "source")
+    return len(exp)
+
+
+def path_auto_category(ctx):
+    """Sidebar upload without a category column: batch categorization."""
+    new = ctx["raw_expenses"][["date", "amount", "description"]].copy()
+    new["category"] = analytics.categorize_series(new["description"], ctx["memory"])
+    return len(new)
+
+
+def path_render_stat_cards(ctx):
+    """render_stat_cards(): total / this month / avg monthly / records."""
+    return analytics.stat_cards(ctx["expenses"])
+
+
+def path_dashboard(ctx):
+    """Dashboard KPIs, category pie, daily trend, income by source, income vs expense."""
+    exp_roll, inc_roll = ctx["exp_roll"], ctx["inc_roll"]
+    stats = analytics.dashboard_stats(exp_roll, inc_roll)
+    exp_roll.label_frame()
+    exp_roll.daily_frame()
+    analytics.yearly_income_by_source(inc_roll, datetime.now().year)
+    analytics.income_vs_expense(exp_roll, inc_roll)
+    return stats
+
+
+def path_weekly_prediction(ctx):
+    """Expenses page: weekly totals, week-over-week change, LinearRegression next week."""
+    weekly_expense = ctx["exp_roll"].weekly_frame()
+    analytics.weekly_change(weekly_expense)
+    return analytics.predict_next_week(weekly_expense)
+
+
+def path_forecast(ctx, n=10):
+    """Forecast page: smoothed daily series, regression, next `n` days."""
+    daily = ctx["exp_roll"].daily_frame()
+    if daily.empty:
+        return None
+    return analytics.forecast_daily(daily, n)
+
+
+def path_reports(ctx):
+    """Reports page: overview numbers, per-category / monthly / yearly tables."""
+    return analytics.report_summary(ctx["exp_roll"])
+
+
+def path_ai_advice(ctx):
+    """AI Advice page: category breakdown, income ratio, recent-expense outliers."""
+    return analytics.advice(ctx["expenses"], ctx["exp_roll"], ctx["inc_roll"].total_amount)
+
+
+PATHS = {
+    "login_load": path_login_load,
+    "auto_category": path_auto_category,
+    "render_stat_cards": path_render_stat_cards,
+    "dashboard": path_dashboard,
+    "weekly_prediction": path_weekly_prediction,
+    "forecast": path_forecast,
+    "reports": path_reports,
+    "ai_advice": path_ai_advice,
+}
+
+
+# ------------------------- runner -------------------------
+def timed(fn, ctx, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(ctx)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(sizes=DEFAULT_SIZES, paths=None, repeat=3, mode="csv", income_ratio=0.1, seed=0, log=None):
+    """Time every path at every size; returns the JSON-ready report dict."""
+    paths = paths or list(PATHS)
+    report = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "storage_mode": mode,
+            "repeat": repeat,
+            "income_ratio": income_ratio,
+            "seed": seed,
+        },
+        "results": [],
+    }
+    cwd = os.getcwd()
+    for rows in sizes:
+        workdir = tempfile.mkdtemp(prefix="expense_bench_")
+        try:
+            t0 = time.perf_counter()
+            raw_exp = synthetic_expenses(rows, seed)
+            raw_inc = synthetic_incomes(max(1, int(rows * income_ratio)), seed)
+            write_user(workdir, raw_exp, raw_inc)
+            gen_s = time.perf_counter() - t0
+            # ledgers live in the cwd, like the app
+            os.chdir(workdir)
+            expenses = storage.normalize_frame(raw_exp.copy(), "expenses")
+            incomes = storage.normalize_frame(raw_inc.copy(), "incomes")
+            ctx = {
+                "mode": mode, "workdir": workdir, "memory": {},
+                "raw_expenses": raw_exp, "expenses": expenses, "incomes": incomes,
+                "exp_roll": analytics.Rollups.from_frame(expenses, "category"),
+                "inc_roll": analytics.Rollups.from_frame(incomes, "source"),
+            }
+            for name in paths:
+                times = timed(PATHS[name], ctx, repeat)
+                best = min(times)
+                result = {
+                    "rows": rows,
+                    "path": name,
+                    "min_s": round(best, 6),
+                    "median_s": round(float(np.median(times)), 6),
+                    "mean_s": round(float(np.mean(times)), 6),
+                    "rows_per_s": round(rows / best) if best > 0 else None,
+                    "generate_s": round(gen_s, 3),
+                    "peak_rss_mb": peak_rss_mb(),
+                }
+                report["results"].append(result)
+                if log:
+                    log(f"{rows:>10,} rows  {name:<18} {best * 1000:10.2f} ms")
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def run_auth(costs, kdf="scrypt", threads=8, seconds=2.0, log=None):
+    """
+    Logins/s through auth's verification pool at each KDF cost, with `threads`
+    concurrent callers (a login burst); the first row is the legacy sha256 hash.
+    """
+    legacy_salt = "bench"
+    legacy = legacy_salt + "$" + hashlib.sha256((legacy_salt + "pw").encode()).hexdigest()
+    cases = [("legacy_sha256", None, legacy)]
+    cases += [(kdf, cost, auth._hash_password("pw", kdf=kdf, cost=cost)) for cost in costs]
+    results = []
+    for name, cost, stored in cases:
+        counts = [0] * threads
+        latencies = [0.0] * threads
+        deadline = time.perf_counter() + seconds
+
+        def worker(i):
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                auth._run_kdf(auth._check_password, stored, "pw")
+                latencies[i] += time.perf_counter() - t0
+                counts[i] += 1
+
+        t0 = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        total = sum(counts)
+        result = {
+            "kdf": name,
+            "cost": cost,
+            "threads": threads,
+            "workers": auth.AUTH_WORKERS,
+            "logins": total,
+            "logins_per_s": round(total / elapsed, 1),
+            "mean_latency_ms": round(sum(latencies) / max(1, total) * 1000, 2),
+        }
+        results.append(result)
+        if log:
+            log(f"{name:<14} cost={cost!s:<8} {result['logins_per_s']:>10} logins/s")
+    return results
+
+
+def keyword_loop(description):
+    """The original auto_category keyword scan (nested loop), kept as the baseline."""
+    text = description.lower()
+    for cat, kws in analytics.keyword_map().items():
+        for kw in kws:
+            if kw in text:
+                return cat
+    return "Others"
+
+
+def run_categorize(rows=1_000_000, seed=0, log=None):
+    """Keyword categorization of `rows` synthetic descriptions: nested loop vs compiled matcher."""
+    descriptions = synthetic_expenses(rows, seed)["description"].tolist()
+    t0 = time.perf_counter()
+    baseline = [keyword_loop(d) for d in descriptions]
+    loop_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    compiled = [analytics.auto_category(d) for d in descriptions]
+    matcher_s = time.perf_counter() - t0
+    result = {
+        "rows": rows,
+        "loop_s": round(loop_s, 3),
+        "matcher_s": round(matcher_s, 3),
+        "speedup": round(loop_s / matcher_s, 2) if matcher_s else None,
+        "identical": baseline == compiled,
+    }
+    if log:
+        log(f"categorize {rows:,} rows: loop {loop_s:.2f}s, matcher {matcher_s:.2f}s")
+    return result
+
+
+def run_classifier(rows=100_000, seed=0, log=None):
+    """Train the category classifier on `rows` keyword-labeled descriptions, then batch-predict `rows` more."""
+    train_df = synthetic_expenses(rows, seed)
+    train_df["category"] = [analytics.auto_category(d) for d in train_df["description"]]
+    test = synthetic_expenses(rows, seed + 1)["description"]
+    expected = [analytics.auto_category(d) for d in test]
+    t0 = time.perf_counter()
+    model = classifier.train(train_df, {}, analytics.keyword_map())
+    train_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    predicted = model.predict(test.str.lower().tolist())
+    predict_s = time.perf_counter() - t0
+    agree = sum(p == e for p, e in zip(predicted, expected)) / rows
+    result = {
+        "rows": rows,
+        "train_s": round(train_s, 3),
+        "predict_s": round(predict_s, 3),
+        "agreement": round(agree, 4),
+    }
+    if log:
+        log(f"classifier {rows:,} rows: train {train_s:.2f}s, predict {predict_s:.2f}s, agreement {agree:.1%}")
+    return result
+
+
+def run_memory_index(entries=50_000, lookups=20_000, seed=0, log=None):
+    """Build a MemoryIndex over `entries` taught descriptions and time best-match lookups."""
+    rng = np.random.default_rng(seed)
+    words = ["".join(w) for w in rng.choice(list("abcdefghijklmnopqrstuvwxyz"), (entries // 2, 7))]
+    pairs = rng.integers(0, len(words), (entries, 2))
+    memory = {f"{words[a]} {words[b]}": "Shopping" for a, b in pairs}
+    keys = list(memory)
+    queries = [f"{keys[i].upper()} UPI/{rng.integers(10**6, 10**9)}" for i in rng.integers(0, len(keys), lookups)]
+    t0 = time.perf_counter()
+    index = analytics.MemoryIndex(memory)
+    build_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    found = sum(index.lookup(q) is not None for q in queries)
+    lookup_s = time.perf_counter() - t0
+    result = {
+        "entries": len(memory),
+        "build_s": round(build_s, 3),
+        "lookup_us": round(lookup_s / lookups * 1e6, 1),
+        "found": round(found / lookups, 4),
+    }
+    if log:
+        log(f"memory index {len(memory):,} entries: build {build_s:.2f}s, {result['lookup_us']}us/lookup")
+    return result
+
+
+def run_import(rows=1_000_000, mode="journal", seed=0, log=None):
+    """Stream a `rows`-line statement CSV into a fresh ledger; rows/s and peak RSS growth."""
+    import resource
+
+    workdir = tempfile.mkdtemp(prefix="expense_bench_")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        # written in blocks so generating the statement doesn't set the RSS high-water mark
+        for i, start in enumerate(range(0, rows, 100_000)):
+            block = synthetic_expenses(min(100_000, rows - start), seed + i).drop(columns="category")
+            block.to_csv("statement.csv", index=False, mode="a", header=not i)
+        del block
+        store = make_backend(mode, workdir)
+        store.ensure_user(BENCH_USER)
+        memo = analytics.CategoryMemo()
+        categorize = lambda d: analytics.categorize_series(d, {}, memo)
+        sink = lambda chunk: store.apply(BENCH_USER, "expenses", {"op": "add", "rows": chunk.to_dict("records")})
+        dedup = importer.DedupIndex.from_frame(pd.DataFrame(columns=["date", "amount", "description"]))
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with open("statement.csv", "rb") as f:
+            summary = importer.import_stream(f, "statement.csv", sink, categorize, dedup=dedup)
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # the same statement again: every row must come back as a duplicate
+        t0 = time.perf_counter()
+        with open("statement.csv", "rb") as f:
+            again = importer.import_stream(f, "statement.csv", sink, categorize, dedup=dedup)
+        summary["reimport_s"] = round(time.perf_counter() - t0, 3)
+        summary["reimport_duplicates"] = again["duplicates"]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = dict(summary, mode=mode, peak_rss_growth_mb=round((rss_after - rss_before) / 1024, 1))
+    if log:
+        log(f"import {rows:,} rows ({mode}): {summary['rows_per_s']:,.0f} rows/s, "
+            f"peak RSS +{result['peak_rss_growth_mb']} MB")
+    return result
+
+
+def run_xlsx(rows=100_000, seed=0, log=None):
+    """Read a `rows`-line statement workbook: pd.read_excel vs the streaming read-only reader."""
+    from openpyxl import Workbook
+
+    workdir = tempfile.mkdtemp(prefix="expense_bench_")
+    try:
+        path = os.path.join(workdir, "statement.xlsx")
+        df = synthetic_expenses(rows, seed)
+        # bank exports carry extra columns and sheets the import never uses
+        df["balance"] = np.round(np.cumsum(df["amount"].to_numpy()), 2)
+        df["reference"] = np.arange(rows)
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Statement")
+        ws.append(list(df.columns))
+        for row in df.itertuples(index=False):
+            ws.append(list(row))
+        wb.create_sheet("Summary").append(["rows", rows])
+        wb.save(path)
+        del df, wb
+
+        t0 = time.perf_counter()
+        whole = pd.read_excel(path)
+        read_excel_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        streamed = sum(len(chunk) for chunk in importer.read_xlsx_chunks(path))
+        stream_s = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = {
+        "rows": rows,
+        "read_excel_s": round(read_excel_s, 3),
+        "stream_s": round(stream_s, 3),
+        "speedup": round(read_excel_s / stream_s, 2) if stream_s else None,
+        "same_rows": len(whole) == streamed,
+    }
+    if log:
+        log(f"xlsx {rows:,} rows: read_excel {read_excel_s:.2f}s, read-only stream {stream_s:.2f}s")
+    return result
+
+
+def compare(report, baseline):
+    """min_s ratio (new / old) per (rows, path) present in both runs."""
+    old = {(r["rows"], r["path"]): r["min_s"] for r in baseline["results"]}
+    out = []
+    for r in report["results"]:
+        prev = old.get((r["rows"], r["path"]))
+        if prev:
+            out.append({"rows": r["rows"], "path": r["path"], "old_s": prev,
+                        "new_s": r["min_s"], "ratio": round(r["min_s"] / prev, 3)})
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the expense advisor computation paths")
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(DEFAULT_SIZES),
+                        help="expense rows per run (e.g. 1000 10000000); empty to skip")
+    parser.add_argument("--paths", nargs="+", choices=list(PATHS), default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mode", choices=["csv", "journal", "sqlite", "arrow"], default="csv",
+                        help="storage backend for login_load")
+    parser.add_argument("--income-ratio", type=float, default=0.1, help="income rows per expense row")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    parser.add_argument("--categorize-rows", type=int, default=None,
+                        help="also compare keyword loop vs compiled matcher on this many descriptions")
+    parser.add_argument("--classifier-rows", type=int, default=None,
+                        help="also time training / batch prediction of the category classifier")
+    parser.add_argument("--memory-entries", type=int, default=None,
+                        help="also time taught-memory index lookups with this many entries")
+    parser.add_argument("--import-rows", type=int, default=None,
+                        help="also stream a statement of this many rows into a --mode ledger")
+    parser.add_argument("--xlsx-rows", type=int, default=None,
+                        help="also time pd.read_excel vs the streaming XLSX reader on a workbook this long")
+    parser.add_argument("--auth-costs", type=int, nargs="+",
+                        help="also measure logins/s at these KDF costs (scrypt log2 N / pbkdf2 iterations)")
+    parser.add_argument("--auth-kdf", choices=["scrypt", "pbkdf2_sha256"], default="scrypt")
+    parser.add_argument("--auth-threads", type=int, default=8)
+    parser.add_argument("--auth-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    report = run(args.sizes, args.paths, args.repeat, args.mode, args.income_ratio, args.seed, log=log)
+    if args.categorize_rows:
+        report["categorize"] = run_categorize(args.categorize_rows, args.seed, log=log)
+    if args.classifier_rows:
+        report["classifier"] = run_classifier(args.classifier_rows, args.seed, log=log)
+    if args.memory_entries:
+        report["memory_index"] = run_memory_index(args.memory_entries, seed=args.seed, log=log)
+    if args.import_rows:
+        report["import"] = run_import(args.import_rows, args.mode, args.seed, log=log)
+    if args.xlsx_rows:
+        report["xlsx"] = run_xlsx(args.xlsx_rows, args.seed, log=log)
+    if args.auth_costs:
+        report["auth"] = run_auth(args.auth_costs, args.auth_kdf, args.auth_threads, args.auth_seconds, log=log)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["compare"] = compare(report, json.load(f))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
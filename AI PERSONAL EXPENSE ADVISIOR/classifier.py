@@ -0,0 +1,219 @@
+# classifier.py
+"""
+Per-user category classifier: hashed character n-grams + a linear model
+trained with partial_fit (scikit-learn only, runs offline on CPU).
+
+It is the fallback after taught memory and the merchant keywords:
+descriptions neither of those recognise are predicted here instead of
+landing in "Others". Each user's model is trained (on a background thread)
+on their labeled expense history plus their category memory, updated
+incrementally on every correction and stored next to the ledgers as
+category_model_<user>.joblib, at most once per SAVE_DELAY seconds. The
+model records how many expense rows it was trained on; once the history has
+grown by RETRAIN_GROWTH since then, is_stale() says so and the app retrains
+it in the background.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from storage import safe_user
+
+
+N_FEATURES = 2 ** 16
+MIN_TRAIN_ROWS = 20      # fewer labeled rows than this: no predictions yet
+MIN_PROBA = 0.5          # below this the prediction is dropped ("Others")
+MEMORY_WEIGHT = 5.0      # a taught mapping counts like this many history rows
+MAX_WEIGHT = 20.0        # cap for a description repeated many times in the history
+TRAIN_EPOCHS = 5
+SAVE_DELAY = float(os.environ.get("EXPENSE_MODEL_SAVE_DELAY", "30"))   # seconds between saves of a corrected model
+RETRAIN_GROWTH = 0.25    # retrain once the history grew by this fraction (and MIN_TRAIN_ROWS rows) since the fit
+
+_train_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="category-train")
+_pending_saves = {}   # path -> model waiting for its delayed save
+_saves_lock = threading.Lock()
+
+
+def model_path(username):
+    return f"category_model_{safe_user(username)}.joblib"
+
+
+class CategoryClassifier:
+    """
+    HashingVectorizer(char_wb 2-4) -> SGDClassifier(log_loss). The vectorizer
+    is stateless, so learning a new example is one partial_fit call; only a
+    label the model has never seen needs a full retrain (classes are fixed
+    at the first partial_fit).
+    """
+
+    def __init__(self, classes):
+        self.classes = sorted(set(classes))
+        self.vectorizer = HashingVectorizer(analyzer="char_wb", ngram_range=(2, 4), n_features=N_FEATURES,
+                                            alternate_sign=False, norm="l2", lowercase=True)
+        self.model = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=0)
+        self.n_seen = 0
+        self.history_rows = 0   # expense rows in the history the last full fit saw
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.n_seen >= MIN_TRAIN_ROWS
+
+    def knows(self, label):
+        return label in self.classes
+
+    def fit(self, descriptions, labels, weights=None, epochs=TRAIN_EPOCHS):
+        """Train from scratch (shuffled passes of partial_fit over distinct (description, label) pairs)."""
+        pairs = pd.DataFrame({"d": [str(d) for d in descriptions], "y": list(labels),
+                              "w": 1.0 if weights is None else np.asarray(weights, dtype=float)})
+        pairs = pairs.groupby(["d", "y"], sort=False)["w"].sum().reset_index()
+        X = self.vectorizer.transform(pairs["d"])
+        y = pairs["y"].to_numpy(dtype=object)
+        w = np.minimum(pairs["w"].to_numpy(), MAX_WEIGHT)
+        rng = np.random.default_rng(0)
+        with self._lock:
+            for _ in range(epochs):
+                order = rng.permutation(len(y))
+                self.model.partial_fit(X[order], y[order], classes=self.classes, sample_weight=w[order])
+            self.n_seen = len(descriptions)
+        return self
+
+    def learn(self, descriptions, labels, weight=MEMORY_WEIGHT):
+        """Incremental update (a correction). False if a label is new: retrain instead."""
+        if not all(self.knows(l) for l in labels):
+            return False
+        X = self.vectorizer.transform([str(d) for d in descriptions])
+        with self._lock:
+            self.model.partial_fit(X, np.asarray(labels, dtype=object), classes=self.classes,
+                                   sample_weight=np.full(len(labels), weight))
+            self.n_seen += len(labels)
+        return True
+
+    def predict(self, descriptions):
+        """Batch prediction: a category per description, None where not confident."""
+        if not self.ready or not len(descriptions):
+            return [None] * len(descriptions)
+        # n-gram hashing dominates, so each distinct description is vectorized once
+        codes, uniques = pd.factorize(pd.Series([str(d) for d in descriptions], dtype=object))
+        X = self.vectorizer.transform(uniques)
+        with self._lock:
+            proba = self.model.predict_proba(X)
+        best = proba.argmax(axis=1)
+        labels = np.where(proba[np.arange(len(best)), best] >= MIN_PROBA, self.model.classes_[best], None)
+        return labels[codes].tolist()
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with self._lock:   # not mid partial_fit
+            joblib.dump(self, tmp, compress=3)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path):
+        return joblib.load(path)
+
+
+def training_data(expenses, memory):
+    """(descriptions, labels, weights) from the expense history and the taught memory."""
+    descriptions, labels, weights = [], [], []
+    if expenses is not None and not expenses.empty:
+        df = expenses[["description", "category"]].dropna()
+        df = df[df["description"].astype(str).str.strip() != ""]
+        descriptions += df["description"].astype(str).str.lower().tolist()
+        labels += df["category"].astype(str).tolist()
+        weights += [1.0] * len(df)
+    for key, cat in (memory or {}).items():
+        descriptions.append(str(key))
+        labels.append(str(cat))
+        weights.append(MEMORY_WEIGHT)
+    return descriptions, labels, weights
+
+
+def train(expenses, memory, extra_classes=()):
+    descriptions, labels, weights = training_data(expenses, memory)
+    clf = CategoryClassifier(set(labels) | set(extra_classes))
+    if len(set(labels)) >= 2:
+        clf.fit(descriptions, labels, weights)
+    clf.history_rows = 0 if expenses is None else len(expenses)
+    return clf
+
+
+def is_stale(model, expenses):
+    """True when the expense history outgrew what the model was trained on (cheap: row counts only)."""
+    trained = getattr(model, "history_rows", None)
+    if trained is None:
+        return True   # saved before the count was recorded
+    grown = (0 if expenses is None else len(expenses)) - trained
+    return grown >= max(MIN_TRAIN_ROWS, RETRAIN_GROWTH * trained)
+
+
+def load_or_train(username, expenses, memory, extra_classes=()):
+    """
+    The user's saved model, or a new one trained on their history (and saved).
+    A saved model is returned even if is_stale(): the caller retrains it in the background.
+    """
+    path = model_path(username)
+    if os.path.exists(path):
+        try:
+            return CategoryClassifier.load(path)
+        except Exception:
+            pass
+    clf = train(expenses, memory, extra_classes)
+    clf.save(path)
+    return clf
+
+
+def load_or_train_async(username, expenses, memory, extra_classes=()):
+    """load_or_train on the background thread; returns the Future."""
+    return _train_pool.submit(load_or_train, username, expenses, dict(memory or {}), tuple(extra_classes))
+
+
+def retrain_async(username, expenses, memory, extra_classes=()):
+    """Train from scratch (e.g. a new category) on the background thread and save; returns the Future."""
+    memory = dict(memory or {})
+
+    def _run():
+        clf = train(expenses, memory, extra_classes)
+        with _saves_lock:   # the replaced model's delayed save must not overwrite this one
+            _pending_saves.pop(model_path(username), None)
+        clf.save(model_path(username))
+        return clf
+
+    return _train_pool.submit(_run)
+
+
+def save_later(model, path):
+    """Save within SAVE_DELAY seconds; corrections made meanwhile ride along in the same save."""
+    with _saves_lock:
+        pending = path in _pending_saves
+        _pending_saves[path] = model
+    if not pending:
+        timer = threading.Timer(SAVE_DELAY, flush_save, args=(path,))
+        timer.daemon = True
+        timer.start()
+
+
+def flush_save(path):
+    """Write a pending delayed save now (timer, logout)."""
+    with _saves_lock:
+        model = _pending_saves.pop(path, None)
+    if model is not None:
+        try:
+            model.save(path)
+        except Exception:
+            pass
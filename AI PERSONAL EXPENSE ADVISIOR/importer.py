@@ -0,0 +1,496 @@
+# importer.py
+"""
+Streaming import of expense statements (pandas only, no Streamlit).
+
+A statement is read in chunks of IMPORT_CHUNK_ROWS rows; each chunk is
+normalized, validated, date-parsed and categorized on its own and handed to
+a sink (the app appends it to the ledger store), so a multi-year statement
+never has to sit in memory as one raw frame. The header row picks the
+layout (standard, debit / credit, or a user-defined one) and the columns to
+read; the column mapping is cached per header fingerprint, while the date
+format is detected once per upload. import_stream returns the row
+counts and the throughput so the uploader can report rows/s. DedupIndex
+keeps re-uploaded (overlapping) statements from being counted twice.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from storage import ledger_path, to_paise
+
+IMPORT_CHUNK_ROWS = int(os.environ.get("EXPENSE_IMPORT_CHUNK", "50000"))
+OUTPUT_COLUMNS = ["date", "amount", "description", "category"]
+PARSER_CACHE_MAX = 256
+
+
+class ImportFormatError(ValueError):
+    """The file cannot be imported as a statement (e.g. missing columns)."""
+
+    def __init__(self, message, columns=()):
+        super().__init__(message)
+        self.columns = list(columns)
+
+
+# ------------------------- statement layouts -------------------------
+# role -> header names seen in bank exports, most specific first
+COLUMN_ALIASES = {
+    "date": ["date", "transaction date", "txn date", "tran date", "trans date", "value date", "posting date",
+             "value dt", "txn dt", "date of transaction"],
+    "description": ["description", "narration", "particulars", "transaction details", "details",
+                    "transaction remarks", "remarks", "transaction description"],
+    "amount": ["amount", "transaction amount", "txn amount", "amount (inr)", "amount(inr)", "amount (rs.)"],
+    "debit": ["debit", "debit amount", "debit amt", "debit (inr)", "withdrawal", "withdrawals", "withdrawal amt.",
+              "withdrawal amt", "withdrawal amount", "withdrawal (dr)", "dr amount", "dr"],
+    "credit": ["credit", "credit amount", "credit amt", "credit (inr)", "deposit", "deposits", "deposit amt.",
+               "deposit amt", "deposit amount", "deposit (cr)", "cr amount", "cr"],
+    "direction": ["dr/cr", "cr/dr", "dr / cr", "cr / dr", "debit/credit", "credit/debit"],
+    "category": ["category"],
+}
+# tried in order on a sample of the date column; day-first before month-first
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y", "%d-%b-%Y", "%d %b %Y",
+                "%d-%b-%y", "%d %b %y", "%d %B %Y", "%Y/%m/%d", "%m/%d/%Y", "%Y-%m-%d %H:%M:%S",
+                "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M")
+DATE_SAMPLE = 200
+# values a direction column must hold to be used; anything else (e.g. "Card", "Cash") and it is ignored
+DEBIT_TOKENS = {"dr", "debit"}
+CREDIT_TOKENS = {"cr", "credit"}
+_AMOUNT_JUNK = r"[^0-9.\-]"
+
+
+def normalize_header(name):
+    return " ".join(str(name).strip().lower().split())
+
+
+def header_fingerprint(names):
+    return hashlib.sha1("\x1f".join(normalize_header(n) for n in names).encode("utf-8")).hexdigest()[:16]
+
+
+def detect_date_format(values):
+    """First DATE_FORMATS entry that parses a sample of the string dates; None if none does."""
+    sample = values.head(DATE_SAMPLE * 5).dropna()
+    sample = sample[sample.map(lambda v: isinstance(v, str))].str.strip()
+    sample = sample[sample != ""].head(DATE_SAMPLE)
+    if sample.empty:
+        return None
+    best, best_ok = None, 0.9
+    for fmt in DATE_FORMATS:
+        ok = pd.to_datetime(sample, format=fmt, errors="coerce").notna().mean()
+        if ok == 1.0:
+            return fmt
+        if ok > best_ok:
+            best, best_ok = fmt, ok
+    return best
+
+
+def parse_amounts(values):
+    """Vectorized: "1,234.50", "₹ 99", "(12.00)", "12.00 Dr" -> floats (NaN when there is no number)."""
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_numeric(values, errors="coerce")
+    text = values.astype("string").str.strip()
+    negative = text.str.startswith("(") & text.str.endswith(")")
+    out = pd.to_numeric(text.str.replace(_AMOUNT_JUNK, "", regex=True).replace("", pd.NA), errors="coerce")
+    return out.where(~negative.fillna(False), -out.abs()).astype("float64")
+
+
+class StatementParser:
+    """
+    One statement layout: role -> header names (normalized) plus the date
+    format when the layout fixes one. Expenses are the debit side: with
+    debit / credit columns (or a direction column holding only Dr / Cr /
+    Debit / Credit) credit rows are left out and counted; a single amount
+    column is taken as is. Several description columns (narration + remarks)
+    are joined. The cached parser is shared by every upload with its header;
+    parse with the copy from for_upload(), which detects the date format
+    from its own first chunk.
+    """
+
+    def __init__(self, name, columns, date_format=None):
+        self.name = name
+        self.columns = {role: [normalize_header(c) for c in (cols if isinstance(cols, list) else [cols])]
+                        for role, cols in columns.items() if cols}
+        self.date_format = date_format
+        self._date_checked = date_format is not None
+        self._use_direction = None   # decided from the first chunk's direction values
+
+    def for_upload(self):
+        """A copy for one upload: its own date-format detection, unless the layout sets the format."""
+        return StatementParser(self.name, self.columns, self.date_format)
+
+    @property
+    def source_columns(self):
+        return {c for cols in self.columns.values() for c in cols}
+
+    def _text(self, chunk, role):
+        cols = self.columns[role]
+        out = chunk[cols[0]].fillna("").astype(str)
+        for c in cols[1:]:
+            out = out.str.cat(chunk[c].fillna("").astype(str), sep=" ")
+        return out.str.strip()
+
+    def parse(self, chunk, categorize):
+        """Raw chunk -> (rows in the ledger schema, rows without an amount, credit rows)."""
+        chunk = chunk.copy()
+        chunk.columns = [normalize_header(c) for c in chunk.columns]
+        cols = self.columns
+        if "amount" in cols:
+            amount = parse_amounts(chunk[cols["amount"][0]])
+            credit = pd.Series(False, index=chunk.index)
+            if "direction" in cols:
+                tokens = chunk[cols["direction"][0]].astype("string").str.strip().str.lower().str.rstrip(".")
+                if self._use_direction is None:
+                    present = set(tokens.dropna().unique()) - {""}
+                    self._use_direction = bool(present) and present <= DEBIT_TOKENS | CREDIT_TOKENS
+                if self._use_direction:
+                    credit = tokens.isin(CREDIT_TOKENS).fillna(False).astype(bool)
+                    amount = amount.abs()
+        else:
+            amount = parse_amounts(chunk[cols["debit"][0]]).abs()
+            credit = amount.isna() | (amount == 0)
+            if "credit" in cols:
+                credit &= parse_amounts(chunk[cols["credit"][0]]).fillna(0) != 0
+            amount = amount.where(~credit)
+        credits = int(credit.sum())
+        valid = amount.notna() & ~credit
+        skipped = int((~valid).sum()) - credits
+        chunk = chunk[valid]
+
+        dates = chunk[cols["date"][0]]
+        if not self._date_checked and not pd.api.types.is_datetime64_any_dtype(dates):
+            self.date_format = detect_date_format(dates)
+            self._date_checked = True
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            parsed = dates
+        elif self.date_format:
+            if dates.dtype == object:
+                dates = dates.str.strip().fillna(dates)   # padded text; datetimes (xlsx) pass through
+            parsed = pd.to_datetime(dates, format=self.date_format, errors="coerce")
+        else:
+            parsed = pd.to_datetime(dates, errors="coerce")
+
+        # rows whose date does not parse are skipped, not saved undated
+        dated = parsed.notna()
+        skipped += int((~dated).sum())
+        chunk, parsed, amount = chunk[dated], parsed[dated], amount[valid][dated]
+
+        rows = pd.DataFrame({"date": parsed, "amount": amount, "description": self._text(chunk, "description")})
+        # batch categorization: each distinct description is resolved once
+        if "category" in cols:
+            rows["category"] = chunk[cols["category"][0]].fillna("")
+            blank = rows["category"].astype(str).str.strip() == ""
+            if blank.any():
+                rows.loc[blank, "category"] = categorize(rows.loc[blank, "description"])
+        else:
+            rows["category"] = categorize(rows["description"])
+        return rows[OUTPUT_COLUMNS].reset_index(drop=True), skipped, credits
+
+
+def layouts_path(username):
+    """One user's saved statement layouts (layouts_<user>.json); never shared between users."""
+    return ledger_path(username, "layouts", ".json")
+
+
+def load_layouts(path):
+    """User-defined layouts: [{"name", "fingerprint", "columns": {role: header or [headers]}, "date_format"}]."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            layouts = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return layouts if isinstance(layouts, list) else []
+
+
+def save_layout(layout, path):
+    """
+    Add (or replace, by name) a user-defined layout. It applies to the header
+    whose header_fingerprint it carries, before the built-in aliases.
+    """
+    layouts = [l for l in load_layouts(path) if l.get("name") != layout.get("name")]
+    layouts.insert(0, layout)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(layouts, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+    with _parsers_lock:
+        _parsers.clear()
+
+
+def _complete(columns):
+    return "date" in columns and "description" in columns and ("amount" in columns or "debit" in columns)
+
+
+def detect_layout(names, layouts=()):
+    """StatementParser for a header row: the user layout saved for this exact header, else the built-in aliases."""
+    present = set(names)
+    fingerprint = header_fingerprint(names)
+    for layout in layouts:
+        columns = layout.get("columns") or {}
+        if layout.get("fingerprint") == fingerprint and _complete(columns):
+            return StatementParser(layout.get("name", "custom"), columns, layout.get("date_format") or None)
+    columns = {}
+    for role, aliases in COLUMN_ALIASES.items():
+        hit = next((a for a in aliases if a in present), None)
+        if hit is not None:
+            columns[role] = hit
+    if "amount" in columns and "debit" in columns:
+        del columns["amount"]   # an "Amount" next to debit / credit columns is usually the balance
+    if "direction" in columns and "amount" not in columns:
+        del columns["direction"]
+    if not _complete(columns):
+        raise ImportFormatError(
+            "Could not recognise this statement: it needs a date column, an amount (or debit / credit) column "
+            "and a description / narration column. Map the columns below to save the layout.", names)
+    name = "debit/credit" if "debit" in columns else "standard"
+    return StatementParser(name, columns)
+
+
+_parsers = OrderedDict()   # (header fingerprint, layouts file, its token) -> StatementParser
+_parsers_lock = threading.Lock()
+
+
+def _layouts_token(path):
+    if path is None:
+        return None
+    try:
+        st_ = os.stat(path)
+        return (st_.st_mtime_ns, st_.st_size)
+    except OSError:
+        return None
+
+
+def detect_parser(names, layouts_file=None):
+    """
+    Cached detect_layout: parsers are kept per header fingerprint (and the
+    user's layouts file and its version), so a repeat upload from the same bank
+    skips the column detection. The date format is not cached (see
+    StatementParser.for_upload).
+    """
+    names = [normalize_header(n) for n in names]
+    key = (header_fingerprint(names), layouts_file, _layouts_token(layouts_file))
+    with _parsers_lock:
+        parser = _parsers.get(key)
+        if parser is not None:
+            _parsers.move_to_end(key)
+            return parser
+    parser = detect_layout(names, load_layouts(layouts_file) if layouts_file else ())
+    with _parsers_lock:
+        _parsers[key] = parser
+        while len(_parsers) > PARSER_CACHE_MAX:
+            _parsers.popitem(last=False)
+    return parser
+
+
+# ------------------------- reading -------------------------
+def is_xlsx(name):
+    return name.lower().endswith(".xlsx")
+
+
+def read_xlsx_chunks(file, chunk_rows=IMPORT_CHUNK_ROWS, columns=OUTPUT_COLUMNS):
+    """
+    First worksheet of a workbook, streamed row by row (openpyxl read-only,
+    cached values instead of formulas, no styles), keeping only the header
+    columns named in `columns` (normalized names; a callable gets the header
+    and returns them; None keeps all of them).
+    """
+    # openpyxl is optional: only needed for .xlsx uploads
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        # trust the rows, not the <dimension> tag: a missing one makes openpyxl pre-scan the whole sheet
+        ws.reset_dimensions()
+        header = next(ws.iter_rows(max_row=1, values_only=True), None)
+        if header is None:
+            return
+        names = ["" if c is None else normalize_header(c) for c in header]
+        if callable(columns):
+            columns = columns([n for n in names if n])
+        keep = [i for i, n in enumerate(names) if n and (columns is None or n in columns)]
+        names = [names[i] for i in keep]
+        width = keep[-1] + 1 if keep else 1
+        buf = []
+        # cells right of the last wanted column are never turned into values
+        for row in ws.iter_rows(min_row=2, max_col=width, values_only=True):
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            values = [row[i] for i in keep]
+            if all(v is None for v in values):
+                continue  # blank / formatting-only rows
+            buf.append(values)
+            if len(buf) >= chunk_rows:
+                yield pd.DataFrame(buf, columns=names)
+                buf = []
+        if buf or not names:
+            yield pd.DataFrame(buf, columns=names)
+    finally:
+        wb.close()
+
+
+def read_csv_chunks(file, chunk_rows=IMPORT_CHUNK_ROWS, columns=None):
+    """CSV in chunks; `columns` as for read_xlsx_chunks (the header is read first, then the file rewound)."""
+    if callable(columns):
+        header = pd.read_csv(file, nrows=0).columns
+        file.seek(0)
+        columns = columns([normalize_header(c) for c in header])
+    usecols = None if columns is None else (lambda c: normalize_header(c) in columns)
+    yield from pd.read_csv(file, chunksize=chunk_rows, usecols=usecols)
+
+
+def read_chunks(file, name, chunk_rows=IMPORT_CHUNK_ROWS, columns=None):
+    """DataFrames of at most `chunk_rows` rows from a CSV or XLSX upload."""
+    if is_xlsx(name):
+        yield from read_xlsx_chunks(file, chunk_rows, columns)
+    else:
+        yield from read_csv_chunks(file, chunk_rows, columns)
+
+
+# ------------------------- duplicate detection -------------------------
+DEDUP_KEY_VERSION = 2   # bump when row_hashes changes: saved indexes are rebuilt
+
+
+def row_hashes(df):
+    """uint64 per row over the normalized (day, amount in paise, description) of an expense frame."""
+    # the day number, not the datetime64 value, so [s] / [us] / [ns] frames hash alike
+    days = pd.to_datetime(df["date"], errors="coerce").to_numpy(dtype="datetime64[D]").view("int64")
+    key = pd.DataFrame({
+        "date": days,
+        "amount": to_paise(df["amount"]),
+        "description": df["description"].astype(str).str.lower().str.replace(r"\s+", " ", regex=True).str.strip(),
+    })
+    return pd.util.hash_pandas_object(key, index=False).to_numpy()
+
+
+def dedup_path(username):
+    return ledger_path(username, "expenses", ".dedup.npz")
+
+
+class DedupIndex:
+    """
+    Multiset of expense row hashes (hash -> rows in the ledger), persisted as
+    expenses_<user>.dedup.npz together with the store version of the ledger
+    it was built from; a saved index whose version (or row count) no longer
+    matches is rebuilt from the frame. In a session, `version` is the
+    owner's change counter for the ledger, moved along with add() / remove().
+    Edits in the app only touch the category, which is not part of the key.
+    Lookups go through a pandas hash table, so a chunk is checked in one
+    vectorized pass at O(1) per row.
+    """
+
+    def __init__(self, counts, rows):
+        self.counts = counts
+        self.rows = rows
+        self.version = None
+
+    @classmethod
+    def from_frame(cls, df):
+        if df.empty:
+            return cls(pd.Series(dtype="int64", index=pd.Index([], dtype="uint64")), 0)
+        return cls(pd.Series(row_hashes(df)).value_counts(), len(df))
+
+    @classmethod
+    def load(cls, path, df, store_version):
+        """The saved index when it was saved for this store version of `df`, else one rebuilt from `df`."""
+        try:
+            with np.load(path) as data:
+                if int(data["key_version"]) == DEDUP_KEY_VERSION and str(data["store_version"]) == str(store_version) \
+                        and int(data["rows"]) == len(df):
+                    return cls(pd.Series(data["counts"], index=pd.Index(data["hashes"])), len(df))
+        except (OSError, KeyError, ValueError):
+            pass
+        return cls.from_frame(df)
+
+    def save(self, path, store_version):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, hashes=self.counts.index.to_numpy(dtype="uint64"),
+                 counts=self.counts.to_numpy(dtype="int64"), rows=self.rows,
+                 store_version=str(store_version), key_version=DEDUP_KEY_VERSION)
+        os.replace(tmp, path)
+
+    def duplicates(self, df, seen):
+        """
+        Mask of rows already in the ledger. A row repeated n times in one
+        statement is only a duplicate as many times as the ledger already
+        holds it, so genuine repeats (two identical coffees) survive;
+        `seen` carries the statement's counts across chunks.
+        """
+        h = row_hashes(df)
+        rank = pd.Series(h).groupby(h).cumcount().to_numpy() + seen.reindex(h, fill_value=0).to_numpy()
+        dup = rank < self.counts.reindex(h, fill_value=0).to_numpy()
+        seen = seen.add(pd.Series(h).value_counts(), fill_value=0).astype("int64")
+        return dup, h, seen
+
+    def add(self, hashes):
+        if len(hashes):
+            self.counts = self.counts.add(pd.Series(hashes).value_counts(), fill_value=0).astype("int64")
+            self.rows += len(hashes)
+
+    def remove(self, hashes):
+        if len(hashes):
+            counts = self.counts.sub(pd.Series(hashes).value_counts(), fill_value=0).astype("int64")
+            self.counts = counts[counts > 0]
+            self.rows -= len(hashes)
+
+
+def import_stream(file, name, sink, categorize, progress=None, chunk_rows=IMPORT_CHUNK_ROWS, dedup=None,
+                  layouts_file=None):
+    """
+    Read `file` chunk by chunk, prepare each chunk and pass it to `sink`.
+    `layouts_file` is the uploading user's saved layouts (layouts_path).
+    With a DedupIndex, rows already in the ledger are left out (and counted)
+    and the index is extended with the new rows at the end.
+    `progress(fraction, rows)` is called after every chunk (fraction from the
+    file position when the size is known; None for workbooks, which are read
+    out of a zip). Returns a summary dict.
+    """
+    size = None if is_xlsx(name) else getattr(file, "size", None)
+    t0 = time.perf_counter()
+    rows = skipped = credits = duplicates = chunks = 0
+    seen = pd.Series(dtype="int64", index=pd.Index([], dtype="uint64"))
+    added = []
+    parser = None
+
+    def select(names):
+        # header row -> layout (cached per fingerprint); only its columns are read
+        nonlocal parser
+        parser = detect_parser(names, layouts_file).for_upload()
+        return parser.source_columns
+
+    for raw in read_chunks(file, name, chunk_rows, select):
+        prepared, dropped, credit_rows = parser.parse(raw, categorize)
+        skipped += dropped
+        credits += credit_rows
+        if dedup is not None and not prepared.empty:
+            dup, hashes, seen = dedup.duplicates(prepared, seen)
+            duplicates += int(dup.sum())
+            added.append(hashes[~dup])
+            prepared = prepared[~dup].reset_index(drop=True)
+        if not prepared.empty:
+            sink(prepared)
+            rows += len(prepared)
+        chunks += 1
+        if progress is not None:
+            try:
+                fraction = min(1.0, file.tell() / size) if size else None
+            except (AttributeError, OSError, ValueError):
+                fraction = None
+            progress(fraction, rows)
+    if dedup is not None and added:
+        dedup.add(np.concatenate(added))
+    seconds = time.perf_counter() - t0
+    return {
+        "layout": parser.name if parser else None,
+        "date_format": parser.date_format if parser else None,
+        "rows": rows,
+        "skipped": skipped,
+        "credits": credits,
+        "duplicates": duplicates,
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "rows_per_s": round(rows / seconds, 1) if seconds else None,
+    }
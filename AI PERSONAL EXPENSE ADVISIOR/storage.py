@@ -0,0 +1,911 @@
+# storage.py
+"""
+Per-user ledger persistence.
+
+Backends (EXPENSE_STORAGE_MODE env var), all behind LedgerStore:
+- "csv"     : every persist rewrites expenses_<user>.csv / incomes_<user>.csv /
+              category_memory_<user>.json in full (original behaviour)
+- "journal" : each add / edit / delete is appended as one JSON line to
+              <snapshot>.journal; a background thread folds the journal back
+              into the snapshot once it grows past COMPACT_BYTES
+- "sqlite"  : one database (EXPENSE_SQLITE_PATH) with single-row statements;
+              the CSV / JSON files stay as the import / export format
+- "arrow"   : like "journal" but the snapshots are typed Arrow IPC files
+              (needs pyarrow); `python storage.py to-arrow <csv>...` converts
+CSV loading always replays snapshot + journal, so "csv" and "journal" share
+their files and can be switched freely. "sqlite" and "arrow" own the data
+written through them: they read the CSV / JSON files only for users they
+have not seen yet, and never write them back, so those files go stale.
+Before leaving either mode, `python storage.py export --from <mode> <user>...`
+writes each ledger back out as CSV / JSON. "arrow" refuses to load a user
+whose CSVs changed after its snapshots (StaleLedgerError).
+"""
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+STORAGE_MODE = os.environ.get("EXPENSE_STORAGE_MODE", "csv").strip().lower()
+JOURNAL_SUFFIX = ".journal"
+COMPACT_BYTES = 256 * 1024
+
+_locks = {}
+_locks_guard = threading.Lock()
+_compacting = set()
+
+# process-wide persist counters (shown in the sidebar diagnostics)
+WRITE_STATS = {"performed": 0, "skipped": 0, "appended": 0}
+
+
+def _lock_for(path):
+    path = os.path.abspath(path)
+    with _locks_guard:
+        if path not in _locks:
+            _locks[path] = threading.RLock()
+        return _locks[path]
+
+
+def journal_path(path):
+    return path + JOURNAL_SUFFIX
+
+
+def count_write(kind):
+    with _locks_guard:
+        WRITE_STATS[kind] = WRITE_STATS.get(kind, 0) + 1
+
+
+def _json_default(v):
+    if v is pd.NaT:
+        return None
+    if isinstance(v, pd.Timestamp):
+        return v.strftime("%Y-%m-%d")
+    if hasattr(v, "item"):  # numpy scalars
+        return v.item()
+    return str(v)
+
+
+# ------------------------- schema helpers -------------------------
+def to_paise(amount):
+    """Rupee amounts -> nullable int64 minor units (exact sums, no float drift)."""
+    return (pd.to_numeric(amount, errors="coerce") * 100).round().astype("Int64")
+
+
+# ------------------------- snapshot read / write -------------------------
+ARROW_EXT = ".arrow"
+TEXT_COLUMNS = ("description", "source")
+DICT_COLUMNS = ("category", "source")
+
+
+def _read_arrow(path):
+    # pyarrow is optional: only needed for EXPENSE_STORAGE_MODE=arrow
+    import pyarrow as pa
+
+    with pa.memory_map(path, "r") as src:
+        table = pa.ipc.open_file(src).read_all()
+    df = table.to_pandas()  # dictionary columns come back as Categorical
+    meta = table.schema.metadata or {}
+    if "amount" in df.columns and meta.get(b"amount_unit") == b"paise":
+        df["amount"] = df["amount"].astype("float64") / 100
+    return df
+
+
+def _write_arrow(df, path):
+    """Arrow IPC (Feather v2) file: typed date, int64 paise amount, dictionary-encoded categories."""
+    import pyarrow as pa
+
+    df2 = df.copy()
+    if "date" in df2.columns:
+        df2["date"] = pd.to_datetime(df2["date"], errors="coerce").dt.normalize()
+    if "amount" in df2.columns:
+        df2["amount"] = to_paise(df2["amount"])
+    if "id" in df2.columns:
+        df2["id"] = pd.to_numeric(df2["id"], errors="coerce").astype("Int64")
+    for c in TEXT_COLUMNS + DICT_COLUMNS:
+        if c in df2.columns:
+            df2[c] = df2[c].astype("string")
+    for c in DICT_COLUMNS:
+        if c in df2.columns:
+            df2[c] = df2[c].astype("category")
+    table = pa.Table.from_pandas(df2, preserve_index=False)
+    if "amount" in df2.columns:
+        table = table.replace_schema_metadata(dict(table.schema.metadata or {}, amount_unit="paise"))
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def _read_frame(path):
+    if os.path.exists(path):
+        if path.endswith(ARROW_EXT):
+            return _read_arrow(path)
+        return pd.read_csv(path)
+    return pd.DataFrame()
+
+
+def _write_frame(df, path):
+    if path.endswith(ARROW_EXT):
+        return _write_arrow(df, path)
+    df2 = df.copy()
+    if "date" in df2.columns:
+        df2["date"] = pd.to_datetime(df2["date"], errors="coerce").dt.strftime("%Y-%m-%d")
+    tmp = path + ".tmp"
+    df2.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _read_memory(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _write_memory(mem, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(mem, f, indent=2)
+    os.replace(tmp, path)
+
+
+# ------------------------- journal -------------------------
+def read_journal(path):
+    jpath = journal_path(path)
+    records = []
+    if not os.path.exists(jpath):
+        return records
+    with open(jpath, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # torn last line after a crash: everything before it is still valid
+                break
+    return records
+
+
+def set_values(df, rows, col, value):
+    if col not in df.columns:
+        df[col] = ""
+    if isinstance(df[col].dtype, pd.CategoricalDtype) and value not in df[col].cat.categories \
+            and not pd.isna(value):
+        df[col] = df[col].cat.add_categories([value])
+    if isinstance(rows, int):
+        df.iat[rows, df.columns.get_loc(col)] = value
+    else:
+        df.loc[rows, col] = value
+
+
+def _rid_rows(df, rec):
+    """Positions of the rows a record names by sqlite rowid, or None when it names them by position."""
+    if ROW_ID not in df.columns or not ("rid" in rec or "rids" in rec):
+        return None
+    rids = rec["rids"] if "rids" in rec else [rec["rid"]]
+    return np.flatnonzero(df[ROW_ID].isin(rids).to_numpy())
+
+
+def replay_frame(df, records):
+    for rec in records:
+        op = rec.get("op")
+        if op == "add":
+            rows = pd.DataFrame(rec.get("rows", []))
+            if rows.empty:
+                continue
+            if df.empty:
+                cols = list(df.columns) + [c for c in rows.columns if c not in df.columns]
+                df = rows.reindex(columns=cols)
+            else:
+                df = pd.concat([df, rows], ignore_index=True)
+        elif op == "update":
+            fields = rec.get("fields", {})
+            pos = _rid_rows(df, rec)
+            if pos is not None:
+                if len(pos):
+                    for k, v in fields.items():
+                        set_values(df, df.index[pos], k, v)
+            elif "row" in rec:
+                pos = int(rec["row"])
+                if 0 <= pos < len(df):
+                    for k, v in fields.items():
+                        set_values(df, pos, k, v)
+            elif "rows" in rec:
+                # bulk edit (e.g. re-categorizing every row with one description)
+                pos = [int(p) for p in rec["rows"] if 0 <= int(p) < len(df)]
+                if pos:
+                    for k, v in fields.items():
+                        set_values(df, df.index[pos], k, v)
+            elif "id" in rec and "id" in df.columns:
+                mask = df["id"] == rec["id"]
+                for k, v in fields.items():
+                    set_values(df, mask, k, v)
+        elif op == "delete":
+            pos = _rid_rows(df, rec)
+            if pos is not None:
+                df = df.drop(df.index[pos]).reset_index(drop=True)
+            elif "row" in rec:
+                pos = int(rec["row"])
+                if 0 <= pos < len(df):
+                    df = df.drop(df.index[pos]).reset_index(drop=True)
+            elif "id" in rec and "id" in df.columns:
+                df = df[df["id"] != rec["id"]].reset_index(drop=True)
+    return df
+
+
+def replay_memory(mem, records):
+    for rec in records:
+        if rec.get("op") == "set":
+            mem[rec["key"]] = rec["value"]
+        elif rec.get("op") == "remove":
+            mem.pop(rec["key"], None)
+    return mem
+
+
+def append_record(path, record):
+    """Append one mutation to the snapshot's journal; O(1) regardless of ledger size."""
+    line = json.dumps(record, default=_json_default, ensure_ascii=False)
+    jpath = journal_path(path)
+    with _lock_for(path):
+        with open(jpath, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        size = os.path.getsize(jpath)
+    count_write("appended")
+    if size >= COMPACT_BYTES:
+        compact_async(path)
+
+
+def compact(path):
+    """Fold the journal into the snapshot file and truncate it."""
+    with _lock_for(path):
+        records = read_journal(path)
+        if not records:
+            return False
+        if path.endswith(".json"):
+            _write_memory(replay_memory(_read_memory(path), records), path)
+        else:
+            _write_frame(replay_frame(_read_frame(path), records), path)
+        os.remove(journal_path(path))
+    return True
+
+
+def compact_async(path):
+    with _locks_guard:
+        if path in _compacting:
+            return
+        _compacting.add(path)
+
+    def _run():
+        try:
+            compact(path)
+        except Exception:
+            pass  # journal is left intact and retried on the next append
+        finally:
+            with _locks_guard:
+                _compacting.discard(path)
+
+    threading.Thread(target=_run, name=f"compact:{os.path.basename(path)}", daemon=True).start()
+
+
+# ------------------------- public load / save -------------------------
+def load_frame(path):
+    """Snapshot + journal replay (date parsing is left to the caller)."""
+    with _lock_for(path):
+        return replay_frame(_read_frame(path), read_journal(path))
+
+
+def save_frame(df, path):
+    """Full rewrite; a fresh snapshot supersedes any pending journal."""
+    with _lock_for(path):
+        _write_frame(df, path)
+        if os.path.exists(journal_path(path)):
+            os.remove(journal_path(path))
+    count_write("performed")
+
+
+def load_memory(path):
+    with _lock_for(path):
+        return replay_memory(_read_memory(path), read_journal(path))
+
+
+def save_memory(mem, path):
+    with _lock_for(path):
+        _write_memory(mem, path)
+        if os.path.exists(journal_path(path)):
+            os.remove(journal_path(path))
+    count_write("performed")
+
+
+# ------------------------- storage backends -------------------------
+LEDGER_COLUMNS = {
+    "expenses": ["date", "amount", "description", "category"],
+    "incomes": ["date", "amount", "source", "id"],
+}
+SQLITE_PATH = os.environ.get("EXPENSE_SQLITE_PATH", "ledgers.db")
+ROW_ID = "rid"   # sqlite rowid column carried in expense frames loaded from SqliteStore
+
+
+def safe_user(username):
+    return username.strip().replace(" ", "_")
+
+
+def ledger_path(username, ledger, ext=".csv"):
+    u = safe_user(username)
+    if ledger == "memory":
+        return f"category_memory_{u}.json"
+    return f"{ledger}_{u}{ext}"
+
+
+def convert_csv_to_arrow(csv_path, arrow_path=None):
+    """expenses_<user>.csv / incomes_<user>.csv (+ pending journal) -> .arrow snapshot."""
+    arrow_path = arrow_path or os.path.splitext(csv_path)[0] + ARROW_EXT
+    df = load_frame(csv_path)
+    with _lock_for(arrow_path):
+        _write_arrow(df, arrow_path)
+        # the converted CSV supersedes whatever the old snapshot's journal recorded
+        if os.path.exists(journal_path(arrow_path)):
+            os.remove(journal_path(arrow_path))
+    return arrow_path
+
+
+class StaleLedgerError(RuntimeError):
+    """Another backend wrote a user's files after the current one last did."""
+
+
+def _mtime(*paths):
+    return max((os.stat(p).st_mtime_ns for p in paths if os.path.exists(p)), default=None)
+
+
+class LedgerStore:
+    """Storage interface used by the app. `ledger` is "expenses", "incomes" or "memory"."""
+
+    def ensure_user(self, username):
+        raise NotImplementedError
+
+    def ensure_users(self, usernames):
+        """Batch ensure_user (bulk provisioning); backends override with a faster path."""
+        for username in usernames:
+            self.ensure_user(username)
+
+    def load(self, username, ledger):
+        """DataFrame for expenses / incomes (dates unparsed), dict for memory."""
+        raise NotImplementedError
+
+    def save(self, username, ledger, data):
+        """Replace the whole ledger."""
+        raise NotImplementedError
+
+    def apply(self, username, ledger, record):
+        """Persist one add / update / delete / set record.
+        Returns False when the backend needs a full save() instead."""
+        return False
+
+    def version(self, username, ledger):
+        """Token that changes whenever the stored ledger changes (cache key)."""
+        raise NotImplementedError
+
+    def range(self, username, ledger, start, end):
+        """
+        Rows with start <= date < end (dates as YYYY-MM-DD strings or datetimes).
+        The pages' "this month" figures do not call this: they are read from the
+        session's rollups, which answer them without touching the store at all.
+        """
+        df = self.load(username, ledger)
+        if df.empty:
+            return df
+        d = pd.to_datetime(df["date"], errors="coerce")
+        return df[(d >= pd.Timestamp(start)) & (d < pd.Timestamp(end))].reset_index(drop=True)
+
+    def export_csv(self, username, ledger, path=None):
+        """Write a ledger out in the original CSV / JSON format (superseding any pending journal)."""
+        path = path or ledger_path(username, ledger)
+        data = self.load(username, ledger)
+        if ledger == "memory":
+            save_memory(data, path)
+        else:
+            save_frame(data.drop(columns=ROW_ID, errors="ignore"), path)
+        return path
+
+
+class CsvStore(LedgerStore):
+    """Original layout: one CSV per ledger, rewritten in full on save."""
+
+    snapshot_ext = ".csv"
+
+    def path(self, username, ledger):
+        return ledger_path(username, ledger, self.snapshot_ext)
+
+    def ensure_user(self, username):
+        for ledger, cols in LEDGER_COLUMNS.items():
+            path = self.path(username, ledger)
+            if not os.path.exists(path):
+                _write_frame(pd.DataFrame(columns=cols), path)
+        mem_path = self.path(username, "memory")
+        if not os.path.exists(mem_path):
+            _write_memory({}, mem_path)
+
+    def ensure_users(self, usernames):
+        if self.snapshot_ext != ".csv":
+            return super().ensure_users(usernames)
+        # empty ledgers are a fixed header line: write the bytes, skip pandas
+        headers = {ledger: (",".join(cols) + "\n").encode("utf-8") for ledger, cols in LEDGER_COLUMNS.items()}
+        headers["memory"] = b"{}"
+        for username in usernames:
+            for ledger, content in headers.items():
+                path = self.path(username, ledger)
+                if not os.path.exists(path):
+                    with open(path, "wb") as f:
+                        f.write(content)
+
+    def load(self, username, ledger):
+        if ledger == "memory":
+            return load_memory(self.path(username, ledger))
+        return load_frame(self.path(username, ledger))
+
+    def save(self, username, ledger, data):
+        if ledger == "memory":
+            save_memory(data, self.path(username, ledger))
+        else:
+            save_frame(data, self.path(username, ledger))
+
+    def version(self, username, ledger):
+        token = []
+        for p in (self.path(username, ledger), journal_path(self.path(username, ledger))):
+            try:
+                st_ = os.stat(p)
+                token.append((st_.st_mtime_ns, st_.st_size))
+            except OSError:
+                token.append(None)
+        return tuple(token)
+
+
+class JournalStore(CsvStore):
+    """CSV snapshots plus an append-only journal per ledger."""
+
+    def apply(self, username, ledger, record):
+        append_record(self.path(username, ledger), record)
+        return True
+
+
+class ArrowStore(JournalStore):
+    """
+    Columnar snapshots (<ledger>_<user>.arrow, memory-mapped on load) plus the
+    same journal. Dates are stored typed, so loading needs no re-parsing.
+    Users that only have CSV files are converted on first login; after that the
+    .arrow files are the source of truth and the CSVs are never read again.
+    A CSV (or its journal) written after the .arrow snapshot means the app ran
+    in csv / journal mode in between: ensure_user refuses to pick a side and
+    raises StaleLedgerError until one copy is removed or re-converted.
+    """
+
+    snapshot_ext = ARROW_EXT
+
+    def ensure_user(self, username):
+        for ledger in LEDGER_COLUMNS:
+            csv_path = ledger_path(username, ledger)
+            arrow_path = self.path(username, ledger)
+            if not os.path.exists(arrow_path) and os.path.exists(csv_path):
+                with _lock_for(csv_path):
+                    convert_csv_to_arrow(csv_path, arrow_path)
+                continue
+            csv_time = _mtime(csv_path, journal_path(csv_path))
+            arrow_time = _mtime(arrow_path, journal_path(arrow_path))
+            if csv_time is not None and arrow_time is not None and csv_time > arrow_time:
+                raise StaleLedgerError(
+                    f"{csv_path} is newer than {arrow_path}: run `python storage.py to-arrow {csv_path}` "
+                    f"to keep the CSV data, or move the CSV away to keep the Arrow data")
+        super().ensure_user(username)
+
+
+class SqliteStore(LedgerStore):
+    """
+    All users in one SQLite file, indexed on (user, date) and (user, category).
+    Expense frames carry each row's rowid in a "rid" column (filled in on add),
+    and update / delete records name rows by it, so a write from a stale tab
+    still hits the row it was made on. Records without rids fall back to the
+    row's position. Existing CSV / JSON files are imported the first time a
+    user is seen.
+    """
+
+    def __init__(self, db_path=SQLITE_PATH):
+        import sqlite3
+
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._versions = {}
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS expenses (
+                rid INTEGER PRIMARY KEY, user TEXT NOT NULL,
+                date TEXT, amount REAL, description TEXT, category TEXT);
+            CREATE INDEX IF NOT EXISTS ix_expenses_user_date ON expenses(user, date);
+            CREATE INDEX IF NOT EXISTS ix_expenses_user_category ON expenses(user, category);
+            CREATE TABLE IF NOT EXISTS incomes (
+                rid INTEGER PRIMARY KEY, user TEXT NOT NULL,
+                date TEXT, amount REAL, source TEXT, id INTEGER);
+            CREATE INDEX IF NOT EXISTS ix_incomes_user_date ON incomes(user, date);
+            CREATE INDEX IF NOT EXISTS ix_incomes_user_id ON incomes(user, id);
+            CREATE TABLE IF NOT EXISTS memory (
+                user TEXT NOT NULL, key TEXT NOT NULL, value TEXT,
+                PRIMARY KEY (user, key));
+            CREATE TABLE IF NOT EXISTS imported_users (user TEXT PRIMARY KEY);
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def _value(col, v):
+        if col == "date":
+            d = pd.to_datetime(v, errors="coerce")
+            return None if pd.isna(d) else d.strftime("%Y-%m-%d")
+        if v is None or v is pd.NaT or (isinstance(v, float) and v != v):
+            return None
+        return v.item() if hasattr(v, "item") else v
+
+    def _rows(self, ledger, rows):
+        cols = LEDGER_COLUMNS[ledger]
+        return [tuple(self._value(c, r.get(c)) for c in cols) for r in rows]
+
+    def _insert(self, user, ledger, rows):
+        """
+        Insert rows. Expense rows that already carry a rid (a full save) keep it;
+        the others get their new rowid written back into the row dict.
+        """
+        cols = LEDGER_COLUMNS[ledger]
+        if ledger == "expenses":
+            kept = [r for r in rows if not pd.isna(r.get(ROW_ID, None))]
+            if kept:
+                self.conn.executemany(
+                    f"INSERT INTO {ledger} (rid, user, {', '.join(cols)}) VALUES (?, ?, {', '.join('?' * len(cols))})",
+                    [(int(r[ROW_ID]), user) + v for r, v in zip(kept, self._rows(ledger, kept))],
+                )
+                rows = [r for r in rows if pd.isna(r.get(ROW_ID, None))]
+        last = self.conn.execute(f"SELECT COALESCE(MAX(rid), 0) FROM {ledger}").fetchone()[0]
+        self.conn.executemany(
+            f"INSERT INTO {ledger} (user, {', '.join(cols)}) VALUES (?, {', '.join('?' * len(cols))})",
+            [(user,) + r for r in self._rows(ledger, rows)],
+        )
+        if ledger == "expenses":
+            new = self.conn.execute(
+                f"SELECT rid FROM {ledger} WHERE user = ? AND rid > ? ORDER BY rid", (user, last))
+            for row, (rid,) in zip(rows, new):
+                row[ROW_ID] = rid
+
+    def _rids_for(self, user, ledger, record):
+        """Rowids an update / delete names: its rids, or (older records) its positions."""
+        if "rids" in record or "rid" in record:
+            return [int(r) for r in (record["rids"] if "rids" in record else [record["rid"]])]
+        positions = [int(p) for p in (record["rows"] if "rows" in record else [record["row"]])]
+        rids = [r[0] for r in self.conn.execute(
+            f"SELECT rid FROM {ledger} WHERE user = ? ORDER BY rid", (user,))]
+        return [rids[p] for p in positions if 0 <= p < len(rids)]
+
+    def ensure_user(self, username):
+        user = safe_user(username)
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM imported_users WHERE user = ?", (user,)).fetchone():
+                return
+            for ledger in LEDGER_COLUMNS:
+                path = ledger_path(user, ledger)
+                if os.path.exists(path) or os.path.exists(journal_path(path)):
+                    df = load_frame(path)
+                    if not df.empty:
+                        self._insert(user, ledger, df.to_dict("records"))
+            mem_path = ledger_path(user, "memory")
+            if os.path.exists(mem_path) or os.path.exists(journal_path(mem_path)):
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO memory (user, key, value) VALUES (?, ?, ?)",
+                    [(user, k, v) for k, v in load_memory(mem_path).items()])
+            self.conn.execute("INSERT INTO imported_users (user) VALUES (?)", (user,))
+            self.conn.commit()
+
+    def ensure_users(self, usernames):
+        """New users have nothing to import: mark them all in one transaction."""
+        users = [safe_user(u) for u in usernames]
+        with self._lock:
+            fresh = [u for u in users if not any(
+                os.path.exists(p) for ledger in ("expenses", "incomes", "memory")
+                for p in (ledger_path(u, ledger), journal_path(ledger_path(u, ledger))))]
+            self.conn.executemany("INSERT OR IGNORE INTO imported_users (user) VALUES (?)",
+                                  [(u,) for u in fresh])
+            self.conn.commit()
+        for u in set(users) - set(fresh):
+            self.ensure_user(u)
+
+    def load(self, username, ledger):
+        user = safe_user(username)
+        with self._lock:
+            if ledger == "memory":
+                return dict(self.conn.execute(
+                    "SELECT key, value FROM memory WHERE user = ?", (user,)).fetchall())
+            cols = LEDGER_COLUMNS[ledger]
+            df = pd.read_sql_query(
+                f"SELECT rid, {', '.join(cols)} FROM {ledger} WHERE user = ? ORDER BY rid",
+                self.conn, params=(user,))
+            # incomes are addressed by their own id column
+            return df[cols + [ROW_ID]] if ledger == "expenses" else df.drop(columns="rid")
+
+    def save(self, username, ledger, data):
+        user = safe_user(username)
+        with self._lock:
+            if ledger == "memory":
+                self.conn.execute("DELETE FROM memory WHERE user = ?", (user,))
+                self.conn.executemany(
+                    "INSERT INTO memory (user, key, value) VALUES (?, ?, ?)",
+                    [(user, k, v) for k, v in data.items()])
+            else:
+                self.conn.execute(f"DELETE FROM {ledger} WHERE user = ?", (user,))
+                self._insert(user, ledger, data.to_dict("records"))
+            self.conn.commit()
+            self._bump(user, ledger)
+        count_write("performed")
+
+    def _bump(self, user, ledger):
+        self._versions[(user, ledger)] = self._versions.get((user, ledger), 0) + 1
+
+    def version(self, username, ledger):
+        user = safe_user(username)
+        with self._lock:
+            # data_version moves on commits from other connections / processes
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            return (data_version, self._versions.get((user, ledger), 0))
+
+    def apply(self, username, ledger, record):
+        user = safe_user(username)
+        op = record.get("op")
+        with self._lock:
+            if ledger == "memory":
+                if op == "set":
+                    self.conn.execute("INSERT OR REPLACE INTO memory (user, key, value) VALUES (?, ?, ?)",
+                                      (user, record["key"], record["value"]))
+                elif op == "remove":
+                    self.conn.execute("DELETE FROM memory WHERE user = ? AND key = ?", (user, record["key"]))
+            elif op == "add":
+                self._insert(user, ledger, record.get("rows", []))
+            elif op in ("update", "delete"):
+                if "id" in record:
+                    where, params = "user = ? AND id = ?", [(user, self._value("id", record["id"]))]
+                else:
+                    # the user check keeps a stale or forged rid from touching another user's row
+                    where, params = "rid = ? AND user = ?", [(rid, user) for rid in self._rids_for(user, ledger, record)]
+                if op == "update":
+                    fields = {k: v for k, v in record.get("fields", {}).items() if k in LEDGER_COLUMNS[ledger]}
+                    if fields and params:
+                        sets = ", ".join(f"{k} = ?" for k in fields)
+                        values = tuple(self._value(k, v) for k, v in fields.items())
+                        self.conn.executemany(f"UPDATE {ledger} SET {sets} WHERE {where}",
+                                              [values + p for p in params])
+                elif params:
+                    self.conn.executemany(f"DELETE FROM {ledger} WHERE {where}", params)
+            self.conn.commit()
+            self._bump(user, ledger)
+        count_write("appended")
+        return True
+
+    def range(self, username, ledger, start, end):
+        user = safe_user(username)
+        cols = LEDGER_COLUMNS[ledger]
+        with self._lock:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(cols)} FROM {ledger} WHERE user = ? AND date >= ? AND date < ? ORDER BY rid",
+                self.conn, params=(user, self._value("date", start), self._value("date", end)))
+
+
+# ------------------------- process-wide ledger cache -------------------------
+CACHE_MAX_BYTES = int(os.environ.get("EXPENSE_CACHE_MB", "256")) * 1024 * 1024
+CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def normalize_frame(df, ledger):
+    """
+    Compact in-memory schema, applied once before a frame is shared:
+    date -> datetime64 normalized to midnight, category / source -> Categorical,
+    amount -> float64 rupees rounded to whole paise.
+    """
+    for c in LEDGER_COLUMNS[ledger]:
+        if c not in df.columns:
+            df[c] = ""
+    if "date" in df.columns:
+        if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+            df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        df["date"] = df["date"].dt.normalize()
+    if "amount" in df.columns:
+        df["amount"] = to_paise(df["amount"]).astype("float64") / 100
+    for c in DICT_COLUMNS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    return df
+
+
+class CachedStore(LedgerStore):
+    """
+    LRU cache of loaded expense / income frames, shared by every session and
+    rerun of the server process and keyed by (user, ledger, backend version).
+    Callers get a shallow copy and must replace, not edit, the frame they hold.
+    Saves and single-record applies refresh the cached frame, so the reload
+    that follows a write is served from memory; a bulk add (an import chunk)
+    drops it instead of re-copying the whole ledger per chunk, and the next
+    load reads it back once. Memory dicts are not cached.
+    """
+
+    def __init__(self, backend, max_bytes=CACHE_MAX_BYTES):
+        from collections import OrderedDict
+
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (user, ledger) -> (version, frame, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _put(self, key, version, df):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            self._drop(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (version, df, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                old_key = next(iter(self._entries))
+                self._drop(old_key)
+                CACHE_STATS["evictions"] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry[2]
+
+    def ensure_user(self, username):
+        self.backend.ensure_user(username)
+
+    def ensure_users(self, usernames):
+        self.backend.ensure_users(usernames)
+
+    def load(self, username, ledger):
+        if ledger == "memory":
+            return self.backend.load(username, ledger)
+        key = (safe_user(username), ledger)
+        version = self.backend.version(username, ledger)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                CACHE_STATS["hits"] += 1
+                return entry[1].copy(deep=False)
+        CACHE_STATS["misses"] += 1
+        df = normalize_frame(self.backend.load(username, ledger), ledger)
+        self._put(key, version, df)
+        return df.copy(deep=False)
+
+    def save(self, username, ledger, data):
+        self.backend.save(username, ledger, data)
+        if ledger == "memory":
+            return
+        if ROW_ID in data.columns and data[ROW_ID].isna().any():
+            # rows given new rowids by the save: the next load reads them back
+            with self._lock:
+                self._drop((safe_user(username), ledger))
+        else:
+            self._put((safe_user(username), ledger), self.backend.version(username, ledger),
+                      normalize_frame(data.copy(), ledger))
+
+    def apply(self, username, ledger, record):
+        if ledger == "memory":
+            return self.backend.apply(username, ledger, record)
+        before = self.backend.version(username, ledger)
+        persisted = self.backend.apply(username, ledger, record)
+        if not persisted:
+            return persisted
+        key = (safe_user(username), ledger)
+        if record.get("op") == "add" and len(record.get("rows", [])) > 1:
+            with self._lock:
+                self._drop(key)
+            return persisted
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] == before:
+            df = normalize_frame(replay_frame(entry[1].copy(), [record]), ledger)
+            self._put(key, self.backend.version(username, ledger), df)
+        return persisted
+
+    def range(self, username, ledger, start, end):
+        return self.backend.range(username, ledger, start, end)
+
+    def export_csv(self, username, ledger, path=None):
+        return self.backend.export_csv(username, ledger, path)
+
+    def version(self, username, ledger):
+        return self.backend.version(username, ledger)
+
+    def stats(self):
+        with self._lock:
+            return dict(CACHE_STATS, entries=len(self._entries), mb=round(self._bytes / 1024 / 1024, 1))
+
+
+def schema_memory_report(rows=100_000):
+    """Bytes used by `rows` synthetic ledger rows, pandas-inferred vs normalize_frame()."""
+    import io
+
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    cats = ["Food", "Shopping", "Bills", "Travel", "Entertainment", "Health",
+            "Education", "Groceries", "Transport", "Others"]
+    report = {"rows": rows}
+    for ledger, label_col, labels in (("expenses", "category", cats),
+                                      ("incomes", "source", ["Salary", "freelancing", "gaming", "selling"])):
+        raw = pd.DataFrame({
+            "date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 2000, rows), unit="D"),
+            "amount": rng.integers(100, 500_000, rows) / 100,
+            label_col: rng.choice(labels, rows),
+        })
+        if ledger == "expenses":
+            raw["description"] = rng.choice(["Cab fare", "Miscellaneous expense", "zomato", "blinkit"], rows)
+        else:
+            raw["id"] = rng.integers(10**7, 10**9, rows)
+        buf = io.StringIO()
+        raw[LEDGER_COLUMNS[ledger]].to_csv(buf, index=False)
+        buf.seek(0)
+        inferred = pd.read_csv(buf)
+        inferred["date"] = pd.to_datetime(inferred["date"], errors="coerce")
+        before = int(inferred.memory_usage(deep=True).sum())
+        after = int(normalize_frame(inferred.copy(), ledger).memory_usage(deep=True).sum())
+        report[ledger] = {"inferred_bytes": before, "compact_bytes": after,
+                          "saved_bytes_per_100k_rows": round((before - after) * 100_000 / rows)}
+    return report
+
+
+_stores = {}
+
+
+def get_store(mode=None):
+    """One (cached) backend instance per process (Streamlit reruns re-import nothing)."""
+    mode = mode or STORAGE_MODE
+    with _locks_guard:
+        if mode not in _stores:
+            if mode == "sqlite":
+                backend = SqliteStore()
+            elif mode == "arrow":
+                backend = ArrowStore()
+            elif mode == "journal":
+                backend = JournalStore()
+            else:
+                backend = CsvStore()
+            _stores[mode] = CachedStore(backend)
+        return _stores[mode]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ledger storage utilities")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    conv = sub.add_parser("to-arrow", help="convert expenses_*.csv / incomes_*.csv to .arrow")
+    conv.add_argument("csv_files", nargs="+")
+    rep = sub.add_parser("schema-report", help="memory of inferred vs compact schema")
+    rep.add_argument("--rows", type=int, default=100_000)
+    exp = sub.add_parser("export", help="write users' ledgers back out as CSV / JSON (before switching modes)")
+    exp.add_argument("--from", dest="mode", default=STORAGE_MODE, choices=["csv", "journal", "sqlite", "arrow"])
+    exp.add_argument("users", nargs="+")
+    args = parser.parse_args()
+
+    if args.cmd == "to-arrow":
+        for csv_file in args.csv_files:
+            print(csv_file, "->", convert_csv_to_arrow(csv_file))
+    elif args.cmd == "schema-report":
+        print(json.dumps(schema_memory_report(args.rows), indent=2))
+    elif args.cmd == "export":
+        store = get_store(args.mode)
+        for user in args.users:
+            for ledger in ("expenses", "incomes", "memory"):
+                print(user, ledger, "->", store.export_csv(user, ledger))
@@ -0,0 +1,17 @@
+# conftest.py
+"""
+The app modules live next to this folder and write their files to the
+working directory: every test runs in its own tmp_path.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,56 @@
+# test_auth.py
+import hashlib
+
+import pytest
+
+import auth
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    # a fresh sqlite user store and a cheap KDF cost, so hashing stays fast
+    store = auth.SqliteUserStore(str(tmp_path / "users.db"))
+    monkeypatch.setattr(auth, "_stores", {"sqlite": store})
+    monkeypatch.setattr(auth, "USER_STORE", "sqlite")
+    monkeypatch.setattr(auth, "KDF_COST", 4 if auth.KDF == "scrypt" else 1000)
+    return store
+
+
+def legacy_hash(password, salt="abc123"):
+    return f"{salt}${hashlib.sha256((salt + password).encode('utf-8')).hexdigest()}"
+
+
+def test_legacy_password_is_rehashed_on_login(users):
+    users.add("asha", {"fullname": "Asha", "password": legacy_hash("secret"),
+                       "security_question": "pet", "security_answer": "tom"})
+
+    assert auth.login("asha", "secret") == {"username": "asha", "fullname": "Asha"}
+    stored = users.get("asha")["password"]
+    kdf, cost, salt, digest = stored.split("$")
+    assert (kdf, cost) == (auth.KDF, str(auth.KDF_COST))
+    assert not auth._needs_rehash(stored)
+    # the new hash still verifies, the old password is the one it checks
+    assert auth.login("asha", "secret") is not None
+    assert users.get("asha")["password"] == stored
+
+
+def test_wrong_password_leaves_a_legacy_hash_alone(users):
+    users.add("asha", {"fullname": "Asha", "password": legacy_hash("secret")})
+    assert auth.login("asha", "wrong") is None
+    assert users.get("asha")["password"] == legacy_hash("secret")
+
+
+def test_older_cost_is_upgraded(users):
+    old = auth._hash_password("secret", cost=auth.KDF_COST + 1)
+    users.add("asha", {"fullname": "Asha", "password": old})
+    assert auth.login("asha", "secret") is not None
+    assert users.get("asha")["password"].split("$")[1] == str(auth.KDF_COST)
+
+
+def test_signup_then_login(users):
+    assert "created" in auth.signup("Ravi", "ravi", "pw", "pet", " Tom ")
+    assert auth.signup("Ravi", "ravi", "pw", "pet", "tom") == "Username already exists."
+    assert auth.login("ravi", "pw")["fullname"] == "Ravi"
+    assert auth.reset_password("ravi", "TOM", "pw2").startswith("Password reset")
+    assert auth.login("ravi", "pw") is None
+    assert auth.login("ravi", "pw2") is not None
@@ -0,0 +1,117 @@
+# test_importer.py
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import importer
+
+
+def categorize(descriptions):
+    return ["Others"] * len(descriptions)
+
+
+def run(csv_text, **kwargs):
+    rows = []
+    summary = importer.import_stream(io.BytesIO(csv_text.encode("utf-8")), "statement.csv",
+                                     rows.append, categorize, **kwargs)
+    return (pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()), summary
+
+
+# ------------------------- dedup -------------------------
+@pytest.mark.parametrize("unit", ["s", "ms", "us", "ns"])
+def test_row_hashes_ignore_the_datetime_unit(unit):
+    df = pd.DataFrame({"date": pd.to_datetime(["2024-01-05", "2024-03-31"]),
+                       "amount": [120.5, 40.0], "description": ["Swiggy  Order", "Uber"]})
+    other = df.assign(date=df["date"].astype(f"datetime64[{unit}]"), description=["swiggy order", "uber"])
+    assert np.array_equal(importer.row_hashes(df), importer.row_hashes(other))
+
+
+def test_row_hashes_ignore_the_time_of_day():
+    a = pd.DataFrame({"date": pd.to_datetime(["2024-01-05 00:00"]), "amount": [1.0], "description": ["x"]})
+    b = a.assign(date=pd.to_datetime(["2024-01-05 18:30"]).astype("datetime64[s]"))
+    assert np.array_equal(importer.row_hashes(a), importer.row_hashes(b))
+
+
+def test_reupload_skips_rows_already_in_the_ledger():
+    ledger = pd.DataFrame({"date": pd.to_datetime(["2024-01-05"]).astype("datetime64[s]"),
+                           "amount": [120.5], "description": ["Swiggy order"], "category": ["Food"]})
+    dedup = importer.DedupIndex.from_frame(ledger)
+    rows, summary = run("Date,Amount,Description\n"
+                        "2024-01-05,120.50,Swiggy order\n"
+                        "2024-01-05,120.50,Swiggy order\n"
+                        "2024-01-06,40,Uber\n", dedup=dedup)
+    # the second identical order is a genuine repeat: only one copy was in the ledger
+    assert summary["duplicates"] == 1
+    assert rows["description"].tolist() == ["Swiggy order", "Uber"]
+    assert dedup.rows == 3
+
+
+def test_saved_dedup_index_is_rebuilt_for_another_store_version(tmp_path):
+    ledger = pd.DataFrame({"date": pd.to_datetime(["2024-01-05"]), "amount": [1.0],
+                           "description": ["x"], "category": ["Food"]})
+    path = str(tmp_path / "expenses_asha.dedup.npz")
+    index = importer.DedupIndex.from_frame(ledger)
+    index.add(importer.row_hashes(ledger.assign(description=["not in the ledger"])))
+    index.save(path, "v1")
+    assert importer.DedupIndex.load(path, ledger, "v2").rows == 1
+
+
+# ------------------------- direction column -------------------------
+def test_dr_cr_direction_column_drops_credit_rows():
+    rows, summary = run("Txn Date,Narration,Amount,Dr/Cr\n"
+                        "05/01/2024,Swiggy,120.50,Dr\n"
+                        "06/01/2024,Salary,50000,Cr\n"
+                        "07/01/2024,Uber,-40,DR.\n")
+    assert rows["description"].tolist() == ["Swiggy", "Uber"]
+    assert rows["amount"].tolist() == [120.5, 40.0]
+    assert summary["credits"] == 1
+    assert summary["date_format"] == "%d/%m/%Y"
+
+
+def test_direction_column_without_dr_cr_values_is_ignored():
+    rows, summary = run("Date,Description,Amount,Dr/Cr\n"
+                        "2024-01-05,Swiggy,120.50,Card\n"
+                        "2024-01-06,Metro,30,Cash\n")
+    assert rows["description"].tolist() == ["Swiggy", "Metro"]
+    assert summary["credits"] == 0
+
+
+def test_debit_credit_columns():
+    rows, summary = run("Date,Particulars,Withdrawal Amt.,Deposit Amt.,Amount\n"
+                        "2024-01-05,Swiggy,120.50,,9000\n"
+                        "2024-01-06,Salary,,50000,59000\n")
+    assert summary["layout"] == "debit/credit"
+    assert rows["amount"].tolist() == [120.5]
+    assert summary["credits"] == 1
+
+
+# ------------------------- saved layouts -------------------------
+HEADER = ["Posted", "Merchant", "Spent"]
+LAYOUT = {"name": "my bank", "fingerprint": importer.header_fingerprint(HEADER),
+          "columns": {"date": "posted", "description": "merchant", "amount": "spent"}, "date_format": "%d.%m.%Y"}
+
+
+def test_saved_layout_matches_its_exact_header(tmp_path):
+    layouts_file = str(tmp_path / importer.layouts_path("asha"))
+    importer.save_layout(LAYOUT, layouts_file)
+    rows, summary = run("Posted,Merchant,Spent\n05.01.2024,Swiggy,120.5\n", layouts_file=layouts_file)
+    assert summary["layout"] == "my bank"
+    assert rows["date"].tolist() == [pd.Timestamp("2024-01-05")]
+
+
+def test_saved_layout_ignores_a_different_header(tmp_path):
+    layouts_file = str(tmp_path / importer.layouts_path("asha"))
+    importer.save_layout(LAYOUT, layouts_file)
+    with pytest.raises(importer.ImportFormatError):
+        importer.detect_parser(HEADER + ["Balance"], layouts_file)
+    # header names are compared normalized (case, spacing)
+    assert importer.detect_parser([" posted", "MERCHANT", "spent "], layouts_file).name == "my bank"
+
+
+def test_layouts_are_kept_per_user(tmp_path):
+    importer.save_layout(LAYOUT, importer.layouts_path("asha"))
+    assert importer.layouts_path("asha") != importer.layouts_path("ravi")
+    with pytest.raises(importer.ImportFormatError):
+        importer.detect_parser(HEADER, importer.layouts_path("ravi"))
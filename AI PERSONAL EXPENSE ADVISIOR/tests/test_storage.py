@@ -0,0 +1,184 @@
+# test_storage.py
+import os
+
+import pandas as pd
+import pytest
+
+import storage
+
+EXPENSES = pd.DataFrame({
+    "date": ["2024-01-05", "2024-01-06", "2024-02-01"],
+    "amount": [120.5, 40.0, 999.99],
+    "description": ["Swiggy order", "Uber ride", "Electricity bill"],
+    "category": ["Food", "Transport", "Bills"],
+})
+INCOMES = pd.DataFrame({
+    "date": ["2024-01-01", "2024-02-01"],
+    "amount": [50000.0, 52000.0],
+    "source": ["Salary", "Salary"],
+    "id": [1, 2],
+})
+
+
+def canon(df):
+    """Backend-independent view of a ledger frame: plain strings / floats, no rowid column."""
+    df = storage.normalize_frame(df.drop(columns=storage.ROW_ID, errors="ignore").copy(),
+                                 "incomes" if "source" in df.columns else "expenses")
+    out = pd.DataFrame({"date": df["date"].dt.strftime("%Y-%m-%d"), "amount": df["amount"].astype(float)})
+    for c in df.columns.drop(["date", "amount"]):
+        out[c] = df[c].astype(str) if c != "id" else df[c].astype(int)
+    return out.reset_index(drop=True)
+
+
+# ------------------------- journal -------------------------
+def test_journal_replay_applies_records_in_order():
+    store = storage.JournalStore()
+    store.ensure_user("asha")
+    store.save("asha", "expenses", EXPENSES)
+    store.apply("asha", "expenses", {"op": "add", "rows": [
+        {"date": "2024-02-02", "amount": 15, "description": "Chai", "category": "Food"}]})
+    store.apply("asha", "expenses", {"op": "update", "row": 1, "fields": {"category": "Travel"}})
+    store.apply("asha", "expenses", {"op": "delete", "row": 0})
+
+    path = store.path("asha", "expenses")
+    assert len(storage.read_journal(path)) == 3
+    df = store.load("asha", "expenses")
+    assert df["description"].tolist() == ["Uber ride", "Electricity bill", "Chai"]
+    assert df["category"].tolist() == ["Travel", "Bills", "Food"]
+
+
+def test_compaction_folds_the_journal_into_the_snapshot():
+    store = storage.JournalStore()
+    store.ensure_user("asha")
+    store.save("asha", "expenses", EXPENSES)
+    store.apply("asha", "expenses", {"op": "update", "rows": [0, 2], "fields": {"category": "Shopping"}})
+    store.apply("asha", "memory", {"op": "set", "key": "swiggy", "value": "Food"})
+    before = canon(store.load("asha", "expenses"))
+
+    path = store.path("asha", "expenses")
+    assert storage.compact(path)
+    assert not os.path.exists(storage.journal_path(path))
+    assert not storage.compact(path)   # nothing left to fold
+    pd.testing.assert_frame_equal(canon(store.load("asha", "expenses")), before)
+
+    mem_path = store.path("asha", "memory")
+    assert storage.compact(mem_path)
+    assert store.load("asha", "memory") == {"swiggy": "Food"}
+
+
+def test_full_save_supersedes_the_journal():
+    store = storage.JournalStore()
+    store.ensure_user("asha")
+    store.apply("asha", "expenses", {"op": "add", "rows": EXPENSES.to_dict("records")})
+    store.save("asha", "expenses", EXPENSES.iloc[:1])
+    assert not os.path.exists(storage.journal_path(store.path("asha", "expenses")))
+    assert len(store.load("asha", "expenses")) == 1
+
+
+# ------------------------- sqlite rowids -------------------------
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = storage.SqliteStore(str(tmp_path / "ledgers.db"))
+    store.ensure_user("asha")
+    store.save("asha", "expenses", EXPENSES)
+    return store
+
+
+def test_sqlite_update_and_delete_by_rid(sqlite_store):
+    df = sqlite_store.load("asha", "expenses")
+    rids = df[storage.ROW_ID].tolist()
+    assert len(set(rids)) == 3
+
+    sqlite_store.apply("asha", "expenses", {"op": "update", "rids": [rids[2]], "fields": {"category": "Utilities"}})
+    sqlite_store.apply("asha", "expenses", {"op": "delete", "rid": rids[0]})
+
+    df = sqlite_store.load("asha", "expenses")
+    assert df[storage.ROW_ID].tolist() == rids[1:]
+    assert df["category"].tolist() == ["Transport", "Utilities"]
+
+
+def test_sqlite_rid_survives_a_stale_position(sqlite_store):
+    # another tab deleted row 0; this tab still names the electricity bill by its rid
+    rids = sqlite_store.load("asha", "expenses")[storage.ROW_ID].tolist()
+    sqlite_store.apply("asha", "expenses", {"op": "delete", "rid": rids[0]})
+    sqlite_store.apply("asha", "expenses", {"op": "update", "row": 2, "rids": [rids[2]],
+                                            "fields": {"category": "Rent"}})
+    df = sqlite_store.load("asha", "expenses")
+    assert df.set_index("description")["category"].to_dict() == {"Uber ride": "Transport", "Electricity bill": "Rent"}
+
+
+def test_sqlite_rid_is_scoped_to_the_user(sqlite_store):
+    sqlite_store.ensure_user("ravi")
+    sqlite_store.save("ravi", "expenses", EXPENSES.iloc[:1])
+    asha_rid = sqlite_store.load("asha", "expenses")[storage.ROW_ID].iloc[0]
+    sqlite_store.apply("ravi", "expenses", {"op": "delete", "rid": int(asha_rid)})
+    assert len(sqlite_store.load("asha", "expenses")) == 3
+    assert len(sqlite_store.load("ravi", "expenses")) == 1
+
+
+def test_sqlite_add_fills_in_rids(sqlite_store):
+    rows = [{"date": "2024-03-01", "amount": 10.0, "description": "Tea", "category": "Food"}]
+    sqlite_store.apply("asha", "expenses", {"op": "add", "rows": rows})
+    assert rows[0][storage.ROW_ID] == sqlite_store.load("asha", "expenses")[storage.ROW_ID].iloc[-1]
+
+
+# ------------------------- backends agree -------------------------
+BACKENDS = ["csv", "journal", "arrow", "sqlite"]
+
+
+def make_store(mode, tmp_path):
+    if mode == "arrow":
+        pytest.importorskip("pyarrow")
+        return storage.ArrowStore()
+    if mode == "sqlite":
+        return storage.SqliteStore(str(tmp_path / "ledgers.db"))
+    return storage.JournalStore() if mode == "journal" else storage.CsvStore()
+
+
+@pytest.mark.parametrize("mode", BACKENDS)
+def test_round_trip_matches_across_backends(mode, tmp_path):
+    store = make_store(mode, tmp_path)
+    store.ensure_user("asha")
+    store.save("asha", "expenses", EXPENSES)
+    store.save("asha", "incomes", INCOMES)
+    store.save("asha", "memory", {"swiggy": "Food"})
+    if not store.apply("asha", "expenses", {"op": "update", "row": 1, "rids": [2], "fields": {"category": "Travel"}}):
+        df = store.load("asha", "expenses").copy()
+        storage.set_values(df, 1, "category", "Travel")
+        store.save("asha", "expenses", df)
+
+    expected = EXPENSES.copy()
+    expected.loc[1, "category"] = "Travel"
+    pd.testing.assert_frame_equal(canon(store.load("asha", "expenses")), canon(expected))
+    pd.testing.assert_frame_equal(canon(store.load("asha", "incomes")), canon(INCOMES))
+    assert store.load("asha", "memory") == {"swiggy": "Food"}
+
+
+@pytest.mark.parametrize("mode", ["arrow", "sqlite"])
+def test_export_writes_the_ledger_back_as_csv(mode, tmp_path):
+    store = make_store(mode, tmp_path)
+    store.ensure_user("asha")
+    store.save("asha", "expenses", EXPENSES)
+    path = store.export_csv("asha", "expenses")
+    pd.testing.assert_frame_equal(canon(storage.CsvStore().load("asha", "expenses")), canon(EXPENSES))
+    assert path == storage.ledger_path("asha", "expenses")
+
+
+def test_arrow_refuses_a_newer_csv():
+    pytest.importorskip("pyarrow")
+    csv_store, arrow_store = storage.CsvStore(), storage.ArrowStore()
+    csv_store.ensure_user("asha")
+    csv_store.save("asha", "expenses", EXPENSES)
+    arrow_store.ensure_user("asha")   # converted on first sight
+
+    # the app then ran in journal mode: the CSV's journal is newer than the snapshot
+    csv_path = storage.ledger_path("asha", "expenses")
+    storage.append_record(csv_path, {"op": "delete", "row": 0})
+    stamp = os.stat(storage.journal_path(csv_path)).st_mtime_ns - 10**9
+    os.utime(arrow_store.path("asha", "expenses"), ns=(stamp, stamp))
+    with pytest.raises(storage.StaleLedgerError):
+        arrow_store.ensure_user("asha")
+
+    storage.convert_csv_to_arrow(csv_path)
+    arrow_store.ensure_user("asha")
+    assert len(arrow_store.load("asha", "expenses")) == 2